@@ -0,0 +1,241 @@
+'''Pipeline Metrics Module.
+
+Module used by the tutorial modules of Parts 2 and 3 to report timings and counts
+instead of printing on every ticker. Each pipeline stage, e.g. saving or loading
+historicals, is timed as a span, and the counters (rows and bytes read and
+written, requests and retries) that grow while a stage runs are attached to its
+span. Spans are sent to every enabled sink. Nothing is recorded until a sink is
+enabled, so with metrics disabled each instrumented call only checks an empty list.
+
+Example:
+  import metricsmodule
+  with metricsmodule.recording(metricsmodule.MemorySink()) as sink:
+    historicals = load_hdf5_historicals(tickers, filepath)
+  sink.summary()
+
+Functions:
+  enable(*sinks)
+    Starts sending spans to the sinks.
+
+  disable()
+    Stops sending spans to every sink.
+
+  enabled()
+    Returns True if any sink is enabled.
+
+  recording(*sinks)
+    Context manager that enables the sinks and disables them again on exit.
+
+  span(stage, **fields)
+    Context manager that times a stage and sends it to the sinks as a span.
+
+  timed_stage(stage)
+    Decorator that times every call of a function as a span of the stage.
+
+  count(name, amount=1)
+    Adds the amount to a counter.
+
+  count_file_bytes(name, filepath)
+    Adds the size of a file or of every file in a folder to a counter.
+
+  counters()
+    Returns a copy of every counter's total.
+
+Counters:
+  rows_read, rows_written
+    Rows of historicals loaded from and saved to disk.
+  bytes_read
+    Decoded bytes of the loaded hdf5 and parquet data, or file bytes of loaded csv files.
+  bytes_written
+    Bytes the saved historicals take on disk.
+  rows_downloaded
+    Rows of historicals downloaded from Yahoo Finance or IEX Cloud.
+  yf_requests, yf_retries, iex_requests, iex_retries
+    Requests made to Yahoo Finance and IEX Cloud, and how many of them were retries.
+  cache_hits, cache_misses, cache_evictions
+    Stage results loaded from, missing from and deleted from a cachemodule.StageCache.
+
+Sinks:
+  MemorySink()
+    Keeps every span in memory.
+
+  LogSink(logger=None, level=logging.INFO)
+    Logs every span with the logging module.
+
+  JsonFileSink(filepath)
+    Appends every span to a json lines file.
+'''
+
+import functools
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+_sinks = []
+_counters = Counter()
+_lock = threading.Lock()
+
+def enable(*sinks):
+  '''Starts sending spans to the sinks.'''
+  _sinks.extend(sinks)
+
+def disable():
+  '''Stops sending spans to every sink.'''
+  _sinks.clear()
+
+def enabled():
+  '''Returns True if any sink is enabled.'''
+  return bool(_sinks)
+
+@contextmanager
+def recording(*sinks):
+  '''Context manager that enables the sinks and disables them again on exit.
+
+  Yields the first sink, so a MemorySink can be read after the block.
+  '''
+  enable(*sinks)
+  try:
+    yield sinks[0] if sinks else None
+  finally:
+    for sink in sinks:
+      _sinks.remove(sink)
+
+def count(name, amount=1):
+  '''Adds the amount to a counter. Safe to call from download threads.'''
+  if _sinks:
+    with _lock:
+      _counters[name] += amount
+
+def count_file_bytes(name, filepath):
+  '''Adds the size of a file or of every file in a folder to a counter. The file system is only read while enabled.'''
+  if _sinks:
+    path = Path(filepath)
+    if path.is_dir():
+      count(name, sum(file.stat().st_size for file in path.rglob('*') if file.is_file()))
+    elif path.is_file():
+      count(name, path.stat().st_size)
+
+def counters():
+  '''Returns a copy of every counter's total.'''
+  with _lock:
+    return dict(_counters)
+
+def span(stage, **fields):
+  '''Context manager that times a stage and sends it to the sinks as a span.
+
+  The span holds the stage, its start time, its duration in seconds, how much each
+  counter grew while it ran (including growth from other threads), the name of the
+  exception it raised if any, and the extra fields.
+  '''
+  if not _sinks:
+    return _NO_SPAN
+  return _Span(stage, fields)
+
+def timed_stage(stage):
+  '''Decorator that times every call of a function as a span of the stage.'''
+  def decorator(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      if not _sinks:  # Skip building a span when metrics are disabled.
+        return function(*args, **kwargs)
+      with _Span(stage, {}):
+        return function(*args, **kwargs)
+    return wrapper
+  return decorator
+
+class _Span:
+  '''Times a stage and sends it to the sinks on exit.'''
+
+  def __init__(self, stage, fields):
+    self.stage = stage
+    self.fields = fields
+
+  def __enter__(self):
+    self._counters = counters()
+    self._wall_start = time.time()
+    self._start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    seconds = time.perf_counter() - self._start
+    counter_growth = {name: total - self._counters.get(name, 0) for name, total in counters().items()
+                      if total != self._counters.get(name, 0)}
+    event = {'stage': self.stage, 'start': self._wall_start, 'seconds': seconds, 'counters': counter_growth,
+             'error': exc_type.__name__ if exc_type is not None else None, **self.fields}
+    for sink in list(_sinks):
+      sink.emit(event)
+    return False
+
+class _NoSpan:
+  '''Span that does nothing, used while metrics are disabled.'''
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    return False
+
+_NO_SPAN = _NoSpan()
+
+class MemorySink:
+  '''Keeps every span in memory.'''
+
+  def __init__(self):
+    self.spans = []
+    self._lock = threading.Lock()
+
+  def emit(self, event):
+    with self._lock:
+      self.spans.append(event)
+
+  def summary(self):
+    '''Returns a dataframe with a row per stage of its calls, total seconds and total counter growth.'''
+    rows = dict()
+    for event in self.spans:
+      row = rows.setdefault(event['stage'], Counter())
+      row['calls'] += 1
+      row['seconds'] += event['seconds']
+      row.update(event['counters'])
+    summary = pd.DataFrame.from_dict(rows, orient='index').fillna(0)
+    summary.index.name = 'stage'
+    return summary
+
+class LogSink:
+  '''Logs every span with the logging module.
+
+  Args:
+    logger: logging.Logger to log to. Defaults to None, which uses the 'historicals' logger.
+    level: int logging level of the spans. Defaults to logging.INFO.
+  '''
+
+  def __init__(self, logger=None, level=logging.INFO):
+    self.logger = logger if logger is not None else logging.getLogger('historicals')
+    self.level = level
+
+  def emit(self, event):
+    counter_growth = ', '.join(f'{name}={value}' for name, value in event['counters'].items())
+    error = f' failed with {event["error"]}' if event['error'] else ''
+    self.logger.log(self.level, '%s took %.3fs%s%s', event['stage'], event['seconds'], error,
+                    f' ({counter_growth})' if counter_growth else '')
+
+class JsonFileSink:
+  '''Appends every span to a json lines file.
+
+  Args:
+    filepath: string of the json lines file to append to.
+  '''
+
+  def __init__(self, filepath):
+    self.filepath = filepath
+    self._lock = threading.Lock()
+
+  def emit(self, event):
+    line = json.dumps(event, default=str)
+    with self._lock, open(self.filepath, 'a', encoding='utf-8') as f:
+      f.write(line + '\n')
@@ -10,6 +10,21 @@ Functions:
   download_yf_tickers(tickers, start_date='2007-01-22', end_date='2022-01-19')
     Downloads specified ticker data from Yahoo Finance.
 
+  download_yf_tickers_concurrently(tickers, start_date='2007-01-22', end_date='2022-01-19', max_workers=8,
+                                   requests_per_second=2, max_retries=3, backoff=1.0, bulk_size=None, yf_backend=yf)
+    Downloads specified ticker data from Yahoo Finance with concurrent, rate limited requests.
+
+  TokenBucket(rate, capacity=None)
+    Token bucket rate limiter that can be shared between download threads.
+
+  iter_yf_tickers(tickers, start_date='2007-01-22', end_date='2022-01-19', max_workers=8,
+                  requests_per_second=2, max_retries=3, backoff=1.0, yf_backend=yf)
+    Yields each ticker's Yahoo Finance data as it is downloaded, keeping only a few tickers in memory.
+
+  stream_yf_tickers_to_hdf5(tickers, filepath, start_date='2007-01-22', end_date='2022-01-19', queue_size=16,
+                            coverage_batch_size=256, source='yf', **download_and_dataset_options)
+    Downloads, formats and saves each ticker as an hdf5 file with a background writer thread.
+
   log_availability_of_tickers_to_json(tickers, filepath, status)
     Saves which tickers were or were not avaliable on yahoo finance as a json file.
 
@@ -19,29 +34,99 @@ Functions:
   format_historicals_to_save_as_hdf5(historicals)
     Formats historicals to safely save as hdf5 files.
 
-  save_historicals_to_csv(historicals, filepath)
+  save_historicals_to_csv(historicals, filepath, source='yf', engine='pandas', max_workers=None)
     Save historicals as csv files.
 
-  save_historicals_to_hdf5(historicals, filepath)
+  save_historicals_to_hdf5(historicals, filepath, source='yf', compression='gzip', compression_opts=None,
+                           shuffle=False, layout='rows', chunk_rows=None, schema='float64')
     Saves historicals as hdf5 files.
 
+  append_historicals_to_hdf5(historicals, filepath, source='yf', **dataset_options)
+    Appends only the new dates of the historicals to their saved hdf5 files.
+
+  get_last_stored_dates(tickers, filepath)
+    Gets each ticker's last stored date without decoding its full hdf5 dataset.
+
+  refresh_hdf5_historicals(tickers, filepath, end_date=None, default_start_date='2007-01-22', **download_kwargs)
+    Downloads and appends only the dates after each ticker's last stored date.
+
   check_if_tickers_were_saved_successfully(tickers, filepath, save_type='hdf5')
     Checks if the tickers were saved successfully as their specified save type.
 
-  load_csv_historicals(tickers, filepath)
+  load_csv_historicals(tickers, filepath, engine='pandas', parse_dates=False, max_workers=None)
     Load csv historicals to memory.
 
-  load_hdf5_historicals(tickers, filepath)
+  load_hdf5_historicals(tickers, filepath, start=None, end=None, columns=None)
     Load hdf5 historicals to memory.
+
+  load_hdf5_historicals_in_parallel(tickers, filepath, start=None, end=None, columns=None, max_workers=None)
+    Load hdf5 historicals to memory with a pool of processes decoding the files.
+
+  LazyHistoricals(tickers, filepath, cache_size=64, start=None, end=None, columns=None)
+    Dict-like historicals that only load a ticker's hdf5 file when it is accessed.
+
+  save_historicals_to_hdf5_store(historicals, filepath, store_name='historicals_store', source='yf')
+    Saves all historicals to a single consolidated hdf5 store.
+
+  consolidate_hdf5_historicals_into_store(tickers, filepath, store_name='historicals_store', source='yf')
+    Consolidates per ticker hdf5 files into a single hdf5 store.
+
+  load_hdf5_store_historicals(tickers, filepath, store_name='historicals_store')
+    Load historicals from a consolidated hdf5 store to memory.
+
+  save_historicals_to_parquet(historicals, filepath, dataset_name='historicals_parquet', row_group_size=16384, source='yf')
+    Saves all historicals to a year partitioned parquet dataset in long format.
+
+  load_parquet_historicals(tickers, filepath, dataset_name='historicals_parquet', start=None, end=None, columns=None)
+    Load historicals from a parquet dataset, only reading the requested tickers, dates and columns.
+
+  HistoricalsPanel(tickers, dates, fields, values, mask)
+    Aligned tickers x trading days x fields panel of historicals with a presence mask.
+
+  update_coverage_index(historicals, filepath, source='yf', replace=False)
+    Marks the dates of the historicals in the coverage index saved next to them.
+
+  query_missing_dates(filepath, tickers=None, start=None, end=None)
+    Gets each ticker's missing dates from the coverage index without loading any prices.
+
+  query_coverage_report(filepath, tickers=None)
+    Reports each ticker's avaliable dates per source from the coverage index.
+
+  collect_tickers_with_missing_dates(filepath, start=None, end=None)
+    Collects the tickers that have missing dates according to the coverage index.
 '''
 
 import yfinance as yf  # You will need to run %pip install yfinance in your main.
+import numpy as np
 import pandas as pd
+import datetime as dt
 import h5py
+try:
+  import pyarrow as pa  # Only needed for the parquet backend and the pyarrow csv engine, run %pip install pyarrow in your main to use them.
+  import pyarrow.csv as pacsv
+  import pyarrow.dataset as pads
+except ImportError:
+  pa = None
+
+try:
+  from . import cachemodule, metricsmodule  # Imported from the p2modules folder.
+except ImportError:
+  import cachemodule
+  import metricsmodule
 
 from pathlib import Path
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+import threading
+import queue
+import time
 import json
+import os
+import shutil
 
+@metricsmodule.timed_stage('download_yf')
 def download_yf_tickers(tickers, start_date='2007-01-22', end_date='2022-01-19'):
   '''Downloads specified ticker data from Yahoo Finance.
 
@@ -70,14 +155,315 @@ def download_yf_tickers(tickers, start_date='2007-01-22', end_date='2022-01-19')
   for ticker in tickers:
     ticker_ref = yf.Ticker(ticker)
     ticker_history = ticker_ref.history(start_date=start_date, end_date=end_date, auto_adjust=True)  # Set auto_adjust=True to get the adjusted OHLC data.
+    metricsmodule.count('yf_requests')
 
     if ticker_history.empty:  # Returns an empty DataFrame if the tickers Yahoo Finance history does not exist.
       tickers_not_avaliable_on_yf.append(ticker)
     else: 
       historicals[ticker] = ticker_history
       tickers_avaliable_on_yf.append(ticker)
+      metricsmodule.count('rows_downloaded', len(ticker_history))
   return (historicals, tickers_avaliable_on_yf, tickers_not_avaliable_on_yf)
 
+class TokenBucket:
+  '''Token bucket rate limiter that can be shared between download threads.
+
+  Tokens refill continuously at the given rate up to the bucket's capacity.
+  Each request takes one token and waits for a refill if the bucket is empty,
+  which allows short bursts while keeping the average request rate bounded.
+
+  Args:
+    rate: float of how many requests are allowed per second.
+    capacity: int of the largest burst of requests allowed. Defaults to the rate
+              rounded up to at least one request.
+  '''
+
+  def __init__(self, rate, capacity=None):
+    self.rate = rate
+    self.capacity = capacity if capacity is not None else max(1, rate)
+    self._tokens = self.capacity
+    self._last_refill = time.monotonic()
+    self._lock = threading.Lock()
+
+  def acquire(self):
+    '''Blocks until a token is avaliable and takes it.'''
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+        wait = (1 - self._tokens) / self.rate
+      time.sleep(wait)  # Sleep outside of the lock so other threads can refill and check the bucket.
+
+@metricsmodule.timed_stage('download_yf')
+def download_yf_tickers_concurrently(tickers, start_date='2007-01-22', end_date='2022-01-19', max_workers=8,
+                                     requests_per_second=2, max_retries=3, backoff=1.0, bulk_size=None, yf_backend=yf):
+  '''Downloads specified ticker data from Yahoo Finance with concurrent, rate limited requests.
+
+  Works the same as download_yf_tickers(tickers, start_date, end_date) but keeps
+  several requests in flight at once. All workers share a token bucket so the
+  combined request rate stays under requests_per_second, and every request is
+  retried with exponential backoff before the ticker is logged as not avaliable.
+  If bulk_size is given, tickers are requested in multi-symbol batches with
+  yf.download and a batch that keeps failing falls back to single ticker requests.
+  With metrics enabled, every ticker or batch is timed as a 'download_yf_ticker'
+  or 'download_yf_batch' span that includes its rate limiter waits and retries.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    start_date: str with format as 'year-month-day'. Defaults '2007-01-22'.
+    end_date: str with format as 'year-month-day'. Defaults '2022-01-19'.
+    max_workers: int of how many requests can be in flight at once. Defaults 8.
+    requests_per_second: float of the maximum combined request rate. Use None
+                         to disable rate limiting. Defaults 2.
+    max_retries: int of how many times a failed request is retried. Defaults 3.
+    backoff: float of seconds to wait before the first retry. The wait doubles
+             after every failed retry. Defaults 1.0.
+    bulk_size: int of how many tickers to request in each multi-symbol batch.
+               Defaults to None, which requests one ticker at a time.
+    yf_backend: module or object that provides the yfinance Ticker and download
+                interface. Replace it with a local fake backend for testing.
+                Defaults to the yfinance module.
+
+  Returns:
+    historicals: dict with tickers as keys and the adjusted OHLCV data as values.
+                 Each OHLCV data is given as a pandas dataframe.
+    tickers_avaliable_on_yf: list of tickers that were avaliable on yahooo finance.
+    tickers_not_avaliable_on_yf: list of tickers that were not avaliable on yahoo finance.
+  '''
+
+  rate_limiter = TokenBucket(requests_per_second) if requests_per_second else None
+
+  def download_ticker(ticker):
+    ticker_history = _download_yf_ticker(ticker, start_date, end_date, rate_limiter, max_retries, backoff, yf_backend)
+    return {ticker: ticker_history} if ticker_history is not None else {}
+
+  def download_batch(ticker_batch):
+    try:
+      with metricsmodule.span('download_yf_batch', tickers=len(ticker_batch)):
+        batch_history = _call_with_retries(lambda: yf_backend.download(ticker_batch,
+                                                                        start=start_date,
+                                                                        end=end_date,
+                                                                        auto_adjust=True,
+                                                                        actions=True,  # Keep Dividends and Stock Splits like Ticker.history.
+                                                                        group_by='ticker',
+                                                                        threads=False,
+                                                                        progress=False),
+                                           rate_limiter, max_retries, backoff)
+    except Exception as e:
+      print(f'Batch {ticker_batch[0]}-{ticker_batch[-1]} failed, falling back to single ticker requests: {e}')
+      batch_historicals = dict()
+      for ticker in ticker_batch:
+        batch_historicals.update(download_ticker(ticker))
+      return batch_historicals
+    return _split_yf_bulk_history(batch_history, ticker_batch)
+
+  if bulk_size:
+    download_requests = [tickers[i:i+bulk_size] for i in range(0, len(tickers), bulk_size)]
+    download_request = download_batch
+  else:
+    download_requests = tickers
+    download_request = download_ticker
+
+  downloaded = dict()
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    for request_historicals in executor.map(download_request, download_requests):
+      downloaded.update(request_historicals)
+
+  historicals = dict()
+  tickers_avaliable_on_yf = []
+  tickers_not_avaliable_on_yf = []
+
+  for ticker in tickers:  # Keep the same ticker order as download_yf_tickers.
+    ticker_history = downloaded.get(ticker)
+    if ticker_history is None or ticker_history.empty:
+      tickers_not_avaliable_on_yf.append(ticker)
+    else:
+      historicals[ticker] = ticker_history
+      tickers_avaliable_on_yf.append(ticker)
+      metricsmodule.count('rows_downloaded', len(ticker_history))
+  return (historicals, tickers_avaliable_on_yf, tickers_not_avaliable_on_yf)
+
+def iter_yf_tickers(tickers, start_date='2007-01-22', end_date='2022-01-19', max_workers=8,
+                    requests_per_second=2, max_retries=3, backoff=1.0, yf_backend=yf):
+  '''Yields each ticker's Yahoo Finance data as it is downloaded, keeping only a few tickers in memory.
+
+  Works like download_yf_tickers_concurrently(tickers, ...) with single ticker
+  requests, but instead of collecting every ticker in one dict it yields them in
+  ticker order while at most max_workers further tickers are being downloaded.
+  Memory therefore depends on max_workers rather than on the amount of tickers.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    start_date: str with format as 'year-month-day'. Defaults '2007-01-22'.
+    end_date: str with format as 'year-month-day'. Defaults '2022-01-19'.
+    max_workers: int of how many requests can be in flight at once. Defaults 8.
+    requests_per_second: float of the maximum combined request rate. Use None
+                         to disable rate limiting. Defaults 2.
+    max_retries: int of how many times a failed request is retried. Defaults 3.
+    backoff: float of seconds to wait before the first retry. Defaults 1.0.
+    yf_backend: module or object that provides the yfinance Ticker interface. Defaults to the yfinance module.
+
+  Yields:
+    ticker: string of the ticker.
+    ticker_history: pandas dataframe of the adjusted OHLCV data, or None if the
+                    ticker was not avaliable on yahoo finance.
+  '''
+
+  rate_limiter = TokenBucket(requests_per_second) if requests_per_second else None
+  in_flight = deque()
+
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    try:
+      for ticker in tickers:
+        in_flight.append((ticker, executor.submit(_download_yf_ticker, ticker, start_date, end_date,
+                                                  rate_limiter, max_retries, backoff, yf_backend)))
+        if len(in_flight) > max_workers:  # Only start a new download once the oldest one has been handed over.
+          yield _collect_yf_ticker(*in_flight.popleft())
+      while in_flight:
+        yield _collect_yf_ticker(*in_flight.popleft())
+    finally:
+      for _, future in in_flight:  # Stop queued downloads if the consumer stops early.
+        future.cancel()
+
+def _download_yf_ticker(ticker, start_date, end_date, rate_limiter, max_retries, backoff, yf_backend):
+  '''Downloads a ticker with retries and returns its history, or None if every attempt failed.'''
+  with metricsmodule.span('download_yf_ticker', ticker=ticker):  # Includes the rate limiter waits, retries and backoff.
+    try:
+      return _call_with_retries(lambda: yf_backend.Ticker(ticker).history(start=start_date,
+                                                                           end=end_date,
+                                                                           auto_adjust=True),
+                                rate_limiter, max_retries, backoff)
+    except Exception as e:
+      print(f'Could not download {ticker} after {max_retries} retries: {e}')
+      return None
+
+def _collect_yf_ticker(ticker, future):
+  '''Waits for a ticker's download and returns the ticker and its history, or None if it was not avaliable.'''
+  ticker_history = future.result()
+  if ticker_history is None or ticker_history.empty:
+    return ticker, None
+  metricsmodule.count('rows_downloaded', len(ticker_history))
+  return ticker, ticker_history
+
+@metricsmodule.timed_stage('stream_yf_to_hdf5')
+def stream_yf_tickers_to_hdf5(tickers, filepath, start_date='2007-01-22', end_date='2022-01-19', queue_size=16,
+                              coverage_batch_size=256, source='yf', **download_and_dataset_options):
+  '''Downloads, formats and saves each ticker as an hdf5 file with a background writer thread.
+
+  Gives the same files as download_yf_tickers_concurrently, then
+  format_historicals_to_save_as_hdf5 and save_historicals_to_hdf5, but never
+  holds the whole universe in memory. Tickers flow from iter_yf_tickers through
+  the hdf5 formatting into a queue of at most queue_size tickers, and a writer
+  thread compresses and saves them while the next tickers are downloading. If
+  the writer falls behind, downloading waits for room in the queue, so memory
+  stays flat however many tickers there are. Each file is complete as soon as it
+  is written, and the coverage index is updated every coverage_batch_size tickers.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    filepath: string of where to save the historicals.
+    start_date: str with format as 'year-month-day'. Defaults '2007-01-22'.
+    end_date: str with format as 'year-month-day'. Defaults '2022-01-19'.
+    queue_size: int of how many formatted tickers can wait for the writer. Defaults 16.
+    coverage_batch_size: int of how many saved tickers are recorded in the coverage index at once. Defaults 256.
+    source: string name of where the historicals came from, recorded in the coverage index. Defaults 'yf'.
+    **download_and_dataset_options: keyword arguments passed on to iter_yf_tickers
+                                    (max_workers, requests_per_second, max_retries, backoff, yf_backend)
+                                    or to save_historicals_to_hdf5 (compression, compression_opts,
+                                    shuffle, layout, chunk_rows, schema).
+
+  Returns:
+    tickers_avaliable_on_yf: list of tickers that were avaliable on yahooo finance.
+    tickers_not_avaliable_on_yf: list of tickers that were not avaliable on yahoo finance.
+  '''
+
+  download_options = {option: download_and_dataset_options.pop(option)
+                      for option in ['max_workers', 'requests_per_second', 'max_retries', 'backoff', 'yf_backend']
+                      if option in download_and_dataset_options}
+  dataset_options = download_and_dataset_options
+
+  formatted_queue = queue.Queue(maxsize=queue_size)
+  writer_errors = []
+
+  def write_tickers():
+    saved_dates = dict()  # Only the dates are kept until they are recorded in the coverage index.
+    queue_finished = False
+    try:
+      while (item := formatted_queue.get()) is not None:
+        ticker, hdf5_historical = item
+        hdf5_filepath = f'{filepath}/{ticker}.hdf5'
+        with h5py.File(hdf5_filepath, 'w') as f:
+          history = f.create_group('historicals')
+          _create_historicals_dataset(history, hdf5_historical, **dataset_options)
+        metricsmodule.count('rows_written', len(hdf5_historical))
+        metricsmodule.count_file_bytes('bytes_written', hdf5_filepath)
+        saved_dates[ticker] = hdf5_historical[['Date']]
+        if len(saved_dates) >= coverage_batch_size:
+          update_coverage_index(saved_dates, filepath, source, replace=True)
+          saved_dates.clear()
+      queue_finished = True
+      update_coverage_index(saved_dates, filepath, source, replace=True)
+    except BaseException as e:
+      writer_errors.append(e)
+      if not queue_finished:  # Keep draining so the downloads are not blocked forever.
+        while formatted_queue.get() is not None:
+          pass
+
+  writer = threading.Thread(target=write_tickers, name='hdf5-writer', daemon=True)
+  writer.start()
+
+  tickers_avaliable_on_yf = []
+  tickers_not_avaliable_on_yf = []
+  try:
+    for ticker, ticker_history in iter_yf_tickers(tickers, start_date, end_date, **download_options):
+      if ticker_history is None:
+        tickers_not_avaliable_on_yf.append(ticker)
+        continue
+      formatted_queue.put((ticker, _format_historical_for_hdf5(ticker_history)))  # Blocks while the queue is full.
+      tickers_avaliable_on_yf.append(ticker)
+      if writer_errors:
+        break
+  finally:
+    formatted_queue.put(None)
+    writer.join()
+
+  if writer_errors:
+    raise writer_errors[0]
+  print('All Tickers Have Been Saved')
+  return (tickers_avaliable_on_yf, tickers_not_avaliable_on_yf)
+
+def _call_with_retries(request, rate_limiter, max_retries, backoff):
+  '''Calls the request and retries it with exponential backoff if it raises.'''
+  for attempt in range(max_retries + 1):
+    if rate_limiter is not None:
+      rate_limiter.acquire()
+    metricsmodule.count('yf_requests')
+    try:
+      return request()
+    except Exception:
+      if attempt == max_retries:
+        raise
+      metricsmodule.count('yf_retries')
+      time.sleep(backoff * 2 ** attempt)
+
+def _split_yf_bulk_history(batch_history, ticker_batch):
+  '''Splits a multi-symbol yf.download dataframe into a dataframe per ticker.'''
+  if batch_history.empty:  # None of the batch's tickers were avaliable.
+    return dict()
+  if not isinstance(batch_history.columns, pd.MultiIndex):  # A single ticker batch may come back with flat columns.
+    return {ticker_batch[0]: batch_history.dropna(subset=['Close'])}
+
+  batch_historicals = dict()
+  downloaded_tickers = set(batch_history.columns.get_level_values(0))
+  for ticker in ticker_batch:
+    if ticker in downloaded_tickers:
+      batch_historicals[ticker] = batch_history[ticker].dropna(subset=['Close'])  # Rows before a ticker's listing have no prices.
+  return batch_historicals
+
 def log_availability_of_tickers_to_json(tickers, filepath, status):
   '''Saves which tickers were or were not avaliable on yahoo finance as a json file.
 
@@ -111,6 +497,7 @@ def log_availability_of_tickers_to_json(tickers, filepath, status):
   print(f'{status} tickers have been logged to {status} tickers list')
   return
 
+@metricsmodule.timed_stage('format_csv')
 def format_historicals_to_save_as_csv(historicals):
   '''Formats historicals to safely save as csv files.
 
@@ -130,6 +517,7 @@ def format_historicals_to_save_as_csv(historicals):
   print('Finished formatting historicals as csv format')
   return csv_historicals
 
+@metricsmodule.timed_stage('format_hdf5')
 def format_historicals_to_save_as_hdf5(historicals):
   '''Formats historicals to safely save as hdf5 files.
 
@@ -144,33 +532,373 @@ def format_historicals_to_save_as_hdf5(historicals):
   hdf5_historicals = {}
 
   for ticker in historicals:
-    hdf5_historicals[ticker] = historicals[ticker].drop(['Dividends', 'Stock Splits'], axis='columns')
-    hdf5_historicals[ticker] = hdf5_historicals[ticker].reset_index()
-    hdf5_historicals[ticker]['Date'] = hdf5_historicals[ticker]['Date'].apply(lambda x: x.timestamp())
+    hdf5_historicals[ticker] = _format_historical_for_hdf5(historicals[ticker])
   print('Finished formatting historicals as hdf5 format')
   return hdf5_historicals
 
-def save_historicals_to_csv(historicals, filepath):
-  '''Save historicals as csv files.'''
-  for ticker in historicals:
+def _format_historical_for_hdf5(historical):
+  '''Formats a ticker's historical to save as an hdf5 file.'''
+  hdf5_historical = historical.drop(['Dividends', 'Stock Splits'], axis='columns')
+  hdf5_historical = hdf5_historical.reset_index()
+  hdf5_historical['Date'] = hdf5_historical['Date'].apply(lambda x: x.timestamp())
+  return hdf5_historical
+
+@metricsmodule.timed_stage('save_csv')
+def save_historicals_to_csv(historicals, filepath, source='yf', engine='pandas', max_workers=None):
+  '''Save historicals as csv files.
+
+  Time zone aware dates are formatted to text for the whole column at once,
+  which gives the same text as pandas but skips its slow per row formatting.
+  Files are written by a pool of threads. engine='pyarrow' writes with pyarrow's
+  multithreaded csv writer, which is several times faster again. Its files hold
+  the same values but write whole numbers without '.0' (e.g. a Volume of 1695921)
+  and the index column header as "", which load_csv_historicals reads back the same.
+  The saved dates are recorded for the source in the folder's coverage index,
+  see update_coverage_index(historicals, filepath, source).
+
+  Args:
+    historicals: dict with tickers as keys and csv formatted OHLC data as values.
+                 See format_historicals_to_save_as_csv(historicals).
+    filepath: string of where to save the historicals.
+    source: string name of where the historicals came from, recorded in the
+            coverage index. Defaults 'yf'.
+    engine: string of the csv writer. Options are {'pandas', 'pyarrow'}, and 'c' is
+            accepted for 'pandas' like load_csv_historicals. Defaults to 'pandas'.
+    max_workers: int of how many files are written at once. Defaults to None, which uses every core.
+
+  Returns:
+    None
+  '''
+
+  assert engine in _CSV_ENGINES, 'Engine must be "pandas" or "pyarrow"'
+  engine = _CSV_ENGINES[engine]
+  if engine == 'pyarrow':
+    _check_pyarrow_is_installed('pyarrow csv engine')
+
+  def save_ticker(ticker):
     csv_filepath = f'{filepath}/{ticker}.csv'
-    historicals[ticker].to_csv(csv_filepath)
-    print(f'Ticker {ticker} Saved as CSV')
+    historical = historicals[ticker]
+    if 'Date' in historical.columns and isinstance(historical['Date'].dtype, pd.DatetimeTZDtype):
+      historical = historical.assign(Date=_format_csv_dates(historical['Date']))
+    if engine == 'pyarrow':
+      table = pa.Table.from_pandas(historical.rename_axis('').reset_index(), preserve_index=False)
+      pacsv.write_csv(table, csv_filepath, pacsv.WriteOptions(quoting_style='none'))
+    else:
+      historical.to_csv(csv_filepath)
+    metricsmodule.count('rows_written', len(historical))
+    metricsmodule.count_file_bytes('bytes_written', csv_filepath)
+
+  with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+    list(executor.map(save_ticker, historicals))  # Raise the first error of any thread.
+  update_coverage_index(historicals, filepath, source, replace=True)
   print('All Tickers Have Been Saved')
 
-def save_historicals_to_hdf5(historicals, filepath):
-  '''Saves historicals as hdf5 files.'''
+def _format_csv_dates(dates):
+  '''Formats time zone aware dates like pandas writes them to csv, e.g. '2007-01-22 00:00:00-05:00', for the whole column at once.'''
+  local_dates = dates.dt.tz_localize(None)
+  local_seconds = local_dates.to_numpy().astype('datetime64[s]')
+  if (local_dates.to_numpy() != local_seconds).any():  # Pandas also writes fractions of a second, let it format those.
+    return dates
+  utc_offsets = (local_dates - dates.dt.tz_convert('UTC').dt.tz_localize(None)).to_numpy() // np.timedelta64(1, 'm')
+  unique_offsets, offset_codes = np.unique(utc_offsets.astype(np.int64), return_inverse=True)
+  offset_texts = np.array([f'{"+" if offset >= 0 else "-"}{abs(offset) // 60:02d}:{abs(offset) % 60:02d}'
+                           for offset in unique_offsets], dtype=object)
+  date_texts = np.char.replace(np.datetime_as_string(local_seconds, unit='s'), 'T', ' ').astype(object)
+  return pd.Series(date_texts + offset_texts[offset_codes], index=dates.index, name=dates.name)
+
+@metricsmodule.timed_stage('save_hdf5')
+def save_historicals_to_hdf5(historicals, filepath, source='yf', compression='gzip', compression_opts=None,
+                             shuffle=False, layout='rows', chunk_rows=None, schema='float64'):
+  '''Saves historicals as hdf5 files.
+
+  The '15Y' dataset always has the (rows, 6) shape, so every loader reads it the
+  same way whatever the storage options are. layout='columns' stores each column
+  in its own chunks, so reading only the 'Close' column decompresses a sixth of
+  the file. lzf and the shuffle filter usually decode much faster than gzip.
+  Run benchmarks/bench_hdf5_codecs.py to compare the options on your files.
+
+  schema='compact' instead saves a 1-D compound dataset of int64 nanosecond
+  Date, float32 Open, High, Low and Close and uint64 Volume rows, which takes
+  32 bytes per row instead of 48. Prices keep about 7 significant digits, with
+  a relative error of at most 2**-24, while dates and whole share volumes are
+  kept exactly (see tests/test_compact_schema.py). The loaders return these dtypes
+  as they are, without upcasting back to float64.
+  The saved dates are recorded for the source in the folder's coverage index,
+  see update_coverage_index(historicals, filepath, source).
+
+  Args:
+    historicals: dict with tickers as keys and hdf5 formatted OHLC data as values.
+                 See format_historicals_to_save_as_hdf5(historicals).
+    filepath: string of where to save the historicals.
+    source: string name of where the historicals came from, recorded in the
+            coverage index. Defaults 'yf'.
+    compression: string of the hdf5 compression filter. Options are {'gzip', 'lzf', None}.
+                 Defaults to 'gzip'.
+    compression_opts: int gzip level from 0 to 9. Defaults to None, which is level 4.
+    shuffle: bool. If True the bytes are shuffled before compressing. Defaults False.
+    layout: string of how the dataset is chunked. Options are {'rows', 'columns'}.
+            Defaults to 'rows'.
+    chunk_rows: int amount of rows per chunk. Defaults to None, which lets h5py pick
+                the chunk shape for the 'rows' layout and uses 4096 rows for 'columns'.
+    schema: string of the dataset's dtypes. Options are {'float64', 'compact'}.
+            The 'compact' schema only supports the 'rows' layout. Defaults to 'float64'.
+
+  Returns:
+    None
+  '''
+
+  dataset_options = dict(compression=compression, compression_opts=compression_opts,
+                         shuffle=shuffle, layout=layout, chunk_rows=chunk_rows, schema=schema)
   for ticker in historicals:
     hdf5_filepath = f'{filepath}/{ticker}.hdf5'
     with h5py.File(hdf5_filepath, 'w') as f:
       history = f.create_group('historicals')
-      history.create_dataset(name='15Y',
-                             data=historicals[ticker],
-                             maxshape=(None, 6),  # Specify a maxshape of None in the row axis so future dates can be added on the rows.
-                             compression='gzip')
-    print(f'Saved {ticker} as HDF5')
+      _create_historicals_dataset(history, historicals[ticker], **dataset_options)
+    metricsmodule.count('rows_written', len(historicals[ticker]))
+    metricsmodule.count_file_bytes('bytes_written', hdf5_filepath)
+  update_coverage_index(historicals, filepath, source, replace=True)
   print('All Tickers Have Been Saved')
 
+def _create_historicals_dataset(history, data, compression='gzip', compression_opts=None,
+                                shuffle=False, layout='rows', chunk_rows=None, schema='float64'):
+  '''Creates the resizable '15Y' dataset in the historicals group.'''
+  assert layout in ['rows', 'columns'], 'Layout must be "rows" or "columns"'
+  assert schema in ['float64', 'compact'], 'Schema must be "float64" or "compact"'
+  assert schema == 'float64' or layout == 'rows', 'The compact schema only supports the "rows" layout'
+  chunks = True
+  maxshape = (None, 6)  # Specify a maxshape of None in the row axis so future dates can be added on the rows.
+  if schema == 'compact':
+    data = _to_compact_rows(data)
+    maxshape = (None,)
+    if chunk_rows is not None:
+      chunks = (chunk_rows,)
+  elif layout == 'columns':
+    chunks = (chunk_rows or 4096, 1)
+  elif chunk_rows is not None:
+    chunks = (chunk_rows, 6)
+  return history.create_dataset(name='15Y',
+                                data=data,
+                                maxshape=maxshape,
+                                chunks=chunks,
+                                compression=compression,
+                                compression_opts=compression_opts,
+                                shuffle=shuffle)
+
+def _dataset_options(dataset):
+  '''Returns the storage options of a saved '15Y' dataset, so a rewrite keeps them.'''
+  compact = dataset.dtype.names is not None
+  chunk_rows = dataset.chunks[0] if dataset.chunks else None
+  column_chunks = not compact and dataset.chunks is not None and dataset.chunks[1] == 1
+  return dict(compression=dataset.compression, compression_opts=dataset.compression_opts, shuffle=dataset.shuffle,
+              layout='columns' if column_chunks else 'rows', chunk_rows=chunk_rows,
+              schema='compact' if compact else 'float64')
+
+_COMPACT_DTYPE = np.dtype([('Date', '<i8'), ('Open', '<f4'), ('High', '<f4'), ('Low', '<f4'), ('Close', '<f4'), ('Volume', '<u8')])
+
+def _to_compact_rows(data):
+  '''Converts hdf5 formatted [timestamp, Open, High, Low, Close, Volume] rows to compact schema rows.'''
+  if isinstance(data, np.ndarray) and data.dtype.names is not None:
+    return data.astype(_COMPACT_DTYPE, copy=False)
+  rows = np.asarray(data, dtype=np.float64).reshape(-1, 6)
+  compact_rows = np.empty(len(rows), dtype=_COMPACT_DTYPE)
+  compact_rows['Date'] = np.round(rows[:, 0] * 10**9).astype(np.int64)
+  for i, column in enumerate(['Open', 'High', 'Low', 'Close'], start=1):
+    compact_rows[column] = rows[:, i]
+  compact_rows['Volume'] = np.round(np.nan_to_num(rows[:, 5])).astype(np.uint64)  # A missing volume is saved as 0.
+  return compact_rows
+
+def _from_compact_rows(compact_rows):
+  '''Converts compact schema rows back to hdf5 formatted [timestamp, Open, High, Low, Close, Volume] float64 rows.'''
+  rows = np.empty((len(compact_rows), 6), dtype=np.float64)
+  rows[:, 0] = compact_rows['Date'] / 10**9
+  for i, column in enumerate(['Open', 'High', 'Low', 'Close', 'Volume'], start=1):
+    rows[:, i] = compact_rows[column]
+  return rows
+
+@metricsmodule.timed_stage('append_hdf5')
+def append_historicals_to_hdf5(historicals, filepath, source='yf', **dataset_options):
+  '''Appends only the new dates of the historicals to their saved hdf5 files.
+
+  The '15Y' dataset is resized in place and only rows dated after the last
+  stored date are written, so a daily update costs the new rows instead of
+  rewriting and recompressing the whole history. Tickers without a saved hdf5
+  file are saved as a new file. Files saved with a fixed row axis are rewritten
+  once with a resizable row axis the first time they are appended to, keeping
+  their compression.
+
+  Args:
+    historicals: dict with tickers as keys and hdf5 formatted OHLC data as values.
+                 See format_historicals_to_save_as_hdf5(historicals).
+    filepath: string of where the historicals are saved.
+    source: string name of where the historicals came from, recorded in the
+            coverage index. Defaults 'yf'.
+    **dataset_options: storage options for tickers without a saved file, see
+                       save_historicals_to_hdf5(historicals, filepath).
+
+  Returns:
+    rows_appended: dict with tickers as keys and the amount of appended rows as values.
+  '''
+
+  rows_appended = dict()
+  appended_historicals = dict()
+
+  for ticker in historicals:
+    hdf5_filepath = f'{filepath}/{ticker}.hdf5'
+    new_data = np.asarray(historicals[ticker], dtype=np.float64)
+    new_data = new_data[np.argsort(new_data[:, 0], kind='stable')]
+
+    with h5py.File(hdf5_filepath, 'a') as f:
+      if 'historicals' not in f:
+        _create_historicals_dataset(f.create_group('historicals'), new_data, **dataset_options)
+        rows_appended[ticker] = len(new_data)
+        appended_historicals[ticker] = new_data
+        continue
+
+      history = f['historicals']
+      dataset = history['15Y']
+      compact = dataset.dtype.names is not None
+      stored_rows = dataset.shape[0]
+      if stored_rows:
+        last_date = dataset[stored_rows - 1]  # Only the last row's chunk is read, not the whole history.
+        last_date = last_date['Date'] / 10**9 if compact else last_date[0]
+        new_data = new_data[new_data[:, 0] > last_date]
+      rows_appended[ticker] = len(new_data)
+      if not len(new_data):
+        continue
+
+      if dataset.maxshape[0] is not None:  # Older files can not grow, so rewrite them once as resizable.
+        stored_data, stored_options = dataset[()], _dataset_options(dataset)
+        del history['15Y']
+        dataset = _create_historicals_dataset(history, stored_data, **stored_options)
+      dataset.resize(stored_rows + len(new_data), axis=0)
+      dataset[stored_rows:] = _to_compact_rows(new_data) if compact else new_data
+      appended_historicals[ticker] = new_data
+  update_coverage_index(appended_historicals, filepath, source)
+  metricsmodule.count('rows_written', sum(rows_appended.values()))
+  print('All Tickers Have Been Appended')
+  return rows_appended
+
+def get_last_stored_dates(tickers, filepath):
+  '''Gets each ticker's last stored date without decoding its full hdf5 dataset.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    filepath: string of where the historicals are saved.
+
+  Returns:
+    last_stored_dates: dict with tickers as keys and their last stored date as a
+                       pandas timestamp. Tickers without a saved hdf5 file or
+                       without any rows are left out.
+  '''
+
+  last_stored_dates = dict()
+
+  for ticker in tickers:
+    hdf5_filepath = f'{filepath}/{ticker}.hdf5'
+    if not Path(hdf5_filepath).is_file():
+      continue
+    with h5py.File(hdf5_filepath, 'r') as f:
+      dataset = f['historicals']['15Y']
+      if dataset.shape[0]:
+        last_row = dataset[dataset.shape[0] - 1]  # Only the last row is read.
+        if dataset.dtype.names is not None:
+          last_stored_dates[ticker] = pd.to_datetime(last_row['Date'], unit='ns')
+        else:
+          last_stored_dates[ticker] = pd.to_datetime(last_row[0], unit='s')
+  return last_stored_dates
+
+@metricsmodule.timed_stage('refresh_hdf5')
+def refresh_hdf5_historicals(tickers, filepath, end_date=None, default_start_date='2007-01-22', **download_kwargs):
+  '''Downloads and appends only the dates after each ticker's last stored date.
+
+  Each ticker's last stored date is read from its hdf5 file and only the missing
+  tail is requested from Yahoo Finance, so a nightly refresh scales with the days
+  since the last refresh instead of the length of the history. Tickers that share
+  a start date are downloaded together with download_yf_tickers_concurrently and
+  the new rows are written with append_historicals_to_hdf5. Tickers that were
+  never saved are downloaded from the default start date.
+
+  Yahoo Finance adjusts every past price again after a dividend or a stock split,
+  so appending a tail with one would leave the stored rows on the old adjustment.
+  Tickers whose new dates have any Dividends or Stock Splits are instead downloaded
+  again from the default start date and their files are rewritten, keeping their
+  storage options.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    filepath: string of where the historicals are saved.
+    end_date: str with format as 'year-month-day'. Defaults to tomorrow so today's
+              data is included.
+    default_start_date: str with format as 'year-month-day' used for tickers without
+                        a saved hdf5 file and for rewritten tickers. Defaults '2007-01-22'.
+    **download_kwargs: keyword arguments passed on to download_yf_tickers_concurrently,
+                       e.g. max_workers, requests_per_second or bulk_size.
+
+  Returns:
+    rows_appended: dict with tickers as keys and the amount of rows after their last
+                   stored date as values, including those of rewritten tickers.
+    tickers_not_avaliable_on_yf: list of tickers without a saved hdf5 file that were
+                                 not avaliable on yahoo finance.
+  '''
+
+  if end_date is None:
+    end_date = (dt.date.today() + dt.timedelta(days=1)).strftime('%Y-%m-%d')
+
+  last_stored_dates = get_last_stored_dates(tickers, filepath)
+
+  tickers_per_start_date = dict()
+  for ticker in tickers:
+    if ticker in last_stored_dates:
+      start_date = (last_stored_dates[ticker] + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+    else:
+      start_date = default_start_date
+    if start_date < end_date:  # Tickers that are already up to date are not requested.
+      tickers_per_start_date.setdefault(start_date, []).append(ticker)
+
+  rows_appended = {ticker: 0 for ticker in last_stored_dates}
+  tickers_not_avaliable_on_yf = []
+  tickers_to_rewrite = []
+
+  for start_date, start_date_tickers in tickers_per_start_date.items():
+    historicals, _, not_avaliable = download_yf_tickers_concurrently(start_date_tickers, start_date, end_date,
+                                                                     **download_kwargs)
+    # An empty download for a saved ticker only means there are no new dates yet.
+    tickers_not_avaliable_on_yf.extend(ticker for ticker in not_avaliable if ticker not in last_stored_dates)
+    readjusted_tickers = [ticker for ticker in historicals
+                          if ticker in last_stored_dates and _has_corporate_actions(historicals[ticker])]
+    tickers_to_rewrite.extend(readjusted_tickers)
+    historicals = {ticker: historicals[ticker] for ticker in historicals if ticker not in readjusted_tickers}
+    if historicals:
+      rows_appended.update(append_historicals_to_hdf5(format_historicals_to_save_as_hdf5(historicals), filepath))
+
+  if tickers_to_rewrite:
+    historicals, _, not_avaliable = download_yf_tickers_concurrently(tickers_to_rewrite, default_start_date, end_date,
+                                                                     **download_kwargs)
+    for ticker in not_avaliable:  # Keep the stored file rather than append a tail on a different adjustment.
+      print(f'Could not download the readjusted history of {ticker}, its file was not refreshed')
+    hdf5_historicals = format_historicals_to_save_as_hdf5(historicals)
+    _rewrite_hdf5_historicals(hdf5_historicals, filepath)
+    for ticker, hdf5_historical in hdf5_historicals.items():
+      rows_appended[ticker] = int((hdf5_historical['Date'] > last_stored_dates[ticker].timestamp()).sum())
+  return rows_appended, tickers_not_avaliable_on_yf
+
+def _has_corporate_actions(historical):
+  '''Returns True if a downloaded historical has any dividend or stock split, which readjusts its past prices.'''
+  actions = historical.columns.intersection(['Dividends', 'Stock Splits'])
+  return bool(historical[actions].fillna(0).to_numpy().any())
+
+def _rewrite_hdf5_historicals(historicals, filepath, source='yf'):
+  '''Rewrites saved hdf5 files with new historicals, keeping each file's storage options.'''
+  for ticker in historicals:
+    hdf5_filepath = f'{filepath}/{ticker}.hdf5'
+    with h5py.File(hdf5_filepath, 'r') as f:
+      dataset_options = _dataset_options(f['historicals']['15Y'])
+    with h5py.File(hdf5_filepath, 'w') as f:  # A new file, since hdf5 does not free the space of a deleted dataset.
+      _create_historicals_dataset(f.create_group('historicals'), historicals[ticker], **dataset_options)
+    metricsmodule.count('rows_written', len(historicals[ticker]))
+    metricsmodule.count_file_bytes('bytes_written', hdf5_filepath)
+  update_coverage_index(historicals, filepath, source, replace=True)
+
 def check_if_tickers_were_saved_successfully(tickers, filepath, save_type='hdf5'):
   '''Checks if the tickers were saved successfully as their specified save type.
 
@@ -203,36 +931,94 @@ def check_if_tickers_were_saved_successfully(tickers, filepath, save_type='hdf5'
       tickers_not_saved.append(ticker)
   return tickers_not_saved
 
-def load_csv_historicals(tickers, filepath):
+@metricsmodule.timed_stage('load_csv')
+def load_csv_historicals(tickers, filepath, engine='pandas', parse_dates=False, max_workers=None):
   '''Load csv historicals to memory.
 
+  Every column is read with an explicit dtype, so the parser does not have to
+  infer them, and files are read by a pool of threads. engine='pyarrow' parses
+  with pyarrow's multithreaded csv reader, which is several times faster than
+  the default pandas c parser. It also reads back exactly the saved prices, while
+  the c parser can be off in the last digit. Volume is still inferred by both
+  engines like before, so whole share volumes load as int64.
+
   Args:
     tickers: list containing each ticker given as a string.
     filepath: string of where the historicals are saved.
+    engine: string of the csv parser. Options are {'pandas', 'pyarrow'}, and 'c' is
+            accepted for 'pandas', the name pandas gives its parser. Defaults to 'pandas'.
+    parse_dates: bool. If True the 'Date' index is parsed from the 'year-month-day hour:minute:second+offset'
+                 format the csv files are saved with as UTC datetimes. Defaults False,
+                 which keeps the dates as text like before.
+    max_workers: int of how many files are read at once. Defaults to None, which uses every core.
 
   Returns:
     historicals: dict with tickers as keys and OHLC data as values.
                  Each OHLC data is given as a pandas dataframe. 
   '''
 
-  historicals = dict()
-  
+  assert engine in _CSV_ENGINES, 'Engine must be "pandas" or "pyarrow"'
+  engine = _CSV_ENGINES[engine]
+  if engine == 'pyarrow':
+    _check_pyarrow_is_installed('pyarrow csv engine')
+
+  def load_ticker(csv_filepath):
+    if engine == 'pyarrow':
+      column_types = {'': pa.int64(), 'Date': pa.string(), **{column: pa.float64() for column in _CSV_DTYPES if column != 'Date'}}
+      table = pacsv.read_csv(csv_filepath, convert_options=pacsv.ConvertOptions(column_types=column_types))
+      dataset = table.to_pandas().rename(columns={'': 'Unnamed: 0'}).set_index('Date')  # Name the index column like pandas does.
+    else:
+      dataset = pd.read_csv(csv_filepath, index_col='Date', dtype=_CSV_DTYPES)
+    if parse_dates:
+      dataset.index = _parse_csv_dates(dataset.index)
+    metricsmodule.count('rows_read', len(dataset))
+    metricsmodule.count_file_bytes('bytes_read', csv_filepath)
+    return dataset
+
+  csv_filepaths = dict()
   for ticker in tickers:
     csv_filepath = f'{filepath}/{ticker}.csv'
     ticker_file = Path(csv_filepath)
     if ticker_file.is_file():
-      dataset = pd.read_csv(csv_filepath, index_col='Date')
-      historicals[ticker] = dataset
+      csv_filepaths[ticker] = csv_filepath
     else:
       print(f'Error {ticker} ticker is missing')
+
+  with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+    historicals = dict(zip(csv_filepaths, executor.map(load_ticker, csv_filepaths.values())))
   return historicals
 
-def load_hdf5_historicals(tickers, filepath):
+def _parse_csv_dates(date_texts):
+  '''Parses dates written like '2007-01-22 00:00:00-05:00' as a UTC datetimeindex for the whole column at once.'''
+  texts = np.asarray(date_texts, dtype=str)
+  if len(texts) == 0 or texts.dtype.itemsize != 25 * 4 or (np.char.str_len(texts) != 25).any():  # Let pandas parse any other ISO 8601 dates.
+    return pd.DatetimeIndex(pd.to_datetime(date_texts, format='ISO8601', utc=True), name='Date')
+  local_seconds = texts.astype('<U19').astype('datetime64[s]')
+  code_points = texts.view(np.uint32).reshape(-1, 25).astype(np.int64)  # Read the offset digits as numbers without parsing text.
+  offset_minutes = (code_points[:, [20, 21, 23, 24]] - ord('0')) @ [600, 60, 10, 1]
+  offset_minutes = np.where(code_points[:, 19] == ord('-'), -offset_minutes, offset_minutes)
+  utc_seconds = local_seconds - offset_minutes.astype('timedelta64[m]')
+  return pd.DatetimeIndex(utc_seconds, name='Date').tz_localize('UTC')
+
+_CSV_DTYPES = {'Date': str, 'Open': np.float64, 'High': np.float64, 'Low': np.float64, 'Close': np.float64}  # Volume is inferred, keeping int64 volumes.
+_CSV_ENGINES = {'pandas': 'pandas', 'c': 'pandas', 'pyarrow': 'pyarrow'}  # 'c' is what pandas calls its own csv parser.
+
+@metricsmodule.timed_stage('load_hdf5')
+def load_hdf5_historicals(tickers, filepath, start=None, end=None, columns=None):
   '''Load hdf5 historicals to memory.
 
+  With start or end the first and last rows are found by a binary search over
+  the stored dates, and only those rows and the requested columns are read, so
+  loading the last few years of 'Close' decodes a fraction of each file.
+  Files saved with the compact schema load as float32 prices and uint64 volume.
+
   Args:
     tickers: list containing each ticker given as a string.
     filepath: string of where the historicals are saved.
+    start: str with format as 'year-month-day' of the first date to load. Defaults to None.
+    end: str with format as 'year-month-day' of the last date to load. Defaults to None.
+    columns: list of the columns to load from {'Open', 'High', 'Low', 'Close', 'Volume'}.
+             Defaults to None, which loads all of them.
 
   Returns:
     historicals: dict with tickers as keys and OHLC data as values.
@@ -240,21 +1026,880 @@ def load_hdf5_historicals(tickers, filepath):
   '''
 
   historicals = dict()
-  columns = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
-  
+
   for ticker in tickers:
     hdf5_filepath = f'{filepath}/{ticker}.hdf5'
     ticker_file = Path(hdf5_filepath)
     if ticker_file.is_file():
+      historicals[ticker] = _load_hdf5_historical(hdf5_filepath, start, end, columns)
+    else:
+      print(f'Error {ticker} ticker is missing')
+  print('All Historicals Have Been Loaded')
+  return historicals
+
+@metricsmodule.timed_stage('load_hdf5')
+def load_hdf5_historicals_in_parallel(tickers, filepath, start=None, end=None, columns=None, max_workers=None):
+  '''Load hdf5 historicals to memory with a pool of processes decoding the files.
+
+  Works the same as load_hdf5_historicals(tickers, filepath, start, end, columns),
+  but h5py holds the GIL while it decompresses, so threads cannot speed it up.
+  Here each worker process decodes its files straight into one block of shared
+  memory, and only the shape and dtype of each ticker's rows are sent back, so
+  no dataframes are pickled between processes. Loading the full universe then
+  scales with the amount of cores. For a few tickers the cost of starting the
+  processes outweighs the gain, so use load_hdf5_historicals instead.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    filepath: string of where the historicals are saved.
+    start: str with format as 'year-month-day' of the first date to load. Defaults to None.
+    end: str with format as 'year-month-day' of the last date to load. Defaults to None.
+    columns: list of the columns to load from {'Open', 'High', 'Low', 'Close', 'Volume'}.
+             Defaults to None, which loads all of them.
+    max_workers: int of how many processes decode the files. Defaults to None, which uses every core.
+
+  Returns:
+    historicals: dict with tickers as keys and OHLC data as values.
+                 Each OHLC data is given as a pandas dataframe.
+  '''
+
+  hdf5_filepaths = dict()
+  byte_offsets = [0]
+  for ticker in tickers:  # Reading the dataset shapes only touches the file metadata.
+    hdf5_filepath = f'{filepath}/{ticker}.hdf5'
+    if Path(hdf5_filepath).is_file():
+      with h5py.File(hdf5_filepath, 'r') as f:
+        dataset = f['historicals']['15Y']
+        dataset_bytes = dataset.size * dataset.dtype.itemsize
+      hdf5_filepaths[ticker] = hdf5_filepath
+      byte_offsets.append(byte_offsets[-1] + -(-dataset_bytes // 8) * 8)  # Keep every ticker's rows 8 byte aligned.
+    else:
+      print(f'Error {ticker} ticker is missing')
+
+  historicals = dict()
+  shared = shared_memory.SharedMemory(create=True, size=max(1, byte_offsets[-1]))
+  try:
+    tasks = [(hdf5_filepath, offset, start, end, columns) for hdf5_filepath, offset in zip(hdf5_filepaths.values(), byte_offsets)]
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_attach_shared_memory, initargs=(shared.name,)) as executor:
+      results = executor.map(_read_hdf5_rows_into_shared_memory, tasks, chunksize=max(1, len(tasks) // (4 * workers)))
+      for ticker, offset, (shape, dtype) in zip(hdf5_filepaths, byte_offsets, results):
+        data = np.ndarray(shape, dtype, buffer=shared.buf, offset=offset).copy()  # Copy out before the shared memory is freed.
+        metricsmodule.count('rows_read', len(data))
+        metricsmodule.count('bytes_read', data.nbytes)
+        historicals[ticker] = _hdf5_rows_to_dataframe(data, columns)
+  finally:
+    shared.close()
+    shared.unlink()
+  print('All Historicals Have Been Loaded')
+  return historicals
+
+_shared_rows = None  # The shared memory block of a load_hdf5_historicals_in_parallel worker process.
+
+def _attach_shared_memory(name):
+  '''Attaches a worker process to the shared memory block it decodes rows into.'''
+  global _shared_rows
+  _shared_rows = shared_memory.SharedMemory(name=name)
+
+def _read_hdf5_rows_into_shared_memory(task):
+  '''Decodes a ticker's requested rows directly into the shared memory at the offset and returns their shape and dtype.'''
+  hdf5_filepath, offset, start, end, columns = task
+  with h5py.File(hdf5_filepath, 'r') as f:
+    dataset = f['historicals']['15Y']
+    rows, read_positions = _hdf5_selection(dataset, start, end, columns)
+    row_count = rows.stop - rows.start
+    if dataset.dtype.names is not None:  # Compact rows are read whole, the loaded dataframe picks the columns.
+      shape, selection = (row_count,), np.s_[rows]
+    elif read_positions == list(range(6)):
+      shape, selection = (row_count, 6), np.s_[rows]
+    else:
+      shape, selection = (row_count, len(read_positions)), np.s_[rows, read_positions]
+    data = np.ndarray(shape, dataset.dtype, buffer=_shared_rows.buf, offset=offset)
+    if row_count:
+      dataset.read_direct(data, selection)
+    del data  # Release the view so the shared memory can be closed.
+    return shape, dataset.dtype
+
+def _load_hdf5_historical(hdf5_filepath, start=None, end=None, columns=None):
+  '''Loads a single ticker's hdf5 file as a pandas dataframe, only reading the rows and columns asked for.'''
+  with h5py.File(hdf5_filepath, 'r') as f:
+    dataset = f['historicals']['15Y']
+    rows, read_positions = _hdf5_selection(dataset, start, end, columns)
+    if dataset.dtype.names is not None:
+      data = dataset.fields(['Date'] + list(columns or _HDF5_COLUMNS))[rows]
+    elif read_positions == list(range(6)):
+      data = dataset[rows]
+    else:
+      data = dataset[rows, read_positions]
+  metricsmodule.count('rows_read', len(data))
+  metricsmodule.count('bytes_read', data.nbytes)
+  return _hdf5_rows_to_dataframe(data, columns)
+
+_HDF5_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+def _hdf5_selection(dataset, start=None, end=None, columns=None):
+  '''Returns the slice of rows between start and end and the sorted column positions to read from the '15Y' dataset.'''
+  positions = [1 + _HDF5_COLUMNS.index(column) for column in (columns or _HDF5_COLUMNS)]
+  read_positions = [0] + sorted(set(positions))  # h5py reads columns in increasing order, reorder them afterwards.
+  first_row, last_row = 0, dataset.shape[0]
+  if start is not None:
+    first_row = _bisect_hdf5_dates(dataset, pd.Timestamp(start))
+  if end is not None:  # The end date is inclusive of the whole day, like slicing a datetime index with a date string.
+    last_row = _bisect_hdf5_dates(dataset, pd.Timestamp(end).normalize() + pd.Timedelta(days=1))
+  return slice(first_row, max(first_row, last_row)), read_positions
+
+def _hdf5_rows_to_dataframe(data, columns=None):
+  '''Converts rows read from a '15Y' dataset, with the Date and the read columns, to a pandas dataframe.'''
+  columns = list(columns or _HDF5_COLUMNS)
+  if data.dtype.names is not None:  # Keep the compact dtypes instead of upcasting them to float64.
+    dates = data['Date'].astype('datetime64[ns]')
+    dataset = pd.DataFrame({column: data[column] for column in columns}, index=pd.DatetimeIndex(dates, name='Date'))
+    return dataset
+  positions = [1 + _HDF5_COLUMNS.index(column) for column in columns]
+  read_positions = [0] + sorted(set(positions))
+  dates = pd.to_datetime(data[:, 0], unit='s')  # Change the float timestamps back to datetimes.
+  values = data[:, [read_positions.index(position) for position in positions]]
+  dataset = pd.DataFrame(data=values, columns=columns, index=pd.DatetimeIndex(dates, name='Date'))
+  return dataset
+
+def _bisect_hdf5_dates(dataset, date):
+  '''Returns the first row of the '15Y' dataset dated at or after the date.
+
+  Only the Date of each probed row is read, so finding a row costs about
+  log2(rows) single values instead of decoding the whole dataset.
+  '''
+  compact = dataset.dtype.names is not None
+  timestamp = date.value if compact else date.timestamp()  # Nanoseconds for the compact schema, float seconds otherwise.
+  low, high = 0, dataset.shape[0]
+  while low < high:
+    middle = (low + high) // 2
+    stored_date = dataset[middle]['Date'] if compact else dataset[middle, 0]
+    if stored_date < timestamp:
+      low = middle + 1
+    else:
+      high = middle
+  return low
+
+class LazyHistoricals(Mapping):
+  '''Dict-like historicals that only load a ticker's hdf5 file when it is accessed.
+
+  Can be used anywhere the dict from load_hdf5_historicals(tickers, filepath) is
+  used, e.g. historicals[ticker], historicals.items() and len(historicals).
+  A ticker's '15Y' dataset is decoded on first access and kept in a least
+  recently used cache of at most cache_size dataframes, so memory stays bounded
+  no matter how many tickers are iterated over.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    filepath: string of where the historicals are saved.
+    cache_size: int of how many decoded dataframes are kept in memory. Defaults 64.
+    start: str with format as 'year-month-day' of the first date to load. Defaults to None.
+    end: str with format as 'year-month-day' of the last date to load. Defaults to None.
+    columns: list of the columns to load from {'Open', 'High', 'Low', 'Close', 'Volume'}.
+             Defaults to None, which loads all of them.
+  '''
+
+  def __init__(self, tickers, filepath, cache_size=64, start=None, end=None, columns=None):
+    self.filepath = filepath
+    self.cache_size = cache_size
+    self.start, self.end, self.columns = start, end, columns
+    self._tickers = []
+    self._cache = OrderedDict()
+
+    for ticker in tickers:
+      if Path(f'{filepath}/{ticker}.hdf5').is_file():
+        self._tickers.append(ticker)
+      else:
+        print(f'Error {ticker} ticker is missing')
+    self._ticker_set = set(self._tickers)
+
+  def __getitem__(self, ticker):
+    if ticker in self._cache:
+      self._cache.move_to_end(ticker)  # Mark as the most recently used.
+      return self._cache[ticker]
+    if ticker not in self._ticker_set:
+      raise KeyError(ticker)
+
+    dataset = _load_hdf5_historical(f'{self.filepath}/{ticker}.hdf5', self.start, self.end, self.columns)
+    self._cache[ticker] = dataset
+    if len(self._cache) > self.cache_size:
+      self._cache.popitem(last=False)  # Evict the least recently used dataframe.
+    return dataset
+
+  def __contains__(self, ticker):
+    return ticker in self._ticker_set  # Avoid the Mapping default, which would decode the file.
+
+  def __iter__(self):
+    return iter(self._tickers)
+
+  def __len__(self):
+    return len(self._tickers)
+
+  def cache_fingerprint(self):
+    '''Returns what identifies the historicals to cachemodule without decoding any file.'''
+    files = [cachemodule.file_fingerprint(f'{self.filepath}/{ticker}.hdf5') for ticker in self._tickers]
+    return (self._tickers, files, self.start, self.end, self.columns)
+
+  def __repr__(self):
+    return f'LazyHistoricals({len(self._tickers)} tickers, {len(self._cache)} cached, filepath={self.filepath!r})'
+
+@metricsmodule.timed_stage('save_store')
+def save_historicals_to_hdf5_store(historicals, filepath, store_name='historicals_store', source='yf'):
+  '''Saves all historicals to a single consolidated hdf5 store.
+
+  Every ticker's rows are written back to back into one '15Y' dataset and an
+  index group records each ticker and the row offset where its data starts.
+  Loading the whole universe then costs a handful of large reads instead of
+  opening and closing one file per ticker.
+
+  Args:
+    historicals: dict with tickers as keys and hdf5 formatted OHLC data as values.
+                 See format_historicals_to_save_as_hdf5(historicals).
+    filepath: string of the folder to save the store in.
+    store_name: string name of the store file. Defaults to 'historicals_store'.
+    source: string name of where the historicals came from, recorded in the
+            coverage index. Defaults 'yf'.
+
+  Returns:
+    None
+  '''
+
+  tickers = list(historicals)
+  offsets = np.zeros(len(tickers) + 1, dtype=np.int64)  # Ticker i's rows are data[offsets[i]:offsets[i+1]].
+  np.cumsum([len(historicals[ticker]) for ticker in tickers], out=offsets[1:])
+
+  data = np.empty((offsets[-1], 6), dtype=np.float64)
+  for i, ticker in enumerate(tickers):
+    data[offsets[i]:offsets[i+1]] = historicals[ticker]
+
+  store_filepath = f'{filepath}/{store_name}.hdf5'
+  with h5py.File(store_filepath, 'w') as f:
+    history = f.create_group('historicals')
+    history.create_dataset(name='15Y',
+                           data=data,
+                           maxshape=(None, 6),
+                           compression='gzip')
+    index = f.create_group('index')
+    index.create_dataset(name='tickers', data=tickers, dtype=h5py.string_dtype())
+    index.create_dataset(name='offsets', data=offsets)
+  metricsmodule.count('rows_written', len(data))
+  metricsmodule.count_file_bytes('bytes_written', store_filepath)
+  update_coverage_index(historicals, filepath, source, replace=True)
+  print(f'All Tickers Have Been Saved to {store_name}')
+
+@metricsmodule.timed_stage('consolidate_store')
+def consolidate_hdf5_historicals_into_store(tickers, filepath, store_name='historicals_store', source='yf'):
+  '''Consolidates per ticker hdf5 files into a single hdf5 store.
+
+  The raw '15Y' arrays are copied as they are, so no dataframes are built
+  along the way. Files saved with the compact schema are converted back to
+  float64 rows. The store is saved in the same folder as the ticker files.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    filepath: string of where the per ticker hdf5 historicals are saved.
+    store_name: string name of the store file. Defaults to 'historicals_store'.
+    source: string name of where the historicals came from, recorded in the
+            coverage index. Defaults 'yf'.
+
+  Returns:
+    tickers_not_consolidated: list of tickers that did not have an hdf5 file.
+  '''
+
+  hdf5_historicals = dict()
+  tickers_not_consolidated = []
+
+  for ticker in tickers:
+    hdf5_filepath = f'{filepath}/{ticker}.hdf5'
+    if Path(hdf5_filepath).is_file():
       with h5py.File(hdf5_filepath, 'r') as f:
-        group = f['historicals']
-        data = group['15Y'][()]
-      
-      dataset = pd.DataFrame(data=data, columns=columns)
-      dataset['Date'] = pd.to_datetime(dataset['Date'], unit='s')
-      dataset = dataset.set_index('Date')
-      historicals[ticker] = dataset
+        data = f['historicals']['15Y'][()]
+      hdf5_historicals[ticker] = _from_compact_rows(data) if data.dtype.names is not None else data
+    else:
+      print(f'Error {ticker} ticker is missing')
+      tickers_not_consolidated.append(ticker)
+
+  save_historicals_to_hdf5_store(hdf5_historicals, filepath, store_name, source)
+  return tickers_not_consolidated
+
+@metricsmodule.timed_stage('load_store')
+def load_hdf5_store_historicals(tickers, filepath, store_name='historicals_store'):
+  '''Load historicals from a consolidated hdf5 store to memory.
+
+  Drop-in replacement for load_hdf5_historicals(tickers, filepath). Requested
+  tickers that sit next to each other in the store are read together, so
+  loading the full universe is a single read of the '15Y' dataset.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    filepath: string of the folder the store is saved in.
+    store_name: string name of the store file. Defaults to 'historicals_store'.
+
+  Returns:
+    historicals: dict with tickers as keys and OHLC data as values.
+                 Each OHLC data is given as a pandas dataframe.
+  '''
+
+  historicals = dict()
+  columns = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+  store_filepath = f'{filepath}/{store_name}.hdf5'
+  with h5py.File(store_filepath, 'r') as f:
+    stored_tickers = f['index']['tickers'].asstr()[()]
+    offsets = f['index']['offsets'][()]
+    store_positions = {ticker: i for i, ticker in enumerate(stored_tickers)}
+
+    positions = []
+    for ticker in tickers:
+      if ticker in store_positions:
+        positions.append(store_positions[ticker])
+      else:
+        print(f'Error {ticker} ticker is missing')
+    positions = np.unique(positions).astype(np.int64)
+
+    # Group neighbouring tickers into runs so each run is one contiguous read.
+    run_starts = np.flatnonzero(np.diff(positions, prepend=-2) != 1)
+    run_ends = np.append(run_starts[1:], len(positions))
+
+    loaded = dict()
+    for run_start, run_end in zip(run_starts, run_ends):
+      first, last = positions[run_start], positions[run_end - 1]
+      block = f['historicals']['15Y'][offsets[first]:offsets[last + 1]]
+      metricsmodule.count('rows_read', len(block))
+      metricsmodule.count('bytes_read', block.nbytes)
+      dates = pd.to_datetime(block[:, 0], unit='s')  # Change the float timestamps back to datetimes once per run.
+      for position in positions[run_start:run_end]:
+        rows = slice(offsets[position] - offsets[first], offsets[position + 1] - offsets[first])
+        dataset = pd.DataFrame(data=block[rows, 1:], columns=columns[1:], index=dates[rows])
+        dataset.index.name = 'Date'
+        loaded[stored_tickers[position]] = dataset
+
+  for ticker in tickers:  # Keep the requested ticker order like load_hdf5_historicals.
+    if ticker in loaded:
+      historicals[ticker] = loaded[ticker]
+  print('All Historicals Have Been Loaded')
+  return historicals
+
+@metricsmodule.timed_stage('save_parquet')
+def save_historicals_to_parquet(historicals, filepath, dataset_name='historicals_parquet', row_group_size=16384, source='yf'):
+  '''Saves all historicals to a year partitioned parquet dataset in long format.
+
+  Every ticker's rows are stacked into one table with the columns Ticker, Date,
+  Open, High, Low, Close and Volume, split into a 'Year=YYYY' folder per year
+  and sorted by ticker then date. Each parquet row group therefore covers a short
+  range of tickers and dates, and its min/max statistics let
+  load_parquet_historicals skip every year folder and row group that cannot hold
+  the requested tickers or dates. Requires pyarrow.
+
+  Saving into an existing dataset replaces only the saved tickers. The year
+  folders that hold new rows or old rows of the saved tickers are rewritten with
+  the other tickers' rows read back from them, so those tickers keep every date.
+
+  Args:
+    historicals: dict with tickers as keys and OHLC data as values. Accepts yahoo
+                 finance dataframes, csv or hdf5 formatted historicals and arrays
+                 of [timestamp, Open, High, Low, Close, Volume] rows.
+    filepath: string of the folder to save the dataset in.
+    dataset_name: string name of the dataset folder. Defaults to 'historicals_parquet'.
+    row_group_size: int maximum rows per parquet row group. Smaller row groups
+                    skip more precisely but add statistics overhead. Defaults 16384.
+    source: string name of where the historicals came from, recorded in the
+            coverage index. Defaults 'yf'.
+
+  Returns:
+    None
+  '''
+
+  _check_pyarrow_is_installed()
+  columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+  if not historicals:
+    return
+  dataset_filepath = f'{filepath}/{dataset_name}'
+  row_tickers, date_columns, value_columns = [], [], []
+  for ticker in historicals:
+    dates, values = _historical_to_dates_and_values(historicals[ticker], columns)
+    row_tickers.append(np.full(len(dates), ticker, dtype=object))
+    date_columns.append(dates)
+    value_columns.append(values)
+  years = np.concatenate(date_columns).astype('datetime64[ns]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+  rewritten_years = set(years.tolist())
+  if Path(dataset_filepath).is_dir():
+    other_tickers, other_dates, other_values, rewritten_years = _read_other_parquet_rows(dataset_filepath, list(historicals),
+                                                                                         rewritten_years, columns)
+    row_tickers.append(other_tickers)
+    date_columns.append(other_dates)
+    value_columns.append(other_values)
+  row_tickers, dates, values = np.concatenate(row_tickers), np.concatenate(date_columns), np.concatenate(value_columns)
+  years = dates.astype('datetime64[ns]').astype('datetime64[Y]').astype(np.int64) + 1970
+  ticker_codes, sorted_tickers = pd.factorize(row_tickers, sort=True)
+
+  order = np.lexsort((dates, ticker_codes, years))  # Year folders, then ticker and date inside each one.
+  table = pa.table({'Ticker': pa.array(sorted_tickers, type=pa.string()).take(ticker_codes[order]),
+                    'Date': pa.array(dates[order].astype('datetime64[ns]')),
+                    **{column: values[order, i] for i, column in enumerate(columns)},
+                    'Year': pa.array(years[order], type=pa.int16())})
+
+  for year in rewritten_years - set(years.tolist()):  # Year folders left without any rows are not written, so delete them.
+    shutil.rmtree(f'{dataset_filepath}/Year={year}', ignore_errors=True)
+  pads.write_dataset(table, dataset_filepath, format='parquet',
+                     partitioning=pads.partitioning(pa.schema([('Year', pa.int16())]), flavor='hive'),
+                     existing_data_behavior='delete_matching', preserve_order=True,
+                     max_rows_per_group=row_group_size, min_rows_per_group=row_group_size)
+  metricsmodule.count('rows_written', table.num_rows)
+  metricsmodule.count_file_bytes('bytes_written', dataset_filepath)
+  update_coverage_index(historicals, filepath, source, replace=True)
+  print(f'All Tickers Have Been Saved to {dataset_name}')
+
+def _read_other_parquet_rows(dataset_filepath, tickers, years, columns):
+  '''Returns the other tickers' rows in the year folders that saving the tickers rewrites, and those years.
+
+  The rewritten years are the years of the new rows and every year the tickers
+  already have rows in, so none of their old rows are left behind.
+  '''
+  dataset = pads.dataset(dataset_filepath, format='parquet', partitioning='hive')
+  ticker_filter = pads.field('Ticker').isin(tickers)
+  saved_years = dataset.to_table(columns=['Year'], filter=ticker_filter).column('Year').to_numpy()
+  years = set(years) | set(np.unique(saved_years).tolist())
+  table = dataset.to_table(columns=['Ticker', 'Date'] + columns,
+                           filter=pads.field('Year').isin(sorted(years)) & ~ticker_filter)
+  metricsmodule.count('rows_read', table.num_rows)
+  other_tickers = table.column('Ticker').to_numpy(zero_copy_only=False).astype(object)
+  other_dates = table.column('Date').to_numpy().astype('datetime64[ns]').view(np.int64)
+  other_values = np.column_stack([table.column(column).to_numpy() for column in columns]).reshape(-1, len(columns))
+  return other_tickers, other_dates, other_values.astype(np.float64), years
+
+@metricsmodule.timed_stage('load_parquet')
+def load_parquet_historicals(tickers, filepath, dataset_name='historicals_parquet', start=None, end=None, columns=None):
+  '''Load historicals from a parquet dataset, only reading the requested tickers, dates and columns.
+
+  The ticker, date and column filters are pushed down to pyarrow, which skips
+  whole year folders and any row group whose statistics rule it out, so the
+  amount read follows the amount returned rather than the size of the dataset.
+  See save_historicals_to_parquet(historicals, filepath). Requires pyarrow.
+
+  Args:
+    tickers: list containing each ticker given as a string. None loads every ticker.
+    filepath: string of the folder the dataset is saved in.
+    dataset_name: string name of the dataset folder. Defaults to 'historicals_parquet'.
+    start: str with format as 'year-month-day' of the first date to load. Defaults to None.
+    end: str with format as 'year-month-day' of the last date to load. Defaults to None.
+    columns: list of the columns to load from {'Open', 'High', 'Low', 'Close', 'Volume'}.
+             Defaults to None, which loads all of them.
+
+  Returns:
+    historicals: dict with tickers as keys and OHLC data as values.
+                 Each OHLC data is given as a pandas dataframe.
+  '''
+
+  _check_pyarrow_is_installed()
+  if columns is None:
+    columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+  dataset = pads.dataset(f'{filepath}/{dataset_name}', format='parquet', partitioning='hive')
+  row_filter = None
+  conditions = []
+  if tickers is not None:
+    conditions.append(pads.field('Ticker').isin(list(tickers)))
+  if start is not None:
+    start = pd.Timestamp(start)
+    conditions += [pads.field('Year') >= start.year, pads.field('Date') >= _to_arrow_timestamp(start)]
+  if end is not None:  # The end date is inclusive of the whole day, like slicing a datetime index with a date string.
+    end = pd.Timestamp(end)
+    conditions += [pads.field('Year') <= end.year, pads.field('Date') < _to_arrow_timestamp(end.normalize() + pd.Timedelta(days=1))]
+  for condition in conditions:
+    row_filter = condition if row_filter is None else row_filter & condition
+  table = dataset.to_table(columns=['Ticker', 'Date'] + list(columns), filter=row_filter)
+  metricsmodule.count('rows_read', table.num_rows)
+  metricsmodule.count('bytes_read', table.nbytes)
+
+  # Year folders each hold their own ticker ordering, so sort once and split at the ticker boundaries.
+  ticker_codes, loaded_tickers = pd.factorize(table.column('Ticker').to_numpy(zero_copy_only=False), sort=True)
+  dates = table.column('Date').to_numpy().astype('datetime64[ns]')
+  order = np.lexsort((dates, ticker_codes))
+  boundaries = np.searchsorted(ticker_codes[order], np.arange(len(loaded_tickers) + 1))
+  values = np.column_stack([table.column(column).to_numpy() for column in columns]) if columns else np.empty((len(order), 0))
+  dates, values = dates[order], values[order]
+
+  loaded = dict()
+  for i, ticker in enumerate(loaded_tickers):
+    rows = slice(boundaries[i], boundaries[i + 1])
+    loaded[ticker] = pd.DataFrame(data=values[rows], columns=list(columns), index=pd.DatetimeIndex(dates[rows], name='Date'))
+
+  historicals = dict()
+  for ticker in (tickers if tickers is not None else loaded_tickers):  # Keep the requested ticker order like load_hdf5_historicals.
+    if ticker in loaded:
+      historicals[ticker] = loaded[ticker]
     else:
       print(f'Error {ticker} ticker is missing')
-    print('All Historicals Have Been Saved to Memory')
-  return historicals
\ No newline at end of file
+  print('All Historicals Have Been Loaded')
+  return historicals
+
+def _check_pyarrow_is_installed(feature='parquet backend'):
+  '''Raises an ImportError for the feature when pyarrow is not installed.'''
+  if pa is None:
+    raise ImportError(f'The {feature} requires pyarrow, run %pip install pyarrow in your main.')
+
+def _to_arrow_timestamp(timestamp):
+  '''Returns a pandas timestamp as a nanosecond pyarrow scalar to compare with the Date column.'''
+  return pa.scalar(timestamp.to_datetime64().astype('datetime64[ns]'))
+
+def _historical_to_dates_and_values(historical, columns):
+  '''Returns a ticker's historical as int64 ns dates and a float64 (rows, columns) array of values.'''
+  if isinstance(historical, pd.DataFrame):
+    if 'Date' in historical.columns:  # csv and hdf5 formatted historicals keep the dates in a column.
+      dates = historical['Date']
+      if pd.api.types.is_numeric_dtype(dates):
+        dates = np.round(dates.to_numpy(dtype=np.float64) * 10**9).astype(np.int64)
+      else:
+        dates = _datetime_index_to_ns(pd.DatetimeIndex(dates))
+    else:
+      dates = _datetime_index_to_ns(historical.index)
+    return dates, historical[columns].to_numpy(dtype=np.float64)
+  rows = np.asarray(historical, dtype=np.float64).reshape(-1, 6)  # hdf5 layout [timestamp, Open, High, Low, Close, Volume] rows.
+  all_columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+  values = rows[:, [1 + all_columns.index(column) for column in columns]]
+  return np.round(rows[:, 0] * 10**9).astype(np.int64), values
+
+class HistoricalsPanel:
+  '''Aligned tickers x trading days x fields panel of historicals with a presence mask.
+
+  All tickers share one master calendar made of every date that any ticker has,
+  so cross-sectional work such as ranking every ticker's close on each day is a
+  single numpy call on panel.field('Close') instead of re-aligning a dataframe
+  per ticker. Days without a row for a ticker are NaN in values and False in mask.
+  ticker(), field() and date_slice() return views, so no data is copied.
+
+  Build a panel with HistoricalsPanel.from_historicals(historicals) or
+  HistoricalsPanel.from_hdf5_store(tickers, filepath) and go back to the dict
+  of dataframes with panel.to_historicals().
+
+  Args:
+    tickers: list of tickers in the order of the panel's first axis.
+    dates: pandas datetimeindex of the master calendar on the panel's second axis.
+    fields: list of field names on the panel's third axis.
+    values: float64 numpy array with shape (tickers, dates, fields).
+    mask: bool numpy array with shape (tickers, dates). True if the ticker has a row on that date.
+  '''
+
+  def __init__(self, tickers, dates, fields, values, mask):
+    self.tickers = list(tickers)
+    self.dates = dates
+    self.fields = list(fields)
+    self.values = values
+    self.mask = mask
+    self._ticker_positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+  @classmethod
+  def from_historicals(cls, historicals, fields=('Open', 'High', 'Low', 'Close', 'Volume')):
+    '''Builds a panel from a dict with tickers as keys and OHLCV dataframes as values.'''
+    tickers = list(historicals)
+    ticker_dates = [_datetime_index_to_ns(historicals[ticker].index) for ticker in tickers]
+    calendar = np.unique(np.concatenate(ticker_dates)) if tickers else np.empty(0, dtype=np.int64)
+
+    values = np.full((len(tickers), len(calendar), len(fields)), np.nan)
+    mask = np.zeros((len(tickers), len(calendar)), dtype=bool)
+    for i, ticker in enumerate(tickers):
+      day_positions = np.searchsorted(calendar, ticker_dates[i])
+      values[i, day_positions] = historicals[ticker][list(fields)].to_numpy(dtype=np.float64)
+      mask[i, day_positions] = True
+    return cls(tickers, pd.DatetimeIndex(calendar.view('datetime64[ns]'), name='Date'), fields, values, mask)
+
+  @classmethod
+  def from_hdf5_store(cls, tickers, filepath, store_name='historicals_store'):
+    '''Builds a panel straight from a consolidated hdf5 store without building dataframes.
+
+    See save_historicals_to_hdf5_store(historicals, filepath, store_name). Tickers
+    that are not in the store are left out of the panel.
+    '''
+
+    store_filepath = f'{filepath}/{store_name}.hdf5'
+    with h5py.File(store_filepath, 'r') as f:
+      stored_tickers = list(f['index']['tickers'].asstr()[()])
+      offsets = f['index']['offsets'][()]
+      data = f['historicals']['15Y'][()]
+
+    store_positions = {ticker: i for i, ticker in enumerate(stored_tickers)}
+    panel_tickers = [ticker for ticker in tickers if ticker in store_positions]
+    row_tickers = np.repeat(np.arange(len(stored_tickers)), np.diff(offsets))  # Store position of every row.
+    panel_positions = np.full(len(stored_tickers), -1)
+    panel_positions[[store_positions[ticker] for ticker in panel_tickers]] = np.arange(len(panel_tickers))
+
+    row_panel_positions = panel_positions[row_tickers]
+    rows = row_panel_positions >= 0
+    row_dates = (data[rows, 0] * 1e9).round().astype(np.int64)  # Float second timestamps to nanoseconds.
+    calendar, day_positions = np.unique(row_dates, return_inverse=True)
+
+    values = np.full((len(panel_tickers), len(calendar), 5), np.nan)
+    mask = np.zeros((len(panel_tickers), len(calendar)), dtype=bool)
+    values[row_panel_positions[rows], day_positions] = data[rows, 1:]
+    mask[row_panel_positions[rows], day_positions] = True
+    fields = ['Open', 'High', 'Low', 'Close', 'Volume']
+    return cls(panel_tickers, pd.DatetimeIndex(calendar.view('datetime64[ns]'), name='Date'), fields, values, mask)
+
+  def ticker(self, ticker):
+    '''Returns a (dates, fields) view of one ticker's values.'''
+    return self.values[self._ticker_positions[ticker]]
+
+  def field(self, field):
+    '''Returns a (tickers, dates) view of one field for every ticker.'''
+    return self.values[:, :, self.fields.index(field)]
+
+  def date_slice(self, start=None, end=None):
+    '''Returns a panel viewing only the dates from start to end, both inclusive.'''
+    days = self.dates.slice_indexer(start, end)
+    return HistoricalsPanel(self.tickers, self.dates[days], self.fields, self.values[:, days], self.mask[:, days])
+
+  def to_historicals(self):
+    '''Converts the panel back to a dict with tickers as keys and OHLCV dataframes as values.'''
+    historicals = dict()
+    for i, ticker in enumerate(self.tickers):
+      historicals[ticker] = pd.DataFrame(data=self.values[i, self.mask[i]],
+                                         columns=self.fields,
+                                         index=self.dates[self.mask[i]])
+    return historicals
+
+  def __repr__(self):
+    return f'HistoricalsPanel({len(self.tickers)} tickers x {len(self.dates)} dates x {len(self.fields)} fields)'
+
+def _datetime_index_to_ns(index):
+  '''Returns a datetime index as int64 nanoseconds since the epoch (UTC for time zone aware indexes).'''
+  if isinstance(index, pd.DatetimeIndex) and index.tz is None:  # Skip building a new index for the common case.
+    return index.values.astype('datetime64[ns]', copy=False).view(np.int64)
+  return pd.DatetimeIndex(index).to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+@metricsmodule.timed_stage('update_coverage_index')
+def update_coverage_index(historicals, filepath, source='yf', replace=False):
+  '''Marks the dates of the historicals in the coverage index saved next to them.
+
+  The coverage index is a small 'coverage_index.hdf5' file in the historicals
+  folder with a bitset per source and ticker, one bit per calendar day. Every
+  save and append function updates it, so gap and availability questions can be
+  answered from a few kilobytes per ticker without reading any price data. The
+  master trading calendar is every day that any ticker has data for.
+
+  Args:
+    historicals: dict with tickers as keys and OHLC data as values. Accepts dataframes
+                 with a datetime index or a 'Date' column (csv or hdf5 formatted) and
+                 arrays of [timestamp, Open, High, Low, Close, Volume] rows.
+    filepath: string of where the historicals are saved.
+    source: string name of where the historicals came from. Defaults 'yf'.
+    replace: bool. If True the tickers' previous dates for the source are replaced,
+             which is used when a file is rewritten. Defaults False, which adds the
+             dates to the previous ones.
+
+  Returns:
+    None
+  '''
+
+  ticker_days = {ticker: _historical_to_epoch_days(historicals[ticker]) for ticker in historicals}
+  if not ticker_days:
+    return
+
+  coverage = _read_coverage_index(filepath)
+  source_coverage = coverage.setdefault(source, {'tickers': [], 'first_day': None, 'bits': np.zeros((0, 0), dtype=np.uint8)})
+  tickers, bits = source_coverage['tickers'], source_coverage['bits']
+
+  all_days = np.concatenate(list(ticker_days.values()))
+  if len(all_days):  # Grow the bitsets to the left or right when the dates fall outside of them.
+    first_day = all_days.min() // 8 * 8
+    if source_coverage['first_day'] is not None:
+      first_day = min(first_day, source_coverage['first_day'])
+      bits = np.pad(bits, ((0, 0), ((source_coverage['first_day'] - first_day) // 8, 0)))
+    byte_count = max(bits.shape[1], (all_days.max() - first_day) // 8 + 1)
+    bits = np.pad(bits, ((0, 0), (0, byte_count - bits.shape[1])))
+    source_coverage['first_day'] = int(first_day)
+
+  ticker_rows = {ticker: i for i, ticker in enumerate(tickers)}
+  new_tickers = [ticker for ticker in ticker_days if ticker not in ticker_rows]
+  for ticker in new_tickers:
+    ticker_rows[ticker] = len(tickers)
+    tickers.append(ticker)
+  bits = np.pad(bits, ((0, len(new_tickers)), (0, 0)))
+
+  if replace:
+    bits[[ticker_rows[ticker] for ticker in ticker_days]] = 0
+  if len(all_days):
+    rows = np.repeat([ticker_rows[ticker] for ticker in ticker_days], [len(days) for days in ticker_days.values()])
+    day_offsets = all_days - source_coverage['first_day']
+    # np.packbits stores the first day of each byte in its highest bit.
+    np.bitwise_or.at(bits, (rows, day_offsets // 8), (1 << (7 - day_offsets % 8)).astype(np.uint8))
+  source_coverage['bits'] = bits
+  _write_coverage_index(filepath, coverage)
+
+def query_missing_dates(filepath, tickers=None, start=None, end=None):
+  '''Gets each ticker's missing dates from the coverage index without loading any prices.
+
+  A date is missing for a ticker if any ticker has data for it (the master
+  trading calendar), it falls between start and end, and no source has data
+  for it for this ticker. Dates before a ticker's first saved date or after its
+  last one are missing too, and a ticker without any saved dates, e.g. one that
+  could not be downloaded, is missing every date of the calendar.
+
+  Args:
+    filepath: string of where the historicals and their coverage index are saved.
+    tickers: list containing each ticker given as a string. Defaults to None,
+             which uses every ticker in the coverage index.
+    start: str with format as 'year-month-day' of the first date to check.
+           Defaults to None, which starts at the master calendar's first date.
+    end: str with format as 'year-month-day' of the last date to check.
+         Defaults to None, which ends at the master calendar's last date.
+
+  Returns:
+    missing_tickers_and_dates: dict with tickers as keys and their missing dates as
+                               a datetimeindex.
+  '''
+
+  tickers, first_day, trading_days, covered = _load_calendar_and_coverage_bits(filepath, tickers)
+  days = first_day + np.arange(covered.shape[1])
+  in_range = np.ones(len(days), dtype=bool)
+  if start is not None:
+    in_range &= days >= _date_to_epoch_day(start)
+  if end is not None:
+    in_range &= days <= _date_to_epoch_day(end)
+
+  missing = trading_days & in_range & ~covered
+  missing_tickers_and_dates = {ticker: _epoch_days_to_dates(days[missing[i]]) for i, ticker in enumerate(tickers)}
+  return missing_tickers_and_dates
+
+def query_coverage_report(filepath, tickers=None):
+  '''Reports each ticker's avaliable dates per source from the coverage index.
+
+  Args:
+    filepath: string of where the historicals and their coverage index are saved.
+    tickers: list containing each ticker given as a string. Defaults to None,
+             which uses every ticker in the coverage index.
+
+  Returns:
+    coverage_report: pandas dataframe with tickers as the index and the columns
+                     'first_date' and 'last_date' of the ticker's data, the amount
+                     of dates from each source as '{source}_days', and 'missing_days'
+                     as the master calendar dates between the first and last date
+                     that no source has.
+  '''
+
+  coverage = _read_coverage_index(filepath)
+  tickers, first_day, trading_days, covered = _load_calendar_and_coverage_bits(filepath, tickers, coverage)
+  days = first_day + np.arange(covered.shape[1])
+
+  has_data, first_positions, last_positions, within_span = _coverage_spans(covered)
+
+  coverage_report = pd.DataFrame(index=pd.Index(tickers, name='Ticker'))
+  coverage_report['first_date'] = _epoch_days_to_dates(days[first_positions]).where(has_data)
+  coverage_report['last_date'] = _epoch_days_to_dates(days[last_positions]).where(has_data)
+  for source in coverage:
+    _, _, source_covered = _load_coverage_bits(filepath, tickers, {source: coverage[source]}, first_day, covered.shape[1])
+    coverage_report[f'{source}_days'] = source_covered.sum(axis=1)
+  coverage_report['missing_days'] = (trading_days & within_span & ~covered).sum(axis=1)
+  return coverage_report
+
+def collect_tickers_with_missing_dates(filepath, start=None, end=None):
+  '''Collects the tickers that have missing dates according to the coverage index.
+
+  The returned tickers can be passed straight to generate_iex_historical_batch_urls
+  in Part 3B to request only the tickers that still have gaps.
+
+  Args:
+    filepath: string of where the historicals and their coverage index are saved.
+    start: str with format as 'year-month-day' of the first date to check. Defaults to None.
+    end: str with format as 'year-month-day' of the last date to check. Defaults to None.
+
+  Returns:
+    tickers_with_missing_dates: list of tickers with at least one missing date.
+  '''
+
+  missing_tickers_and_dates = query_missing_dates(filepath, start=start, end=end)
+  tickers_with_missing_dates = [ticker for ticker, missing_dates in missing_tickers_and_dates.items()
+                                if len(missing_dates)]
+  return tickers_with_missing_dates
+
+def _load_coverage_bits(filepath, tickers=None, coverage=None, first_day=None, day_count=None):
+  '''Returns the tickers, first day and (tickers, days) bool coverage of every source combined.'''
+  if coverage is None:
+    coverage = _read_coverage_index(filepath)
+  if tickers is None:
+    tickers = list(dict.fromkeys(ticker for source_coverage in coverage.values() for ticker in source_coverage['tickers']))
+  if first_day is None:
+    first_days = [source_coverage['first_day'] for source_coverage in coverage.values()]
+    first_day = min(first_days) if first_days else 0
+    day_count = max([source_coverage['first_day'] - first_day + source_coverage['bits'].shape[1] * 8
+                     for source_coverage in coverage.values()], default=0)
+
+  covered = np.zeros((len(tickers), day_count), dtype=bool)
+  for source_coverage in coverage.values():
+    source_rows = {ticker: i for i, ticker in enumerate(source_coverage['tickers'])}
+    positions = [(i, source_rows[ticker]) for i, ticker in enumerate(tickers) if ticker in source_rows]
+    if not positions:
+      continue
+    ticker_positions, source_positions = np.array(positions).T
+    source_bits = np.unpackbits(source_coverage['bits'][source_positions], axis=1).astype(bool)
+    offset = source_coverage['first_day'] - first_day
+    covered[ticker_positions, offset:offset + source_bits.shape[1]] |= source_bits
+  return tickers, first_day, covered
+
+def _load_calendar_and_coverage_bits(filepath, tickers=None, coverage=None):
+  '''Returns the tickers, first day, master trading calendar of every ticker and (tickers, days) coverage of the tickers.'''
+  if coverage is None:
+    coverage = _read_coverage_index(filepath)
+  all_tickers, first_day, all_covered = _load_coverage_bits(filepath, None, coverage)
+  trading_days = all_covered.any(axis=0)  # The calendar comes from every ticker, not only the requested ones.
+  if tickers is None:
+    return all_tickers, first_day, trading_days, all_covered
+  tickers, _, covered = _load_coverage_bits(filepath, tickers, coverage, first_day, all_covered.shape[1])
+  return tickers, first_day, trading_days, covered
+
+def _coverage_spans(covered):
+  '''Returns which tickers have data, their first and last covered positions and a mask of the days between them.'''
+  has_data = covered.any(axis=1)
+  first_positions = np.where(has_data, covered.argmax(axis=1), 0)
+  last_positions = np.where(has_data, covered.shape[1] - 1 - covered[:, ::-1].argmax(axis=1), -1)
+  positions = np.arange(covered.shape[1])
+  within_span = (positions >= first_positions[:, None]) & (positions <= last_positions[:, None])
+  return has_data, first_positions, last_positions, within_span
+
+def _read_coverage_index(filepath):
+  '''Reads the coverage index as a dict with sources as keys and their tickers, first day and bits as values.'''
+  coverage = dict()
+  coverage_filepath = f'{filepath}/coverage_index.hdf5'
+  if not Path(coverage_filepath).is_file():
+    return coverage
+  with h5py.File(coverage_filepath, 'r') as f:
+    for source, source_group in f['sources'].items():
+      coverage[source] = {'tickers': list(source_group['tickers'].asstr()[()]),
+                          'first_day': int(source_group.attrs['first_day']),
+                          'bits': source_group['bits'][()]}
+  return coverage
+
+def _write_coverage_index(filepath, coverage):
+  '''Writes the coverage index to a temporary file and swaps it in, so a crash never leaves half an index.'''
+  coverage_filepath = f'{filepath}/coverage_index.hdf5'
+  temporary_filepath = f'{coverage_filepath}.tmp'
+  with h5py.File(temporary_filepath, 'w') as f:
+    sources = f.create_group('sources')
+    for source, source_coverage in coverage.items():
+      source_group = sources.create_group(source)
+      source_group.attrs['first_day'] = source_coverage['first_day'] if source_coverage['first_day'] is not None else 0
+      source_group.create_dataset(name='tickers', data=source_coverage['tickers'], dtype=h5py.string_dtype())
+      source_group.create_dataset(name='bits', data=source_coverage['bits'], compression='gzip')
+  os.replace(temporary_filepath, coverage_filepath)
+
+def _historical_to_epoch_days(historical):
+  '''Returns the dates of a ticker's historical as int64 days since 1970-01-01.'''
+  if isinstance(historical, pd.DataFrame):
+    if 'Date' in historical.columns:  # csv and hdf5 formatted historicals keep the dates in a column.
+      dates = historical['Date']
+      if pd.api.types.is_numeric_dtype(dates):
+        return np.floor(dates.to_numpy(dtype=np.float64) / 86400).astype(np.int64)
+      return _datetime_index_to_ns(pd.DatetimeIndex(dates)) // (86400 * 10**9)
+    return _datetime_index_to_ns(historical.index) // (86400 * 10**9)
+  rows = np.asarray(historical, dtype=np.float64).reshape(-1, 6)  # hdf5 layout [timestamp, Open, High, Low, Close, Volume] rows.
+  return np.floor(rows[:, 0] / 86400).astype(np.int64)
+
+def _date_to_epoch_day(date):
+  '''Returns a date as days since 1970-01-01.'''
+  return _datetime_index_to_ns(pd.DatetimeIndex([date]))[0] // (86400 * 10**9)
+
+def _epoch_days_to_dates(days):
+  '''Returns days since 1970-01-01 as a datetimeindex.'''
+  return pd.DatetimeIndex(np.asarray(days, dtype=np.int64).astype('datetime64[D]').astype('datetime64[ns]'), name='Date')
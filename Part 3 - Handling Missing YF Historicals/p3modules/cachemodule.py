@@ -0,0 +1,297 @@
+'''Pipeline Cache Module.
+
+Module used by the tutorial modules of Parts 2 and 3 to skip pipeline stages
+whose inputs have not changed since the last run. Caching is opt-in: no stage
+is cached unless it is run through StageCache.call. A stage's result is saved
+to disk under a key made from content hashes of everything that produced it:
+the source of the module defining the function, its arguments (dataframes,
+dates, lists, parameters) and any input files, e.g. the hdf5 historicals or the
+constituents json. Rerunning a stage with the same inputs loads the saved
+result instead of recomputing it, and changing any of them gives a new key.
+Code the stage calls from other modules is not hashed, so pass a new version
+after editing it, or clear the cache. The least recently used results are
+deleted once the cache grows past its size limit.
+
+Results are saved as pickles, which is fine for a cache that can always be
+rebuilt, but the historicals themselves should still be kept as hdf5 files.
+
+Example:
+  import cachemodule
+  cache = cachemodule.StageCache('p3Aoutputs/cache')
+  historicals = cache.call(load_hdf5_historicals, tickers, filepath, input_files=[filepath])
+  missing_tickers_and_dates = cache.call(compile_tickers_and_missing_dates, historicals, tickers, full_date_range)
+
+Functions:
+  StageCache(filepath, max_bytes=2 * 1024**3)
+    On disk cache of stage results keyed on content hashes of their inputs.
+
+  fingerprint(*values)
+    Returns a content hash of the values.
+
+  file_fingerprint(filepath)
+    Returns a content hash of a file or of every file in a folder.
+'''
+
+import datetime as dt
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from collections.abc import Mapping
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+  from . import metricsmodule  # Imported from the p2modules or p3modules folder.
+except ImportError:
+  import metricsmodule
+
+_file_digests = dict()  # Content hashes of the files already read, keyed by path and checked against size and mtime.
+
+class StageCache:
+  '''On disk cache of stage results keyed on content hashes of their inputs.
+
+  Args:
+    filepath: string of the folder to save the results in. Created if it does not exist.
+    max_bytes: int of how many bytes of results are kept before the least recently
+               used ones are deleted. Defaults 2 GiB.
+  '''
+
+  def __init__(self, filepath, max_bytes=2 * 1024**3):
+    self.filepath = Path(filepath)
+    self.max_bytes = max_bytes
+    self.filepath.mkdir(parents=True, exist_ok=True)
+    self._load_file_digests()
+
+  def call(self, function, *args, input_files=None, version=None, **kwargs):
+    '''Returns function(*args, **kwargs), loading it from the cache if the same inputs were already run.
+
+    Args:
+      function: the stage function to run.
+      *args: positional arguments of the function.
+      input_files: list of files or folders the function reads, e.g. where the historicals
+                   are saved. Their contents are hashed into the key, since a filepath
+                   argument alone does not change when the files do. The cache
+                   folder should not be inside them. Defaults to None.
+      version: any value hashed into the key, to be changed after editing code the
+               function calls from another module. Defaults to None.
+      **kwargs: keyword arguments of the function.
+
+    Returns:
+      result: the function's result.
+    '''
+
+    key = self.key(function, *args, input_files=input_files, version=version, **kwargs)
+    result_filepath = self.filepath / f'{key}.pickle'
+    if result_filepath.is_file():
+      try:
+        with open(result_filepath, 'rb') as f:
+          result = pickle.load(f)
+        os.utime(result_filepath)  # Mark as the most recently used.
+        metricsmodule.count('cache_hits')
+        return result
+      except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        result_filepath.unlink(missing_ok=True)  # Recompute results that can no longer be read.
+
+    metricsmodule.count('cache_misses')
+    result = function(*args, **kwargs)
+    self._save_result(result_filepath, result)
+    return result
+
+  def key(self, function, *args, input_files=None, version=None, **kwargs):
+    '''Returns the cache key of function(*args, **kwargs) given its input files and version.'''
+    files = [file_fingerprint(filepath) for filepath in (input_files or [])]
+    key = fingerprint(_function_fingerprint(function), version, args, kwargs, files)
+    if input_files:
+      self._save_file_digests()
+    return key
+
+  def clear(self):
+    '''Deletes every cached result.'''
+    for result_filepath in self.filepath.glob('*.pickle'):
+      result_filepath.unlink(missing_ok=True)
+
+  def size(self):
+    '''Returns how many bytes the cached results take on disk.'''
+    return sum(result_filepath.stat().st_size for result_filepath in self.filepath.glob('*.pickle'))
+
+  def _save_result(self, result_filepath, result):
+    '''Saves a result through a temporary file, then deletes the least recently used results over max_bytes.'''
+    temporary_filepath = result_filepath.with_suffix('.tmp')
+    with open(temporary_filepath, 'wb') as f:
+      pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    if temporary_filepath.stat().st_size > self.max_bytes:  # Never evict everything for a result that cannot fit.
+      temporary_filepath.unlink()
+      return
+    os.replace(temporary_filepath, result_filepath)
+    self._evict()
+
+  def _evict(self):
+    '''Deletes the least recently used results until the cache is at most max_bytes.'''
+    results = []
+    for result_filepath in self.filepath.glob('*.pickle'):
+      stat = result_filepath.stat()
+      results.append((stat.st_mtime_ns, stat.st_size, result_filepath))
+    total_bytes = sum(size for _, size, _ in results)
+    for _, size, result_filepath in sorted(results):
+      if total_bytes <= self.max_bytes:
+        break
+      result_filepath.unlink(missing_ok=True)
+      metricsmodule.count('cache_evictions')
+      total_bytes -= size
+
+  def _load_file_digests(self):
+    '''Loads the file hashes saved by earlier runs, so unchanged files are not read again.'''
+    digests_filepath = self.filepath / 'file_digests.json'
+    if digests_filepath.is_file():
+      with open(digests_filepath, 'r', encoding='utf-8') as f:
+        for path, (size, mtime_ns, digest) in json.load(f).items():
+          _file_digests.setdefault(path, (size, mtime_ns, digest))
+
+  def _save_file_digests(self):
+    '''Saves the file hashes for the next run.'''
+    digests_filepath = self.filepath / 'file_digests.json'
+    temporary_filepath = digests_filepath.with_suffix('.tmp')
+    with open(temporary_filepath, 'w', encoding='utf-8') as f:
+      json.dump(_file_digests, f)
+    os.replace(temporary_filepath, digests_filepath)
+
+  def __repr__(self):
+    return f'StageCache(filepath={str(self.filepath)!r}, max_bytes={self.max_bytes})'
+
+def fingerprint(*values):
+  '''Returns a content hash of the values.
+
+  Supports None, bools, numbers, strings, bytes, dates, numpy arrays, pandas
+  indexes, series and dataframes, and lists, tuples, sets and dicts of them.
+  Objects with a cache_fingerprint() method, e.g. LazyHistoricals, are hashed
+  by what that method returns.
+
+  Raises:
+    TypeError: if a value cannot be hashed.
+  '''
+
+  h = hashlib.sha256()
+  _update_hash(h, values)
+  return h.hexdigest()
+
+def file_fingerprint(filepath):
+  '''Returns a content hash of a file or of every file in a folder.
+
+  A file is only read again if its size or modification time changed since it
+  was last hashed.
+
+  Raises:
+    FileNotFoundError: if nothing exists at the filepath.
+  '''
+
+  path = Path(filepath)
+  if path.is_dir():
+    files = sorted(file for file in path.rglob('*') if file.is_file())
+    return fingerprint([(file.relative_to(path).as_posix(), _file_digest(file)) for file in files])
+  if path.is_file():
+    return _file_digest(path)
+  raise FileNotFoundError(filepath)
+
+def _file_digest(path):
+  '''Returns the content hash of a file, reusing the saved hash if the file has not changed.'''
+  stat = path.stat()
+  key = str(path.resolve())
+  saved = _file_digests.get(key)
+  if saved is not None and saved[0] == stat.st_size and saved[1] == stat.st_mtime_ns:
+    return saved[2]
+
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      h.update(block)
+  _file_digests[key] = (stat.st_size, stat.st_mtime_ns, h.hexdigest())
+  return h.hexdigest()
+
+def _function_fingerprint(function):
+  '''Returns what identifies a function: its name and the source of its module.
+
+  The whole module is hashed rather than only the function, so editing a helper
+  the stage calls from the same module also gives new keys. Functions whose
+  module source cannot be read, e.g. ones defined in a notebook cell, fall back
+  to their own source or bytecode.
+  '''
+
+  function = inspect.unwrap(function)  # Hash the stage itself rather than a metrics wrapper.
+  for source_object in [inspect.getmodule(function), function]:
+    try:
+      source = inspect.getsource(source_object)
+      break
+    except (OSError, TypeError):
+      continue
+  else:
+    source = function.__code__.co_code if hasattr(function, '__code__') else repr(function)
+  return (function.__module__, function.__qualname__, source)
+
+def _update_hash(h, value):
+  '''Adds a value to the hash, prefixed by its type so e.g. 1 and '1' give different hashes.'''
+  if hasattr(value, 'cache_fingerprint'):
+    h.update(b'fingerprint:')
+    _update_hash(h, value.cache_fingerprint())
+  elif value is None or isinstance(value, (bool, int, float, complex, str, dt.date, dt.timedelta, np.generic)):
+    h.update(f'{type(value).__name__}:{value!r};'.encode('utf-8'))
+  elif isinstance(value, bytes):
+    h.update(f'bytes:{len(value)}:'.encode('utf-8'))
+    h.update(value)
+  elif isinstance(value, np.ndarray):
+    h.update(f'ndarray:{value.dtype.str}:{value.shape}:'.encode('utf-8'))
+    if value.dtype.hasobject:
+      _update_hash(h, value.tolist())
+    else:
+      h.update(np.ascontiguousarray(value).tobytes())
+  elif isinstance(value, pd.DataFrame):
+    h.update(f'DataFrame:{value.shape}:'.encode('utf-8'))
+    _update_hash(h, [str(dtype) for dtype in value.dtypes])
+    _update_hash(h, value.columns)
+    _update_hash(h, value.index)
+    if all(isinstance(dtype, np.dtype) and dtype.kind in 'biufc' for dtype in value.dtypes):
+      h.update(np.ascontiguousarray(value.to_numpy()).tobytes())  # Hash numeric columns as one block.
+    else:
+      for _, column in value.items():
+        _update_pandas_values(h, column)
+  elif isinstance(value, pd.Series):
+    h.update(f'Series:{value.dtype}:{value.name!r}:'.encode('utf-8'))
+    _update_hash(h, value.index)
+    _update_pandas_values(h, value)
+  elif isinstance(value, pd.Index):
+    h.update(f'{type(value).__name__}:{value.dtype}:{value.name!r}:{len(value)}:'.encode('utf-8'))
+    _update_pandas_values(h, value)
+  elif isinstance(value, Mapping):
+    h.update(f'{type(value).__name__}:{len(value)}:'.encode('utf-8'))
+    for key in value:  # Keep the insertion order, since results follow it.
+      _update_hash(h, key)
+      _update_hash(h, value[key])
+  elif isinstance(value, (list, tuple)):
+    h.update(f'{type(value).__name__}:{len(value)}:'.encode('utf-8'))
+    for item in value:
+      _update_hash(h, item)
+  elif isinstance(value, (set, frozenset)):
+    h.update(f'{type(value).__name__}:{len(value)}:'.encode('utf-8'))
+    for item_hash in sorted(fingerprint(item) for item in value):
+      h.update(item_hash.encode('utf-8'))
+  else:
+    raise TypeError(f'Cannot fingerprint a {type(value).__name__}')
+
+def _update_pandas_values(h, values):
+  '''Adds the values of a pandas index or series to the hash.
+
+  Numeric and datetime values are hashed as raw bytes, which is much faster than
+  pandas' own row hashing. Object values, e.g. lists of tickers, are hashed one by one.
+  '''
+  array = values.array
+  if hasattr(array, 'asi8'):  # Datetimes, including time zone aware ones, as integers since the epoch.
+    h.update(f'{values.dtype}:'.encode('utf-8'))
+    h.update(np.ascontiguousarray(array.asi8).tobytes())
+  elif isinstance(values.dtype, np.dtype) and not values.dtype.hasobject:
+    h.update(f'{values.dtype.str}:'.encode('utf-8'))
+    h.update(np.ascontiguousarray(values.to_numpy()).tobytes())
+  else:
+    _update_hash(h, values.tolist())
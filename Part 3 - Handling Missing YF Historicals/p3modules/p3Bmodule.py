@@ -14,6 +14,15 @@ Functions:
   partition(tickers, partition_size)
     Partitions tickers into a list of lists with specified partition size.
 
+  download_iex_historicals(batch_urls)
+    Downloads IEX historicals by making API requests to IEX Cloud.
+
+  download_iex_historicals_concurrently(batch_urls, checkpoint_filepath=None, max_in_flight=4, max_retries=3, backoff=1.0, timeout=30)
+    Downloads IEX historicals with pooled connections, retries and resumable checkpoints.
+
+  parse_iex_chart_to_columns(chart)
+    Parses an IEX chart into columnar numpy arrays in one pass.
+
   collect_tickers_not_found_on_iex(historicals, ticker_batches)
     Collects tickers that were not avaliable on IEX Cloud.
 
@@ -38,6 +47,12 @@ Functions:
   merge_historicals(yf_historicals, iex_historicals)
     Merges given historicals.
 
+  merge_historical_sources(sources, columns=None, record_source=False)
+    Merges historicals from any number of sources in priority order.
+
+  validate_chronological_order(historicals, max_workers=None)
+    Validates that every ticker's dates are strictly increasing.
+
   test_for_ordinance(historicals)
     Tests that historicals are all in chronological order.
 '''
@@ -48,9 +63,21 @@ import datetime as dt
 from itertools import chain
 
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import hashlib
+import json
+import os
+import time
 
 from p3Binputs.apitokens import IEX_TOKEN 
 
+try:
+  from . import metricsmodule  # Imported from the p3modules folder.
+except ImportError:
+  import metricsmodule
+
 def generate_iex_historical_batch_urls(tickers, date_length, partition_size=50, IEX_TOKEN=IEX_TOKEN):
   '''Generates historical batch urls for IEX Cloud.
   
@@ -86,6 +113,7 @@ def partition(tickers, partition_size):
     partitioned_tickers.append(tickers[i:i+partition_size])
   return partitioned_tickers
 
+@metricsmodule.timed_stage('download_iex')
 def download_iex_historicals(batch_urls):
   '''Downloads IEX historicals by making API requests to IEX Cloud.
 
@@ -114,6 +142,7 @@ def download_iex_historicals(batch_urls):
 
   for batch_url in batch_urls:
     try:
+      metricsmodule.count('iex_requests')
       hist_response = requests.get(batch_url)
       hist_response.raise_for_status()
       hist_response = hist_response.json()
@@ -121,26 +150,165 @@ def download_iex_historicals(batch_urls):
       print(f'Stopped at batch url: {batch_url}')
       print(f'Status Code: {hist_response.status_code}')
       raise SystemExit(e)
-    for ticker in hist_response:
-      ticker_hist = list()
-      total_amount_of_days = len(hist_response[ticker]['chart'])
-      for day in range(0, total_amount_of_days):
-        current_date = hist_response[ticker]['chart'][day]['date']
-        current_timestamp = dt.datetime.strptime(current_date,"%Y-%m-%d").timestamp()  # Change string date to timestamp to save as in hdf5 format.
-        try:
-          ticker_hist.append([current_timestamp,
-                              hist_response[ticker]['chart'][day]['fOpen'],  # As per IEX Cloud documentation the 'f' in front of
-                              hist_response[ticker]['chart'][day]['fHigh'],  # the OHLCV names specify for the adjusted OHLCV values.
-                              hist_response[ticker]['chart'][day]['fLow'],
-                              hist_response[ticker]['chart'][day]['fClose'],
-                              hist_response[ticker]['chart'][day]['fVolume']])
-          historicals[ticker] = ticker_hist
-        except KeyError as e:
-          print(f"Key Error with {current_date} at {ticker} for {e}")
-          key_error_log.append([ticker, current_date, e])
-      print(f'Finished downloading {ticker}')
+    _add_iex_batch_response_to_historicals(hist_response, historicals, key_error_log)
   return historicals, key_error_log
 
+@metricsmodule.timed_stage('download_iex')
+def download_iex_historicals_concurrently(batch_urls, checkpoint_filepath=None, max_in_flight=4, max_retries=3,
+                                          backoff=1.0, timeout=30):
+  '''Downloads IEX historicals with pooled connections, retries and resumable checkpoints.
+
+  Works the same as download_iex_historicals(batch_urls) but keeps several batch
+  urls in flight at once over a shared pool of keep-alive connections. Transient
+  failures (connection errors, timeouts, 429 and 5xx responses) are retried with
+  exponential backoff. A batch that still fails is logged and skipped instead of
+  stopping the download, so batches that were already paid for are kept.
+
+  If a checkpoint_filepath is given, every finished batch response is written to
+  that folder. Rerunning with the same batch urls and folder loads those batches
+  from disk and only requests the batches that have not finished yet. With
+  metrics enabled, every requested batch is timed as a 'download_iex_batch' span
+  that includes its retries.
+
+  Args:
+    batch_urls: list of IEX batch urls.
+    checkpoint_filepath: string of the folder to write batch checkpoints to.
+                         Defaults to None, which disables checkpoints.
+    max_in_flight: int of how many batch urls are requested at once. Defaults 4.
+    max_retries: int of how many times a transient failure is retried. Defaults 3.
+    backoff: float of seconds to wait before the first retry. The wait doubles
+             after every failed retry unless IEX sends a Retry-After header. Defaults 1.0.
+    timeout: float of seconds to wait for a server response. Defaults 30.
+
+  Returns:
+    historicals: dict with tickers as keys and OHLC data as list of lists.
+                 Each list contains a date as a timestamp and the adjusted OHLCV data
+                 for that date.
+    key_error_log: list of lists of the key errors that occured. Each list contains
+                   which ticker that caused the key error and the date that it happened.
+    failed_batch_urls: list of batch urls that could not be downloaded.
+  '''
+
+  if checkpoint_filepath is not None:
+    Path(checkpoint_filepath).mkdir(parents=True, exist_ok=True)
+
+  session = requests.Session()
+  adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)  # One keep-alive connection per request in flight.
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+
+  def download_batch(batch_url):
+    batch_checkpoint = _iex_batch_checkpoint_filepath(checkpoint_filepath, batch_url)
+    if batch_checkpoint is not None and batch_checkpoint.is_file():
+      with open(batch_checkpoint, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+    with metricsmodule.span('download_iex_batch'):  # Includes the retries, backoff and Retry-After waits.
+      hist_response = _request_iex_batch_with_retries(session, batch_url, max_retries, backoff, timeout)
+    if batch_checkpoint is not None:  # Write to a temporary file first so an interrupted write never looks finished.
+      temporary_checkpoint = batch_checkpoint.with_suffix('.tmp')
+      with open(temporary_checkpoint, 'w', encoding='utf-8') as f:
+        json.dump(hist_response, f)
+      os.replace(temporary_checkpoint, batch_checkpoint)
+    return hist_response
+
+  historicals = dict()
+  key_error_log = []
+  failed_batch_urls = []
+
+  with session, ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+    futures = [executor.submit(download_batch, batch_url) for batch_url in batch_urls]
+    for batch_url, future in zip(batch_urls, futures):  # Parse in batch url order so results match download_iex_historicals.
+      try:
+        hist_response = future.result()
+      except (requests.exceptions.RequestException, ValueError) as e:
+        print(f'Failed batch url: {batch_url}')
+        print(f'Error: {e}')
+        failed_batch_urls.append(batch_url)
+        continue
+      _add_iex_batch_response_to_historicals(hist_response, historicals, key_error_log)
+  return historicals, key_error_log, failed_batch_urls
+
+def _request_iex_batch_with_retries(session, batch_url, max_retries, backoff, timeout):
+  '''Requests a batch url and retries transient failures with exponential backoff.'''
+  transient_status_codes = {429, 500, 502, 503, 504}
+
+  for attempt in range(max_retries + 1):
+    delay = backoff * 2 ** attempt
+    metricsmodule.count('iex_requests')
+    if attempt:
+      metricsmodule.count('iex_retries')
+    try:
+      hist_response = session.get(batch_url, timeout=timeout)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+      if attempt == max_retries:
+        raise
+      time.sleep(delay)
+      continue
+
+    if hist_response.status_code in transient_status_codes and attempt < max_retries:
+      retry_after = hist_response.headers.get('Retry-After', '')
+      time.sleep(float(retry_after) if retry_after.isdigit() else delay)  # IEX tells us how long to wait when throttling.
+      continue
+    hist_response.raise_for_status()
+    return hist_response.json()
+
+def _iex_batch_checkpoint_filepath(checkpoint_filepath, batch_url):
+  '''Returns the checkpoint file for a batch url, named by a hash so the token is not written to disk.'''
+  if checkpoint_filepath is None:
+    return None
+  batch_hash = hashlib.sha1(batch_url.encode('utf-8')).hexdigest()
+  return Path(checkpoint_filepath) / f'{batch_hash}.json'
+
+def _add_iex_batch_response_to_historicals(hist_response, historicals, key_error_log):
+  '''Adds each ticker's chart from an IEX batch response to the historicals.'''
+  for ticker in hist_response:
+    columns, missing_mask = parse_iex_chart_to_columns(hist_response[ticker]['chart'])
+    ticker_hist = np.column_stack(list(columns.values()))[~missing_mask]
+    if len(ticker_hist):  # Tickers without a single complete day are left out like before.
+      historicals[ticker] = ticker_hist.tolist()
+      metricsmodule.count('rows_downloaded', len(ticker_hist))
+
+    for day in np.flatnonzero(missing_mask):  # Only the rare incomplete days are visited one by one.
+      current_date = hist_response[ticker]['chart'][day].get('date')
+      missing_key = next((key for key in ['date', 'fOpen', 'fHigh', 'fLow', 'fClose', 'fVolume']
+                          if pd.isna(hist_response[ticker]['chart'][day].get(key))), 'NaN value')  # NaN counts as missing like None.
+      e = KeyError(missing_key)
+      print(f"Key Error with {current_date} at {ticker} for {e}")
+      key_error_log.append([ticker, current_date, e])
+
+def parse_iex_chart_to_columns(chart):
+  '''Parses an IEX chart into columnar numpy arrays in one pass.
+
+  The chart records are read into columns at once and every date string is
+  parsed in a single vectorized call. Dates are returned as UTC midnight float
+  timestamps, the same as the Yahoo Finance historicals saved in Part 2. Days
+  that are missing a date or any of the adjusted OHLCV values are flagged in
+  the missing mask instead of raising a KeyError.
+
+  Args:
+    chart: list of dicts from an IEX batch response's 'chart' for one ticker.
+
+  Returns:
+    columns: dict with 'Date', 'Open', 'High', 'Low', 'Close' and 'Volume' as keys
+             and float64 numpy arrays as values. Missing values are NaN.
+    missing_mask: bool numpy array that is True for every day with a missing value.
+  '''
+
+  # As per IEX Cloud documentation the 'f' in front of the OHLCV names specify for the adjusted OHLCV values.
+  iex_keys = ['date', 'fOpen', 'fHigh', 'fLow', 'fClose', 'fVolume']
+  chart_frame = pd.DataFrame.from_records(chart, columns=iex_keys)
+  missing_mask = chart_frame.isna().any(axis=1).to_numpy()
+
+  dates = chart_frame['date'].where(~missing_mask, '1970-01-01').to_numpy(dtype=str)
+  timestamps = np.array(dates, dtype='datetime64[D]').astype('datetime64[s]').astype(np.int64).astype(np.float64)
+  timestamps[missing_mask] = np.nan
+
+  columns = {'Date': timestamps}
+  for column, iex_key in zip(['Open', 'High', 'Low', 'Close', 'Volume'], iex_keys[1:]):
+    columns[column] = chart_frame[iex_key].to_numpy(dtype=np.float64, na_value=np.nan)
+  return columns, missing_mask
+
 def collect_tickers_not_found_on_iex(historicals, ticker_batches):
   '''Collects tickers that were not avaliable on IEX Cloud.
 
@@ -180,9 +348,42 @@ def add_missing_iex_tickers_to_historicals(historicals, missing_iex_tickers):
   return historicals
 
 def collect_data_that_is_still_missing(historicals, yf_missing_tickers_and_dates):
-  '''Collects the tickers and dates that are still missing after the IEX download and YF download.'''
-  data_still_missing = {ticker: np.setdiff1d(yf_missing_tickers_and_dates[ticker], historicals[ticker])
-                       for ticker in historicals}
+  '''Collects the tickers and dates that are still missing after the IEX download and YF download.
+
+  Every ticker's missing and downloaded timestamps are tagged with the ticker
+  and sorted together once, so the whole universe is compared in a single
+  sorted join instead of one np.setdiff1d per ticker. Only the timestamp column
+  of the downloaded rows is compared against the missing dates.
+
+  Args:
+    historicals: dict with tickers as keys and OHLC data as a list of lists.
+    yf_missing_tickers_and_dates: dict with tickers as keys and their missing
+                                  dates as float timestamps.
+
+  Returns:
+    data_still_missing: dict with tickers as keys and sorted numpy arrays of the
+                        float timestamps that are still missing as values.
+  '''
+
+  tickers = list(historicals)
+  missing_dates = [np.asarray(yf_missing_tickers_and_dates[ticker], dtype=np.float64).ravel() for ticker in tickers]
+  found_dates = [np.asarray(historicals[ticker], dtype=np.float64).reshape(-1, 6)[:, 0] for ticker in tickers]
+
+  row_tickers = np.repeat(np.tile(np.arange(len(tickers)), 2), [len(dates) for dates in missing_dates + found_dates])
+  row_dates = np.concatenate(missing_dates + found_dates) if tickers else np.empty(0)
+  row_found = np.repeat([False, True], [sum(map(len, missing_dates)), sum(map(len, found_dates))])
+
+  # Sort by ticker then date with found rows first, so a missing row that starts its group was never found.
+  order = np.lexsort((~row_found, row_dates, row_tickers))
+  row_tickers, row_dates, row_found = row_tickers[order], row_dates[order], row_found[order]
+  group_starts = np.ones(len(order), dtype=bool)
+  group_starts[1:] = (row_tickers[1:] != row_tickers[:-1]) | (row_dates[1:] != row_dates[:-1])
+  still_missing = group_starts & ~row_found
+
+  row_tickers, row_dates = row_tickers[still_missing], row_dates[still_missing]
+  ticker_starts = np.searchsorted(row_tickers, np.arange(len(tickers) + 1))
+  data_still_missing = {ticker: row_dates[ticker_starts[i]:ticker_starts[i + 1]]
+                        for i, ticker in enumerate(tickers)}
   return data_still_missing
 
 def convert_timestamps_to_datetimes(data_still_missing):
@@ -260,9 +461,11 @@ def format_data_still_missing_for_json(data_still_missing):
 def merge_historicals(yf_historicals, iex_historicals):
   '''Merges given historicals.
 
-  Historicals are concated with each other and same or overlapping dates 
-  are removed. The merged dataframe is then sorted by ascending dates 
-  from past to present.
+  Historicals are merged with each other and same or overlapping dates 
+  are taken from the Yahoo Finance historicals, with each missing value of
+  a Yahoo Finance row filled from IEX. The merged dataframe is sorted by
+  ascending dates from past to present. See merge_historical_sources(sources)
+  to merge more than two sources.
   
   Args:
     yf_historicals: dict with tickers as keys and OHLC data as values.
@@ -274,17 +477,209 @@ def merge_historicals(yf_historicals, iex_historicals):
     merged_historicals: dict with tickers as keys and OHLC data as a pandas dataframe.
   '''
 
-  merged_historicals = dict()
+  merged_historicals = merge_historical_sources({'yf': yf_historicals, 'iex': iex_historicals})
+  return merged_historicals
+
+@metricsmodule.timed_stage('merge_sources')
+def merge_historical_sources(sources, columns=None, record_source=False):
+  '''Merges historicals from any number of sources in priority order.
+
+  Every source is already sorted by date, so instead of a group-by per ticker
+  the whole universe is merged in one pass. Each row gets an int64 key made of
+  its ticker and date in seconds, and the keys are concatenated ticker by ticker
+  and source by source. A stable sort then only has to merge the already
+  sorted runs, and the rows of every repeated key are in priority order. Each
+  column of a key takes its first value that is not NaN, like a group-by
+  first(), so a lower priority source fills the missing values of a higher
+  priority row.
+
+  Args:
+    sources: dict with source names as keys and historicals as values, ordered from
+             the highest to the lowest priority, e.g. {'yf': yf_historicals,
+             'iex': iex_historicals, 'csv': csv_historicals}. Each ticker's data is a
+             pandas dataframe with a datetime index, or a list of lists or numpy array
+             of [timestamp, Open, High, Low, Close, Volume] rows like the IEX downloads.
+    columns: list of the columns to merge. Defaults to None, which merges
+             ['Open', 'High', 'Low', 'Close', 'Volume'].
+    record_source: bool. If True a categorical 'Source' column records the highest
+                   priority source with any value of each row. Defaults False.
+
+  Returns:
+    merged_historicals: dict with tickers as keys and OHLC data as a pandas dataframe.
+                        A ticker's dates keep the time zone and resolution of its
+                        highest priority dataframe with a datetime index, e.g.
+                        America/New_York for Yahoo Finance, and are naive UTC
+                        nanoseconds if it only has IEX style rows.
+  '''
+
+  if columns is None:
+    columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+  source_names = list(sources)
+  all_tickers = list(dict.fromkeys(chain.from_iterable(sources.values())))  # Keep the first seen ticker order.
+
+  row_tickers, row_sources, row_dates, row_values = [], [], [], []
+  ticker_index_formats = dict()
+  for ticker_position, ticker in enumerate(all_tickers):
+    for source_position, source_name in enumerate(source_names):
+      if ticker not in sources[source_name]:
+        continue
+      historical = sources[source_name][ticker]
+      if isinstance(historical, pd.DataFrame) and isinstance(historical.index, pd.DatetimeIndex):
+        ticker_index_formats.setdefault(ticker, (historical.index.tz, historical.index.unit))
+      dates, values = _source_to_ns_dates_and_values(historical, columns)
+      has_values = ~np.isnan(values).all(axis=1)
+      row_dates.append(dates[has_values])
+      row_values.append(values[has_values])
+      row_tickers.append(np.full(has_values.sum(), ticker_position, dtype=np.int64))
+      row_sources.append(np.full(has_values.sum(), source_position, dtype=np.int8))
+
+  if not row_dates:
+    return dict()
+  row_tickers, row_sources = np.concatenate(row_tickers), np.concatenate(row_sources)
+  row_dates, row_values = np.concatenate(row_dates), np.concatenate(row_values)
+
+  seconds, remainder = np.divmod(row_dates, 10**9)
+  if len(seconds):
+    seconds -= seconds.min()
+  if not remainder.any() and seconds.max(initial=0) < 2**32 and len(all_tickers) < 2**31:
+    row_keys = (row_tickers << 32) | seconds
+    order = np.argsort(row_keys, kind='stable')  # Timsort merges the already sorted runs in about linear time.
+    sorted_keys = row_keys[order]
+    first_of_key = np.ones(len(order), dtype=bool)
+    first_of_key[1:] = sorted_keys[1:] != sorted_keys[:-1]
+  else:  # Sub-second dates or a span over 136 years do not fit in one key.
+    order = np.lexsort((row_sources, row_dates, row_tickers))
+    sorted_tickers, sorted_dates = row_tickers[order], row_dates[order]
+    first_of_key = np.ones(len(order), dtype=bool)
+    first_of_key[1:] = (sorted_tickers[1:] != sorted_tickers[:-1]) | (sorted_dates[1:] != sorted_dates[:-1])
+
+  key_starts = np.flatnonzero(first_of_key)
+  kept_rows = order[key_starts]  # The first row of every key comes from the highest priority source.
+  row_tickers, row_sources, row_dates = row_tickers[kept_rows], row_sources[kept_rows], row_dates[kept_rows]
+  row_values = _first_values_per_key(row_values[order], key_starts)
 
-  all_tickers = set(yf_historicals.keys()) + set(iex_historicals.keys())
-  for ticker in all_tickers:
-    merged_historicals[ticker] = pd.concat([yf_historicals[ticker], iex_historicals[ticker]])
-    merged_historicals[ticker] = merged_historicals[ticker].groupby(merged_historicals[ticker].index).first().sort_index()
+  merged_historicals = dict()
+  column_index = pd.Index(columns)
+  ticker_starts = np.searchsorted(row_tickers, np.arange(len(all_tickers) + 1))
+  for ticker_position, ticker in enumerate(all_tickers):
+    rows = slice(ticker_starts[ticker_position], ticker_starts[ticker_position + 1])
+    index = pd.DatetimeIndex(row_dates[rows].view('datetime64[ns]'), name='Date')
+    if ticker in ticker_index_formats:  # The int64 dates are UTC nanoseconds, so convert them back to the source's dtype.
+      tz, unit = ticker_index_formats[ticker]
+      index = index.as_unit(unit) if tz is None else index.tz_localize('UTC').tz_convert(tz).as_unit(unit)
+    merged = pd.DataFrame(data=row_values[rows], columns=column_index, index=index)
+    if record_source:
+      merged['Source'] = pd.Categorical.from_codes(row_sources[rows], categories=source_names)
+    merged_historicals[ticker] = merged
   return merged_historicals
 
+def _first_values_per_key(sorted_values, key_starts):
+  '''Returns each column's first value that is not NaN in every run of rows starting at the key_starts.
+
+  Most keys have a single row, so the first rows are taken as they are and only
+  the NaNs of repeated keys are filled, one lower priority row at a time.
+  '''
+  first_values = sorted_values[key_starts]
+  key_sizes = np.diff(np.append(key_starts, len(sorted_values)))
+  repeated_keys = np.flatnonzero(key_sizes > 1)
+  for offset in range(1, key_sizes.max(initial=1)):
+    repeated_keys = repeated_keys[key_sizes[repeated_keys] > offset]
+    missing = np.isnan(first_values[repeated_keys])
+    if not missing.any():
+      break
+    lower_priority_values = sorted_values[key_starts[repeated_keys] + offset]
+    first_values[repeated_keys] = np.where(missing, lower_priority_values, first_values[repeated_keys])
+  return first_values
+
+def _source_to_ns_dates_and_values(historical, columns):
+  '''Returns a source's int64 UTC nanosecond dates and float64 values for the columns.'''
+  if isinstance(historical, pd.DataFrame):
+    dates = _datetime_index_to_ns(historical.index)
+    column_positions = historical.columns.get_indexer(columns)
+    values = historical.to_numpy(dtype=np.float64)[:, column_positions]
+    values[:, column_positions < 0] = np.nan  # Columns the source does not have.
+  else:  # IEX style [timestamp, Open, High, Low, Close, Volume] rows.
+    rows = np.asarray(historical, dtype=np.float64).reshape(-1, 6)
+    dates = (rows[:, 0] * 10**9).round().astype(np.int64)
+    all_columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+    values = np.column_stack([rows[:, 1 + all_columns.index(column)] if column in all_columns
+                              else np.full(len(rows), np.nan)
+                              for column in columns]).reshape(len(rows), len(columns))
+  return dates, values
+
+@metricsmodule.timed_stage('validate_order')
+def validate_chronological_order(historicals, max_workers=None):
+  '''Validates that every ticker's dates are strictly increasing.
+
+  Every ticker's int64 date index is concatenated and checked with a single
+  vectorized diff, so the whole universe is validated at once and every bad
+  ticker is reported instead of only the first one. With max_workers the
+  tickers are split into that many chunks that are checked on a thread pool.
+
+  Args:
+    historicals: dict with tickers as keys and OHLC data as values.
+                 Each OHLC data is given as a pandas dataframe.
+    max_workers: int of how many chunks to check in parallel. Defaults to None,
+                 which checks every ticker in one pass.
+
+  Returns:
+    ordinance_report: dict with the tickers that are not in chronological order as
+                      keys. Each value is a dict with
+                      'positions': int numpy array of the rows that are not after the previous row,
+                      'duplicates': datetimeindex of dates equal to the previous date,
+                      'out_of_order': datetimeindex of dates before the previous date.
+  '''
+
+  tickers = list(historicals)
+  if not max_workers or max_workers < 2 or len(tickers) < 2:
+    return _find_ordinance_errors(historicals, tickers)
+
+  chunk_size = -(-len(tickers) // max_workers)  # Ceiling division so there are at most max_workers chunks.
+  ticker_chunks = partition(tickers, chunk_size)
+  ordinance_report = dict()
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    for chunk_report in executor.map(lambda chunk: _find_ordinance_errors(historicals, chunk), ticker_chunks):
+      ordinance_report.update(chunk_report)
+  return ordinance_report
+
+def _find_ordinance_errors(historicals, tickers):
+  '''Finds the rows that are not after their previous row for the tickers in one vectorized pass.'''
+  if not tickers:
+    return dict()
+  ticker_dates = [_datetime_index_to_ns(historicals[ticker].index) for ticker in tickers]
+  offsets = np.zeros(len(tickers) + 1, dtype=np.int64)
+  np.cumsum([len(dates) for dates in ticker_dates], out=offsets[1:])
+
+  all_dates = np.concatenate(ticker_dates)
+  steps = np.diff(all_dates)
+  bad_rows = np.flatnonzero(steps <= 0) + 1
+  bad_rows = bad_rows[~np.isin(bad_rows, offsets)]  # A ticker's first row is never compared to the previous ticker.
+
+  ordinance_report = dict()
+  bad_tickers = np.searchsorted(offsets, bad_rows, side='right') - 1
+  for ticker_position in np.unique(bad_tickers):
+    rows = bad_rows[bad_tickers == ticker_position]
+    row_steps = steps[rows - 1]
+    ordinance_report[tickers[ticker_position]] = {
+      'positions': rows - offsets[ticker_position],
+      'duplicates': pd.DatetimeIndex(all_dates[rows[row_steps == 0]].view('datetime64[ns]')),
+      'out_of_order': pd.DatetimeIndex(all_dates[rows[row_steps < 0]].view('datetime64[ns]'))}
+  return ordinance_report
+
+def _datetime_index_to_ns(index):
+  '''Returns datetimes as int64 nanoseconds since the epoch (UTC for time zone aware datetimes).'''
+  if isinstance(index, pd.DatetimeIndex) and index.tz is None:  # Skip building a new index for the common case.
+    return index.values.astype('datetime64[ns]', copy=False).view(np.int64)
+  return pd.DatetimeIndex(index).to_numpy(dtype='datetime64[ns]').view(np.int64)
+
 def test_for_ordinance(historicals):
   '''Tests that historicals are all in chronological order.
 
+  Every ticker that is not in chronological order is printed with the first
+  date that is out of order. See validate_chronological_order(historicals)
+  for the full report.
+
   Args:
     historicals: dict with tickers as keys and OHLC data as values.
                  Each OHLC data is given as a pandas dataframe. 
@@ -294,14 +689,9 @@ def test_for_ordinance(historicals):
                or False if the data is not in chronological order
   '''
 
-  ordinance = True
-  for ticker in historicals:
-    current_date = dt.date.min
-    for date in historicals[ticker].index:
-      if current_date > date or current_date == date:
-        print(f'Error with ticker {ticker} on {date}')
-        ordinance = False
-        return ordinance
-      else:
-        current_date = date
+  ordinance_report = validate_chronological_order(historicals)
+  for ticker, errors in ordinance_report.items():
+    date = historicals[ticker].index[errors['positions'][0]]
+    print(f'Error with ticker {ticker} on {date}')
+  ordinance = not ordinance_report
   return ordinance
\ No newline at end of file
@@ -4,9 +4,18 @@ Module used for the GitHub repository "Part 3 - Handling Missing YF Historicals.
 Part 3A's functions focus on EDA analysis for missing Yahoo Finance historicals.
 
 Functions:
-  load_hdf5_historicals(tickers, filepath)
+  load_hdf5_historicals(tickers, filepath, start=None, end=None, columns=None)
     Load hdf5 historicals to memory.
 
+  load_hdf5_historicals_in_parallel(tickers, filepath, start=None, end=None, columns=None, max_workers=None)
+    Load hdf5 historicals to memory with a pool of processes decoding the files.
+
+  LazyHistoricals(tickers, filepath, cache_size=64, start=None, end=None, columns=None)
+    Dict-like historicals that only load a ticker's hdf5 file when it is accessed.
+
+  load_hdf5_store_historicals(tickers, filepath, store_name='historicals_store')
+    Load historicals from a consolidated hdf5 store to memory.
+
   collect_all_historical_lengths(historicals) 
     Collects all common historical lengths.
 
@@ -19,14 +28,17 @@ Functions:
   compile_tickers_and_missing_dates(historicals, tickers, full_date_range)
     Compiles all missing dates for the tickers.
 
-  filter_out_the_dates_not_in_sp500(tickers_and_dates, sp500_changes)
-    Filters out the dates when the tickers are not in the SP500.
-  
-  _collect_date_ranges_when_in_sp500(dates_mask)
-    Collects all dates when the ticker was in the SP500.
+  compute_universe_gaps(historicals, calendar, tickers=None)
+    Computes the missing dates of every ticker on a shared master calendar in one pass.
+
+  UniverseGaps(tickers, calendar, missing_bits)
+    Compact bitmap of the missing (ticker, date) pairs on a master calendar.
 
-  _collect_each_date_when_in_sp500(dates, date_ranges_in_sp500)
-    Collects all dates for the given SP500 date ranges.
+  build_sp500_membership_intervals(sp500_changes)
+    Builds an index of the date intervals each ticker was in the SP500.
+
+  filter_out_the_dates_not_in_sp500(tickers_and_dates, sp500_changes, membership_intervals=None)
+    Filters out the dates when the tickers are not in the SP500.
 
   remove_tickers_with_no_missing_dates_while_in_sp500(true_missing_tickers_and_dates)
     Removes tickers with no missing dates while in the SP500.
@@ -38,6 +50,7 @@ Functions:
     Formats missing tickers and dates to save as a json. 
 '''
 
+import numpy as np
 import pandas as pd
 import datetime as dt
 from dateutil.relativedelta import relativedelta
@@ -47,14 +60,35 @@ import matplotlib.pyplot as plt
 
 import h5py
 import json
+import os
 from pathlib import Path
-
-def load_hdf5_historicals(tickers, filepath):
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from collections import OrderedDict
+from collections.abc import Mapping
+
+try:
+  from . import cachemodule, metricsmodule  # Imported from the p3modules folder.
+except ImportError:
+  import cachemodule
+  import metricsmodule
+
+@metricsmodule.timed_stage('load_hdf5')
+def load_hdf5_historicals(tickers, filepath, start=None, end=None, columns=None):
   '''Load hdf5 historicals to memory.
 
+  With start or end the first and last rows are found by a binary search over
+  the stored dates, and only those rows and the requested columns are read, so
+  loading the last few years of 'Close' decodes a fraction of each file.
+  Files saved with the compact schema load as float32 prices and uint64 volume.
+
   Args:
     tickers: list containing each ticker given as a string.
     filepath: string of where the historicals are saved.
+    start: str with format as 'year-month-day' of the first date to load. Defaults to None.
+    end: str with format as 'year-month-day' of the last date to load. Defaults to None.
+    columns: list of the columns to load from {'Open', 'High', 'Low', 'Close', 'Volume'}.
+             Defaults to None, which loads all of them.
 
   Returns:
     historicals: dict with tickers as keys and OHLC data as values.
@@ -62,21 +96,278 @@ def load_hdf5_historicals(tickers, filepath):
   '''
 
   historicals = dict()
-  columns = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
-  
+
   for ticker in tickers:
     hdf5_filepath = f'{filepath}/{ticker}.hdf5'
     ticker_file = Path(hdf5_filepath)
     if ticker_file.is_file():
+      historicals[ticker] = _load_hdf5_historical(hdf5_filepath, start, end, columns)
+    else:
+      print(f'Error {ticker} ticker is missing')
+  print('All Historicals Have Been Loaded')
+  return historicals
+
+@metricsmodule.timed_stage('load_hdf5')
+def load_hdf5_historicals_in_parallel(tickers, filepath, start=None, end=None, columns=None, max_workers=None):
+  '''Load hdf5 historicals to memory with a pool of processes decoding the files.
+
+  Works the same as load_hdf5_historicals(tickers, filepath, start, end, columns),
+  but h5py holds the GIL while it decompresses, so threads cannot speed it up.
+  Here each worker process decodes its files straight into one block of shared
+  memory, and only the shape and dtype of each ticker's rows are sent back, so
+  no dataframes are pickled between processes. Loading the full universe then
+  scales with the amount of cores. For a few tickers the cost of starting the
+  processes outweighs the gain, so use load_hdf5_historicals instead.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    filepath: string of where the historicals are saved.
+    start: str with format as 'year-month-day' of the first date to load. Defaults to None.
+    end: str with format as 'year-month-day' of the last date to load. Defaults to None.
+    columns: list of the columns to load from {'Open', 'High', 'Low', 'Close', 'Volume'}.
+             Defaults to None, which loads all of them.
+    max_workers: int of how many processes decode the files. Defaults to None, which uses every core.
+
+  Returns:
+    historicals: dict with tickers as keys and OHLC data as values.
+                 Each OHLC data is given as a pandas dataframe.
+  '''
+
+  hdf5_filepaths = dict()
+  byte_offsets = [0]
+  for ticker in tickers:  # Reading the dataset shapes only touches the file metadata.
+    hdf5_filepath = f'{filepath}/{ticker}.hdf5'
+    if Path(hdf5_filepath).is_file():
       with h5py.File(hdf5_filepath, 'r') as f:
-        group = f['historicals']
-        data = group['15Y'][()]
-      dataset = pd.DataFrame(data=data, columns=columns)
-      dataset['Date'] = pd.to_datetime(dataset['Date'], unit='s')  # Change the float timestamps back to datetimes.
-      dataset = dataset.set_index('Date')
-      historicals[ticker] = dataset
+        dataset = f['historicals']['15Y']
+        dataset_bytes = dataset.size * dataset.dtype.itemsize
+      hdf5_filepaths[ticker] = hdf5_filepath
+      byte_offsets.append(byte_offsets[-1] + -(-dataset_bytes // 8) * 8)  # Keep every ticker's rows 8 byte aligned.
     else:
       print(f'Error {ticker} ticker is missing')
+
+  historicals = dict()
+  shared = shared_memory.SharedMemory(create=True, size=max(1, byte_offsets[-1]))
+  try:
+    tasks = [(hdf5_filepath, offset, start, end, columns) for hdf5_filepath, offset in zip(hdf5_filepaths.values(), byte_offsets)]
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_attach_shared_memory, initargs=(shared.name,)) as executor:
+      results = executor.map(_read_hdf5_rows_into_shared_memory, tasks, chunksize=max(1, len(tasks) // (4 * workers)))
+      for ticker, offset, (shape, dtype) in zip(hdf5_filepaths, byte_offsets, results):
+        data = np.ndarray(shape, dtype, buffer=shared.buf, offset=offset).copy()  # Copy out before the shared memory is freed.
+        metricsmodule.count('rows_read', len(data))
+        metricsmodule.count('bytes_read', data.nbytes)
+        historicals[ticker] = _hdf5_rows_to_dataframe(data, columns)
+  finally:
+    shared.close()
+    shared.unlink()
+  print('All Historicals Have Been Loaded')
+  return historicals
+
+_shared_rows = None  # The shared memory block of a load_hdf5_historicals_in_parallel worker process.
+
+def _attach_shared_memory(name):
+  '''Attaches a worker process to the shared memory block it decodes rows into.'''
+  global _shared_rows
+  _shared_rows = shared_memory.SharedMemory(name=name)
+
+def _read_hdf5_rows_into_shared_memory(task):
+  '''Decodes a ticker's requested rows directly into the shared memory at the offset and returns their shape and dtype.'''
+  hdf5_filepath, offset, start, end, columns = task
+  with h5py.File(hdf5_filepath, 'r') as f:
+    dataset = f['historicals']['15Y']
+    rows, read_positions = _hdf5_selection(dataset, start, end, columns)
+    row_count = rows.stop - rows.start
+    if dataset.dtype.names is not None:  # Compact rows are read whole, the loaded dataframe picks the columns.
+      shape, selection = (row_count,), np.s_[rows]
+    elif read_positions == list(range(6)):
+      shape, selection = (row_count, 6), np.s_[rows]
+    else:
+      shape, selection = (row_count, len(read_positions)), np.s_[rows, read_positions]
+    data = np.ndarray(shape, dataset.dtype, buffer=_shared_rows.buf, offset=offset)
+    if row_count:
+      dataset.read_direct(data, selection)
+    del data  # Release the view so the shared memory can be closed.
+    return shape, dataset.dtype
+
+def _load_hdf5_historical(hdf5_filepath, start=None, end=None, columns=None):
+  '''Loads a single ticker's hdf5 file as a pandas dataframe, only reading the rows and columns asked for.'''
+  with h5py.File(hdf5_filepath, 'r') as f:
+    dataset = f['historicals']['15Y']
+    rows, read_positions = _hdf5_selection(dataset, start, end, columns)
+    if dataset.dtype.names is not None:
+      data = dataset.fields(['Date'] + list(columns or _HDF5_COLUMNS))[rows]
+    elif read_positions == list(range(6)):
+      data = dataset[rows]
+    else:
+      data = dataset[rows, read_positions]
+  metricsmodule.count('rows_read', len(data))
+  metricsmodule.count('bytes_read', data.nbytes)
+  return _hdf5_rows_to_dataframe(data, columns)
+
+_HDF5_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+def _hdf5_selection(dataset, start=None, end=None, columns=None):
+  '''Returns the slice of rows between start and end and the sorted column positions to read from the '15Y' dataset.'''
+  positions = [1 + _HDF5_COLUMNS.index(column) for column in (columns or _HDF5_COLUMNS)]
+  read_positions = [0] + sorted(set(positions))  # h5py reads columns in increasing order, reorder them afterwards.
+  first_row, last_row = 0, dataset.shape[0]
+  if start is not None:
+    first_row = _bisect_hdf5_dates(dataset, pd.Timestamp(start))
+  if end is not None:  # The end date is inclusive of the whole day, like slicing a datetime index with a date string.
+    last_row = _bisect_hdf5_dates(dataset, pd.Timestamp(end).normalize() + pd.Timedelta(days=1))
+  return slice(first_row, max(first_row, last_row)), read_positions
+
+def _hdf5_rows_to_dataframe(data, columns=None):
+  '''Converts rows read from a '15Y' dataset, with the Date and the read columns, to a pandas dataframe.'''
+  columns = list(columns or _HDF5_COLUMNS)
+  if data.dtype.names is not None:  # Keep the compact dtypes instead of upcasting them to float64.
+    dates = data['Date'].astype('datetime64[ns]')
+    dataset = pd.DataFrame({column: data[column] for column in columns}, index=pd.DatetimeIndex(dates, name='Date'))
+    return dataset
+  positions = [1 + _HDF5_COLUMNS.index(column) for column in columns]
+  read_positions = [0] + sorted(set(positions))
+  dates = pd.to_datetime(data[:, 0], unit='s')  # Change the float timestamps back to datetimes.
+  values = data[:, [read_positions.index(position) for position in positions]]
+  dataset = pd.DataFrame(data=values, columns=columns, index=pd.DatetimeIndex(dates, name='Date'))
+  return dataset
+
+def _bisect_hdf5_dates(dataset, date):
+  '''Returns the first row of the '15Y' dataset dated at or after the date.
+
+  Only the Date of each probed row is read, so finding a row costs about
+  log2(rows) single values instead of decoding the whole dataset.
+  '''
+  compact = dataset.dtype.names is not None
+  timestamp = date.value if compact else date.timestamp()  # Nanoseconds for the compact schema, float seconds otherwise.
+  low, high = 0, dataset.shape[0]
+  while low < high:
+    middle = (low + high) // 2
+    stored_date = dataset[middle]['Date'] if compact else dataset[middle, 0]
+    if stored_date < timestamp:
+      low = middle + 1
+    else:
+      high = middle
+  return low
+
+class LazyHistoricals(Mapping):
+  '''Dict-like historicals that only load a ticker's hdf5 file when it is accessed.
+
+  Can be used anywhere the dict from load_hdf5_historicals(tickers, filepath) is
+  used, e.g. historicals[ticker], historicals.items() and len(historicals).
+  A ticker's '15Y' dataset is decoded on first access and kept in a least
+  recently used cache of at most cache_size dataframes, so memory stays bounded
+  no matter how many tickers are iterated over.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    filepath: string of where the historicals are saved.
+    cache_size: int of how many decoded dataframes are kept in memory. Defaults 64.
+    start: str with format as 'year-month-day' of the first date to load. Defaults to None.
+    end: str with format as 'year-month-day' of the last date to load. Defaults to None.
+    columns: list of the columns to load from {'Open', 'High', 'Low', 'Close', 'Volume'}.
+             Defaults to None, which loads all of them.
+  '''
+
+  def __init__(self, tickers, filepath, cache_size=64, start=None, end=None, columns=None):
+    self.filepath = filepath
+    self.cache_size = cache_size
+    self.start, self.end, self.columns = start, end, columns
+    self._tickers = []
+    self._cache = OrderedDict()
+
+    for ticker in tickers:
+      if Path(f'{filepath}/{ticker}.hdf5').is_file():
+        self._tickers.append(ticker)
+      else:
+        print(f'Error {ticker} ticker is missing')
+    self._ticker_set = set(self._tickers)
+
+  def __getitem__(self, ticker):
+    if ticker in self._cache:
+      self._cache.move_to_end(ticker)  # Mark as the most recently used.
+      return self._cache[ticker]
+    if ticker not in self._ticker_set:
+      raise KeyError(ticker)
+
+    dataset = _load_hdf5_historical(f'{self.filepath}/{ticker}.hdf5', self.start, self.end, self.columns)
+    self._cache[ticker] = dataset
+    if len(self._cache) > self.cache_size:
+      self._cache.popitem(last=False)  # Evict the least recently used dataframe.
+    return dataset
+
+  def __contains__(self, ticker):
+    return ticker in self._ticker_set  # Avoid the Mapping default, which would decode the file.
+
+  def __iter__(self):
+    return iter(self._tickers)
+
+  def __len__(self):
+    return len(self._tickers)
+
+  def cache_fingerprint(self):
+    '''Returns what identifies the historicals to cachemodule without decoding any file.'''
+    files = [cachemodule.file_fingerprint(f'{self.filepath}/{ticker}.hdf5') for ticker in self._tickers]
+    return (self._tickers, files, self.start, self.end, self.columns)
+
+  def __repr__(self):
+    return f'LazyHistoricals({len(self._tickers)} tickers, {len(self._cache)} cached, filepath={self.filepath!r})'
+
+@metricsmodule.timed_stage('load_store')
+def load_hdf5_store_historicals(tickers, filepath, store_name='historicals_store'):
+  '''Load historicals from a consolidated hdf5 store to memory.
+
+  Drop-in replacement for load_hdf5_historicals(tickers, filepath). Requested
+  tickers that sit next to each other in the store are read together, so
+  loading the full universe is a single read of the '15Y' dataset.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    filepath: string of the folder the store is saved in.
+    store_name: string name of the store file. Defaults to 'historicals_store'.
+
+  Returns:
+    historicals: dict with tickers as keys and OHLC data as values.
+                 Each OHLC data is given as a pandas dataframe.
+  '''
+
+  historicals = dict()
+  columns = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+  store_filepath = f'{filepath}/{store_name}.hdf5'
+  with h5py.File(store_filepath, 'r') as f:
+    stored_tickers = f['index']['tickers'].asstr()[()]
+    offsets = f['index']['offsets'][()]
+    store_positions = {ticker: i for i, ticker in enumerate(stored_tickers)}
+
+    positions = []
+    for ticker in tickers:
+      if ticker in store_positions:
+        positions.append(store_positions[ticker])
+      else:
+        print(f'Error {ticker} ticker is missing')
+    positions = np.unique(positions).astype(np.int64)
+
+    # Group neighbouring tickers into runs so each run is one contiguous read.
+    run_starts = np.flatnonzero(np.diff(positions, prepend=-2) != 1)
+    run_ends = np.append(run_starts[1:], len(positions))
+
+    loaded = dict()
+    for run_start, run_end in zip(run_starts, run_ends):
+      first, last = positions[run_start], positions[run_end - 1]
+      block = f['historicals']['15Y'][offsets[first]:offsets[last + 1]]
+      metricsmodule.count('rows_read', len(block))
+      metricsmodule.count('bytes_read', block.nbytes)
+      dates = pd.to_datetime(block[:, 0], unit='s')  # Change the float timestamps back to datetimes once per run.
+      for position in positions[run_start:run_end]:
+        rows = slice(offsets[position] - offsets[first], offsets[position + 1] - offsets[first])
+        dataset = pd.DataFrame(data=block[rows, 1:], columns=columns[1:], index=dates[rows])
+        dataset.index.name = 'Date'
+        loaded[stored_tickers[position]] = dataset
+
+  for ticker in tickers:  # Keep the requested ticker order like load_hdf5_historicals.
+    if ticker in loaded:
+      historicals[ticker] = loaded[ticker]
   print('All Historicals Have Been Loaded')
   return historicals
 
@@ -144,17 +435,179 @@ def compile_tickers_and_missing_dates(historicals, tickers, full_date_range):
     missing_tickers_and_dates: dict with tickers as keys and their missing dates as values.
   '''
 
-  missing_tickers_and_dates = {ticker: full_date_range.difference(historicals[ticker].index) 
-                              for ticker in tickers}
+  missing_tickers_and_dates = compute_universe_gaps(historicals, full_date_range, tickers).to_dict()
   return missing_tickers_and_dates
 
-def filter_out_the_dates_not_in_sp500(tickers_and_dates, sp500_changes):
+@metricsmodule.timed_stage('universe_gaps')
+def compute_universe_gaps(historicals, calendar, tickers=None):
+  '''Computes the missing dates of every ticker on a shared master calendar in one pass.
+
+  Every ticker's dates are concatenated and placed on the calendar with a single
+  binary search, instead of a separate sorted difference per ticker. The result
+  is a compact bitmap that can be updated after each backfill source with
+  UniverseGaps.apply_backfill(historicals).
+
+  Args:
+    historicals: dict with tickers as keys and OHLC data as values. Each OHLC data is
+                 a pandas dataframe with a datetime index, a datetimeindex, a list of
+                 lists of [timestamp, Open, High, Low, Close, Volume] rows like the IEX
+                 downloads or a list of float timestamps.
+    calendar: datetimeindex of the master calendar, e.g. the full date range.
+    tickers: list containing each ticker given as a string. Defaults to None, which
+             uses every ticker in the historicals. Tickers that are not in the
+             historicals are missing every calendar date.
+
+  Returns:
+    universe_gaps: UniverseGaps with the missing (ticker, date) pairs.
+  '''
+
+  tickers = list(historicals) if tickers is None else list(tickers)
+  calendar = pd.DatetimeIndex(calendar)
+  if not (calendar.is_monotonic_increasing and calendar.is_unique):
+    calendar = calendar.unique().sort_values()
+
+  present = _mark_dates_on_calendar(historicals, tickers, _datetime_index_to_ns(calendar))
+  universe_gaps = UniverseGaps(tickers, calendar, np.packbits(~present, axis=1))
+  return universe_gaps
+
+class UniverseGaps:
+  '''Compact bitmap of the missing (ticker, date) pairs on a master calendar.
+
+  Each ticker is a row of bits over the calendar, packed 8 dates to a byte, so
+  the whole universe's gaps take a few hundred kilobytes. Build it with
+  compute_universe_gaps(historicals, calendar).
+
+  Args:
+    tickers: list of tickers in the order of the bitmap's rows.
+    calendar: datetimeindex of the master calendar in the order of the bitmap's bits.
+    missing_bits: uint8 numpy array from np.packbits with shape (tickers, ceil(dates / 8)).
+  '''
+
+  def __init__(self, tickers, calendar, missing_bits):
+    self.tickers = list(tickers)
+    self.calendar = calendar
+    self.missing_bits = missing_bits
+
+  @property
+  def missing(self):
+    '''Unpacked bool numpy array with shape (tickers, dates). True where the date is missing.'''
+    return np.unpackbits(self.missing_bits, axis=1, count=len(self.calendar)).astype(bool)
+
+  def apply_backfill(self, historicals):
+    '''Returns new gaps with the dates that the backfill historicals have filled in.
+
+    Args:
+      historicals: dict with tickers as keys and the backfill source's OHLC data as
+                   values, in any of the forms compute_universe_gaps accepts.
+    '''
+
+    filled = _mark_dates_on_calendar(historicals, self.tickers, _datetime_index_to_ns(self.calendar))
+    return UniverseGaps(self.tickers, self.calendar, self.missing_bits & ~np.packbits(filled, axis=1))
+
+  def missing_counts(self):
+    '''Returns a dict with tickers as keys and how many dates they are missing as values.'''
+    return dict(zip(self.tickers, self.missing.sum(axis=1).tolist()))
+
+  def to_dict(self):
+    '''Returns a dict with tickers as keys and their missing dates as a datetimeindex.'''
+    missing = self.missing
+    return {ticker: self.calendar[missing[i]] for i, ticker in enumerate(self.tickers)}
+
+  def to_timestamps_dict(self):
+    '''Returns a dict with tickers as keys and their missing dates as float timestamps to save as a json.'''
+    missing = self.missing
+    calendar_seconds = _datetime_index_to_ns(self.calendar) / 10**9
+    return {ticker: calendar_seconds[missing[i]].tolist() for i, ticker in enumerate(self.tickers)}
+
+  def __repr__(self):
+    return f'UniverseGaps({len(self.tickers)} tickers x {len(self.calendar)} dates, {int(self.missing.sum())} missing)'
+
+def _mark_dates_on_calendar(historicals, tickers, calendar):
+  '''Returns a bool array with shape (tickers, calendar) that is True where a ticker has the date.'''
+  ticker_dates = [_historical_dates_to_ns(historicals[ticker]) if ticker in historicals
+                  else np.empty(0, dtype=np.int64)
+                  for ticker in tickers]
+  row_tickers = np.repeat(np.arange(len(tickers)), [len(dates) for dates in ticker_dates])
+  all_dates = np.concatenate(ticker_dates) if ticker_dates else np.empty(0, dtype=np.int64)
+
+  day_positions = np.minimum(np.searchsorted(calendar, all_dates), max(len(calendar) - 1, 0))
+  on_calendar = calendar[day_positions] == all_dates if len(calendar) else np.zeros(len(all_dates), dtype=bool)
+
+  present = np.zeros((len(tickers), len(calendar)), dtype=bool)
+  present[row_tickers[on_calendar], day_positions[on_calendar]] = True
+  return present
+
+def _historical_dates_to_ns(historical):
+  '''Returns the dates of a ticker's historical as int64 nanoseconds.'''
+  if isinstance(historical, pd.DataFrame):
+    return _datetime_index_to_ns(historical.index)
+  if isinstance(historical, pd.DatetimeIndex):
+    return _datetime_index_to_ns(historical)
+  timestamps = np.asarray(historical, dtype=np.float64)
+  if timestamps.ndim == 2:  # IEX style [timestamp, Open, High, Low, Close, Volume] rows.
+    timestamps = timestamps[:, 0]
+  return (timestamps * 10**9).round().astype(np.int64)
+
+@metricsmodule.timed_stage('sp500_membership_intervals')
+def build_sp500_membership_intervals(sp500_changes):
+  '''Builds an index of the date intervals each ticker was in the SP500.
+
+  Every run of consecutive change dates that list a ticker becomes one
+  (enter, exit) interval, from the first to the last change date of the run.
+  The index is built for all tickers at once from the flattened constituents
+  lists, so it only needs to be built once and can be reused across filters.
+
+  Args:
+    sp500_changes: pandas dataframe containing the changes of the SP500 tickers
+                   as a list from 1996 to the present date.
+
+  Returns:
+    membership_intervals: dict with tickers as keys and int64 numpy arrays with
+                          shape (intervals, 2) as values. Each row holds the
+                          enter and exit date of an interval as nanosecond
+                          timestamps, both inclusive and sorted by enter date.
+  '''
+
+  change_dates = _datetime_index_to_ns(sp500_changes['date'])
+  tickers_per_change = sp500_changes['tickers'].values
+  change_rows = np.repeat(np.arange(len(tickers_per_change)), [len(tickers) for tickers in tickers_per_change])
+  if not len(change_rows):
+    return dict()
+  ticker_codes, unique_tickers = pd.factorize(np.concatenate(tickers_per_change))
+
+  # Sort every (ticker, change row) pair so each ticker's rows are grouped together in order.
+  order = np.lexsort((change_rows, ticker_codes))
+  ticker_codes, change_rows = ticker_codes[order], change_rows[order]
+
+  same_ticker = np.r_[False, ticker_codes[1:] == ticker_codes[:-1]]
+  repeated = same_ticker & np.r_[False, change_rows[1:] == change_rows[:-1]]  # A ticker listed twice on one date.
+  ticker_codes, change_rows, same_ticker = ticker_codes[~repeated], change_rows[~repeated], same_ticker[~repeated]
+
+  run_starts = np.flatnonzero(~same_ticker | np.r_[True, change_rows[1:] != change_rows[:-1] + 1])
+  run_ends = np.r_[run_starts[1:], len(change_rows)] - 1
+  intervals = np.column_stack([change_dates[change_rows[run_starts]], change_dates[change_rows[run_ends]]])
+
+  run_codes = ticker_codes[run_starts]
+  ticker_starts = np.flatnonzero(np.r_[True, run_codes[1:] != run_codes[:-1]])
+  ticker_ends = np.r_[ticker_starts[1:], len(run_codes)]
+  membership_intervals = {unique_tickers[run_codes[start]]: intervals[start:end]
+                          for start, end in zip(ticker_starts, ticker_ends)}
+  return membership_intervals
+
+@metricsmodule.timed_stage('sp500_membership_filter')
+def filter_out_the_dates_not_in_sp500(tickers_and_dates, sp500_changes, membership_intervals=None):
   '''Filters out the dates when the tickers are not in the SP500.
   
+  The dates of every ticker are matched against the membership intervals in
+  one vectorized pass instead of scanning every change date's tickers.
+
   Args:
     tickers_and_dates: dict with tickers as keys and their dates as values.
     sp500_changes: pandas dataframe containing the changes of the SP500 tickers 
                    as a list from 1996 to the present date.
+    membership_intervals: dict from build_sp500_membership_intervals(sp500_changes).
+                          Pass it in to reuse the index across calls. Defaults to
+                          None, which builds it from sp500_changes.
   
   Returns:
     ticker_and_dates_in_sp500: dict with ticker as keys and dates as datetime values.
@@ -162,73 +615,56 @@ def filter_out_the_dates_not_in_sp500(tickers_and_dates, sp500_changes):
                                is in the SP500.
   '''
 
-  tickers_and_dates_in_sp500 = dict()
+  if membership_intervals is None:
+    membership_intervals = build_sp500_membership_intervals(sp500_changes)
+
+  tickers = [ticker for ticker in tickers_and_dates if ticker in membership_intervals]
+  in_sp500 = _mask_dates_in_intervals([tickers_and_dates[ticker] for ticker in tickers],
+                                      [membership_intervals[ticker] for ticker in tickers])
 
+  tickers_and_dates_in_sp500 = dict()
+  ticker_masks = dict(zip(tickers, in_sp500))
   for ticker, dates in tickers_and_dates.items():
-    # Create a mask that will tell you when the ticker was in the SP500.
-    mask = [True if ticker in current_sp500_tickers
-            else False
-            for current_sp500_tickers in sp500_changes['tickers'].values]
-    
-    dates_mask = sp500_changes['date'].where(mask, False)
-    date_ranges_in_sp500 = _collect_date_ranges_when_in_sp500(dates_mask)  # Collect date ranges because time spent in 
-                                                                           # the SP500 is continuous for a range of dates.
-
-    dates = dates.to_series().rename()  # Pandas datetimeIndex needs to be a pandas series and renamed to use pandas series methods on it later.
-    tickers_and_dates_in_sp500[ticker] = _collect_each_date_when_in_sp500(dates, date_ranges_in_sp500)
+    if ticker not in ticker_masks:  # Never in the SP500, there are no date ranges to collect.
+      tickers_and_dates_in_sp500[ticker] = None
+      continue
+    dates = dates[ticker_masks[ticker]]
+    tickers_and_dates_in_sp500[ticker] = dates.to_series().rename()  # Pandas datetimeIndex needs to be a pandas series and renamed to use pandas series methods on it later.
   return tickers_and_dates_in_sp500
 
-def _collect_date_ranges_when_in_sp500(dates_mask): 
-  '''Collects all dates when the ticker was in the SP500.
-
-  Args:
-    dates_mask: pseudo-bool mask for each date. The False 
-                value indicates the ticker was not in the SP500 at that
-                date. However, if the ticker was in the SP500 at that date,
-                the value will be the date instead of a True value.
-
-  Returns:
-    date_ranges_in_sp500: list containing each date range
-                          when the ticker was in the SP500.
-  '''
-
-  date_ranges_in_sp500 = []
-  prev_mask = False  # Keep track of the previous mask to collect the date range at the end.
-
-  for mask in dates_mask:  
-    if mask:  # mask will be False until it hits its first date in the SP500.
-      if prev_mask == False:
-        start_date = mask
-      end_date = mask
-    else:
-      if prev_mask:
-        date_ranges_in_sp500.append([start_date, end_date])
-    prev_mask = mask
-  if prev_mask:  # Ensure that the last date range is added on the last date.
-    date_ranges_in_sp500.append([start_date, end_date])
-  return date_ranges_in_sp500
-
-def _collect_each_date_when_in_sp500(dates, date_ranges_in_sp500):
-  '''Collects all dates for the given SP500 date ranges.
+def _mask_dates_in_intervals(ticker_dates, ticker_intervals):
+  '''Returns a bool mask per ticker of which dates fall inside its (enter, exit) intervals, for every ticker in one pass.
 
-  Args:
-    dates: pandas series containing all ticker's dates as a datetime
-    date_ranges_in_sp500: list containing each date range
-                          when the ticker was in the SP500.
-  
-  Returns:
-    ticker_sp500_dates: pandas series with only the dates for the
-                        given date ranges.
+  Every enter adds one and every exit removes one on a timeline sorted by
+  ticker, then date, with enters before and exits after the dates on the same
+  day so both ends are inclusive. A date is in the SP500 where the running sum
+  is positive. Each ticker's enters and exits cancel out, so nothing leaks into
+  the next ticker.
   '''
-  
-  ticker_sp500_dates = None
-
-  for date_range in date_ranges_in_sp500:
-    if ticker_sp500_dates is None:
-      ticker_sp500_dates = dates.loc[date_range[0]:date_range[1]]
-    else:
-      ticker_sp500_dates = pd.concat([ticker_sp500_dates, dates.loc[date_range[0]:date_range[1]]])
-  return ticker_sp500_dates
+  date_counts = [len(dates) for dates in ticker_dates]
+  if not sum(date_counts):
+    return [np.zeros(0, dtype=bool) for _ in ticker_dates]
+  interval_counts = [len(intervals) for intervals in ticker_intervals]
+  dates = np.concatenate([_datetime_index_to_ns(dates) for dates in ticker_dates])
+  intervals = np.concatenate(ticker_intervals) if ticker_intervals else np.zeros((0, 2), dtype=np.int64)
+
+  codes = np.concatenate([np.repeat(np.arange(len(ticker_dates)), date_counts),
+                          np.repeat(np.arange(len(ticker_intervals)), interval_counts),
+                          np.repeat(np.arange(len(ticker_intervals)), interval_counts)])
+  times = np.concatenate([dates, intervals[:, 0], intervals[:, 1]])
+  kinds = np.repeat([1, 0, 2], [len(dates), len(intervals), len(intervals)])  # Enters, then dates, then exits on the same day.
+  steps = np.repeat([0, 1, -1], [len(dates), len(intervals), len(intervals)])
+
+  order = np.lexsort((kinds, times, codes))
+  inside = np.empty(len(order), dtype=bool)
+  inside[order] = np.cumsum(steps[order]) > 0
+  return np.split(inside[:len(dates)], np.cumsum(date_counts)[:-1])
+
+def _datetime_index_to_ns(index):
+  '''Returns datetimes as int64 nanoseconds since the epoch (UTC for time zone aware datetimes).'''
+  if isinstance(index, pd.DatetimeIndex) and index.tz is None:  # Skip building a new index for the common case.
+    return index.values.astype('datetime64[ns]', copy=False).view(np.int64)
+  return pd.DatetimeIndex(index).to_numpy(dtype='datetime64[ns]').view(np.int64)
 
 def remove_tickers_with_no_missing_dates_while_in_sp500(true_missing_tickers_and_dates):
   '''Removes tickers with no missing dates while in the SP500.'''
@@ -250,9 +686,8 @@ def collect_amount_of_missing_data_per_year(missing_tickers_and_dates):
     binned_years: datetimeindex per year used to bin the missing occurances
   '''
 
-  all_dates = None
-  for missing_dates in missing_tickers_and_dates.values():
-    all_dates = pd.concat([all_dates, missing_dates])
+  missing_dates = [dates for dates in missing_tickers_and_dates.values() if dates is not None]
+  all_dates = pd.concat(missing_dates) if missing_dates else None  # Concatenate once instead of growing it per ticker.
   
   missing_occurances = pd.DataFrame(all_dates, columns=['Dates']).reset_index(drop=True)
 
@@ -0,0 +1,109 @@
+'''Offline throughput and tail latency benchmark of the Yahoo Finance and IEX downloaders.
+
+Starts a FakeMarketServer on localhost with synthetic historicals and the
+requested latency, error, throttling and partial record settings, then runs
+download_yf_tickers_concurrently (Part 2) and
+download_iex_historicals_concurrently (Part 3B) against it at each amount of
+workers. For every run it reports the wall time, tickers downloaded per second,
+how many requests were made and how many of them were throttled or failed,
+client side p50/p95/p99 latency of each ticker or batch, the server side p99
+request latency and how many tickers were not downloaded. The client latency is
+taken from the downloaders' metricsmodule spans, so unlike the server latency it
+includes the rate limiter waits, the retries and their backoff and Retry-After
+waits.
+A few tickers that the server does not know are always requested to exercise
+the not avaliable paths.
+
+Run from the repository root:
+  python benchmarks/bench_downloads.py
+  python benchmarks/bench_downloads.py --tickers 500 --latency 0.1 --jitter 0.05 --error-rate 0.05 --max-rps 40
+'''
+
+import argparse
+import contextlib
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'allmodules'))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Part 3 - Handling Missing YF Historicals'))  # For p3Binputs.
+import metricsmodule
+import p2module
+import p3Bmodule
+import synthetic
+from fake_market_server import FakeMarketServer, FakeYahooBackend
+
+REQUEST_STAGES = {'download_yf_ticker', 'download_yf_batch', 'download_iex_batch'}  # Spans of a ticker or batch download.
+
+def run_yf(server, tickers, start_date, end_date, workers, requests_per_second, bulk_size):
+  '''Downloads the tickers from the fake Yahoo Finance chart endpoint and returns the downloaded historicals.'''
+  backend = FakeYahooBackend(server.url)
+  historicals, _, _ = p2module.download_yf_tickers_concurrently(tickers, start_date, end_date, max_workers=workers,
+                                                                requests_per_second=requests_per_second, max_retries=5,
+                                                                backoff=0.05, bulk_size=bulk_size, yf_backend=backend)
+  return historicals
+
+def run_iex(server, tickers, workers):
+  '''Downloads the tickers from the fake IEX Cloud batch endpoint and returns the downloaded historicals.'''
+  batch_urls, _ = p3Bmodule.generate_iex_historical_batch_urls(tickers, 'max', IEX_TOKEN='fake')
+  batch_urls = [server.iex_batch_url(batch_url) for batch_url in batch_urls]
+  historicals, _, _ = p3Bmodule.download_iex_historicals_concurrently(batch_urls, max_in_flight=workers,
+                                                                      max_retries=5, backoff=0.05)
+  return historicals
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--tickers', type=int, default=200)
+  parser.add_argument('--years', type=int, default=15)
+  parser.add_argument('--unknown', type=int, default=5, help='tickers the server does not know')
+  parser.add_argument('--workers', default='1,4,8,16', help='comma separated amounts of workers to run')
+  parser.add_argument('--latency', type=float, default=0.05, help='seconds every request is delayed by')
+  parser.add_argument('--jitter', type=float, default=0.02, help='mean seconds of extra exponential delay')
+  parser.add_argument('--error-rate', type=float, default=0.02)
+  parser.add_argument('--max-rps', type=int, help='server side requests per second before answering 429')
+  parser.add_argument('--partial-rate', type=float, default=0.001, help='fraction of IEX records with a missing value')
+  parser.add_argument('--client-rps', type=float, help='requests_per_second of the Yahoo Finance downloader')
+  parser.add_argument('--bulk-size', type=int, help='bulk_size of the Yahoo Finance downloader')
+  args = parser.parse_args()
+
+  tickers = synthetic.generate_tickers(args.tickers)
+  trading_days = synthetic.generate_trading_days(args.years)
+  historicals, _ = synthetic.generate_historicals(tickers, trading_days)
+  requested_tickers = tickers + [f'UNKNOWN{i}' for i in range(args.unknown)]
+  start_date = trading_days[0].strftime('%Y-%m-%d')
+  end_date = (trading_days[-1] + trading_days.freq).strftime('%Y-%m-%d')
+
+  print(f'{args.tickers} tickers + {args.unknown} unknown, {args.years} years, latency {args.latency}s + {args.jitter}s, '
+        f'error rate {args.error_rate}, max rps {args.max_rps}, partial rate {args.partial_rate}')
+  print(f'{"downloader":<10} {"workers":>7} {"wall s":>8} {"tickers/s":>10} {"requests":>9} {"429":>5} {"5xx":>5} '
+        f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"srv p99":>8} {"missing":>8}')
+
+  with FakeMarketServer(historicals, latency=args.latency, latency_jitter=args.jitter, error_rate=args.error_rate,
+                        max_requests_per_second=args.max_rps, partial_rate=args.partial_rate) as server:
+    server.prepare_iex_charts('max')
+    for workers in [int(workers) for workers in args.workers.split(',')]:
+      for downloader in ['yf', 'iex']:
+        server.reset_stats()
+        start = time.perf_counter()
+        with metricsmodule.recording(metricsmodule.MemorySink()) as sink, \
+             contextlib.redirect_stdout(io.StringIO()):  # Skip the per ticker prints.
+          if downloader == 'yf':
+            downloaded = run_yf(server, requested_tickers, start_date, end_date, workers, args.client_rps, args.bulk_size)
+          else:
+            downloaded = run_iex(server, requested_tickers, workers)
+        wall = time.perf_counter() - start
+
+        latencies = [span['seconds'] for span in sink.spans if span['stage'] in REQUEST_STAGES]
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (np.nan,) * 3
+        stats = server.stats()
+        server_errors = sum(count for status, count in stats['statuses'].items() if status >= 500)
+        missing = len(set(tickers) - set(downloaded))
+        print(f'{downloader:<10} {workers:>7} {wall:>8.2f} {len(downloaded) / wall:>10.1f} {stats["requests"]:>9} '
+              f'{stats["statuses"].get(429, 0):>5} {server_errors:>5} {p50 * 1e3:>8.1f} {p95 * 1e3:>8.1f} '
+              f'{p99 * 1e3:>8.1f} {stats["p99"] * 1e3:>8.1f} {missing:>8}')
+
+if __name__ == '__main__':
+  main()
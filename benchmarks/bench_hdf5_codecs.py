@@ -0,0 +1,97 @@
+'''Benchmark for the hdf5 storage options of save_historicals_to_hdf5.
+
+Saves the real 15 year historicals in the Part 2 "p2outputs" folder with each
+compression, shuffle, layout and chunk rows configuration of the Part 2 module,
+then reports the chunk shape, the write time, the time to read every full
+dataset, the time to read only the 'Close' column and the bytes on disk. The
+first configuration is the default. The write time only covers writing the
+datasets, the same way save_historicals_to_hdf5 does, and leaves out its
+coverage index update, which does not depend on the storage options.
+
+Run from the repository root:
+  python benchmarks/bench_hdf5_codecs.py
+'''
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import h5py
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'allmodules'))
+import p2module
+
+HISTORICALS_FILEPATH = Path(__file__).resolve().parents[1] / 'Part 2 - Download YF Historicals' / 'p2outputs'
+
+CONFIGURATIONS = {
+  'gzip rows (default)': dict(),
+  'gzip rows 256': dict(chunk_rows=256),
+  'gzip rows 1024': dict(chunk_rows=1024),
+  'gzip rows 4096': dict(chunk_rows=4096),
+  'gzip-1 rows': dict(compression_opts=1),
+  'gzip-9 rows': dict(compression_opts=9),
+  'gzip shuffle rows': dict(shuffle=True),
+  'lzf rows': dict(compression='lzf'),
+  'lzf shuffle rows': dict(compression='lzf', shuffle=True),
+  'none rows': dict(compression=None),
+  'gzip columns': dict(layout='columns'),
+  'gzip columns 1024': dict(layout='columns', chunk_rows=1024),
+  'gzip columns 16384': dict(layout='columns', chunk_rows=16384),
+  'gzip shuffle columns': dict(shuffle=True, layout='columns'),
+  'lzf columns': dict(compression='lzf', layout='columns'),
+  'lzf shuffle columns': dict(compression='lzf', shuffle=True, layout='columns'),
+}
+
+def load_real_historicals(filepath=HISTORICALS_FILEPATH):
+  '''Loads every saved hdf5 historical as its raw (rows, 6) array.'''
+  historicals = dict()
+  for hdf5_filepath in sorted(filepath.glob('*.hdf5')):
+    with h5py.File(hdf5_filepath, 'r') as f:
+      historicals[hdf5_filepath.stem] = f['historicals']['15Y'][()]
+  return historicals
+
+def time_reads(tickers, filepath, column=None, repeats=5):
+  '''Returns the best time of reading every ticker's dataset, or only one of its columns.'''
+  best = float('inf')
+  for _ in range(repeats):
+    start = time.perf_counter()
+    for ticker in tickers:
+      with h5py.File(f'{filepath}/{ticker}.hdf5', 'r') as f:
+        dataset = f['historicals']['15Y']
+        dataset[()] if column is None else dataset[:, column]
+    best = min(best, time.perf_counter() - start)
+  return best
+
+def write_datasets(historicals, filepath, dataset_options):
+  '''Writes every ticker's dataset like save_historicals_to_hdf5, without its coverage index update.'''
+  for ticker in historicals:
+    with h5py.File(f'{filepath}/{ticker}.hdf5', 'w') as f:
+      history = f.create_group('historicals')
+      p2module._create_historicals_dataset(history, historicals[ticker], **dataset_options)
+
+def time_configuration(historicals, dataset_options):
+  '''Times writing, full reads and 'Close' reads and measures the chunk shape and bytes on disk for one configuration.'''
+  with tempfile.TemporaryDirectory() as filepath:
+    start = time.perf_counter()
+    write_datasets(historicals, filepath, dataset_options)
+    write = time.perf_counter() - start
+    full_read = time_reads(historicals, filepath)
+    close_read = time_reads(historicals, filepath, column=4)
+    size = sum(Path(f'{filepath}/{ticker}.hdf5').stat().st_size for ticker in historicals)
+    with h5py.File(f'{filepath}/{next(iter(historicals))}.hdf5', 'r') as f:
+      chunks = f['historicals']['15Y'].chunks
+  return chunks, write, full_read, close_read, size
+
+def main():
+  historicals = load_real_historicals()
+  rows = sum(len(data) for data in historicals.values())
+  print(f'{len(historicals)} tickers, {rows} rows from {HISTORICALS_FILEPATH}')
+  print(f'{"configuration":<22} {"chunks":>11} {"write ms":>9} {"read ms":>8} {"close ms":>9} {"bytes":>10}')
+  for name, dataset_options in CONFIGURATIONS.items():
+    chunks, write, full_read, close_read, size = time_configuration(historicals, dataset_options)
+    chunks = 'x'.join(str(chunk) for chunk in chunks)
+    print(f'{name:<22} {chunks:>11} {write * 1e3:>9.1f} {full_read * 1e3:>8.1f} {close_read * 1e3:>9.1f} {size:>10}')
+
+if __name__ == '__main__':
+  main()
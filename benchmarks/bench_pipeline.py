@@ -0,0 +1,160 @@
+'''End to end benchmark suite of the Part 1 to Part 3 modules on synthetic data.
+
+Generates deterministic constituents records, OHLCV historicals with missing
+dates and IEX style backfill rows (see synthetic.py), then times each stage
+of the tutorial pipeline:
+
+  records     p1module reads, formats and collects the constituents records csv
+  format      p2module.format_historicals_to_save_as_hdf5
+  save        p2module.save_historicals_to_hdf5
+  load        p2module.load_hdf5_historicals
+  gaps        p3Amodule.compute_universe_gaps on the trading days
+  membership  p3Amodule.filter_out_the_dates_not_in_sp500 on the missing dates
+  merge       p3Bmodule.merge_historical_sources of the yf and iex historicals
+  ordering    p3Bmodule.validate_chronological_order of the merged historicals
+
+Each stage's best time over the repeats is compared with baselines.json, and
+the suite exits with status 1 if any stage is slower than its baseline times
+the tolerance. Baselines are machine specific, so record your own with
+--update-baselines before comparing changes.
+
+Run from the repository root:
+  python benchmarks/bench_pipeline.py --scale small
+  python benchmarks/bench_pipeline.py --scale small --update-baselines
+  python benchmarks/bench_pipeline.py --tickers 2000 --years 30
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'allmodules'))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'Part 3 - Handling Missing YF Historicals'))  # For p3Binputs.
+import p1module
+import p2module
+import p3Amodule
+import p3Bmodule
+import synthetic
+
+BASELINES_FILEPATH = Path(__file__).resolve().parent / 'baselines.json'
+
+SCALES = {
+  'tiny': dict(tickers=200, years=15),
+  'small': dict(tickers=1000, years=15),
+  'medium': dict(tickers=5000, years=25),
+  'large': dict(tickers=20000, years=40),
+}
+
+def generate_inputs(ticker_count, years, entries_per_ticker=3, seed=0):
+  '''Generates every input of the pipeline for the scale.'''
+  tickers = synthetic.generate_tickers(ticker_count)
+  trading_days = synthetic.generate_trading_days(years)
+  sp500_changes = synthetic.generate_sp500_changes(tickers, trading_days[::21], entries_per_ticker)
+  historicals, missing_dates = synthetic.generate_historicals(tickers, trading_days, seed=seed)
+  inputs = dict(tickers=tickers,
+                trading_days=trading_days,
+                sp500_changes=sp500_changes,
+                constituents_records=synthetic.generate_constituents_records(sp500_changes),
+                historicals=historicals,
+                missing_dates=missing_dates,
+                backfill_rows=synthetic.generate_backfill_rows(missing_dates, seed=seed))
+  return inputs
+
+def run_stages(inputs, filepath):
+  '''Runs each stage once and returns its time in seconds. Each stage feeds the next like the notebooks do.'''
+  timings = dict()
+  records_filepath = f'{filepath}/constituents_records.csv'
+  inputs['constituents_records'].to_csv(records_filepath)
+
+  def timed(stage, function, *args, **kwargs):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # Skip the per ticker prints.
+      result = function(*args, **kwargs)
+    timings[stage] = time.perf_counter() - start
+    return result
+
+  def run_part_1():
+    records = p1module.get_sp500_constituents_records(records_filepath)
+    records = p1module.format_sp500_constituents_records(records)
+    return p1module.collect_all_sp500_constituents(records)
+
+  timed('records', run_part_1)
+  hdf5_historicals = timed('format', p2module.format_historicals_to_save_as_hdf5, inputs['historicals'])
+  timed('save', p2module.save_historicals_to_hdf5, hdf5_historicals, filepath)
+  historicals = timed('load', p2module.load_hdf5_historicals, inputs['tickers'], filepath)
+  # The loaded dates are New York midnights as naive UTC, e.g. 05:00 or 04:00, so put the calendar on the same times.
+  calendar = inputs['trading_days'].tz_localize('America/New_York').tz_convert('UTC').tz_localize(None)
+  universe_gaps = timed('gaps', p3Amodule.compute_universe_gaps, historicals, calendar)
+  expected_missing = sum(len(calendar) - len(historical) for historical in historicals.values())
+  assert sum(universe_gaps.missing_counts().values()) == expected_missing, 'The gaps stage did not match the loaded dates to the calendar'
+  timed('membership', p3Amodule.filter_out_the_dates_not_in_sp500, inputs['missing_dates'], inputs['sp500_changes'])
+  merged = timed('merge', p3Bmodule.merge_historical_sources, {'yf': historicals, 'iex': inputs['backfill_rows']})
+  timed('ordering', p3Bmodule.validate_chronological_order, merged)
+  return timings
+
+def time_pipeline(ticker_count, years, repeats=3):
+  '''Returns each stage's best time over the repeats.'''
+  inputs = generate_inputs(ticker_count, years)
+  best_timings = dict()
+  for _ in range(repeats):
+    with tempfile.TemporaryDirectory() as filepath:
+      timings = run_stages(inputs, filepath)
+    for stage, seconds in timings.items():
+      best_timings[stage] = min(seconds, best_timings.get(stage, float('inf')))
+  return best_timings
+
+def compare_with_baselines(timings, baselines, tolerance, min_seconds=0.05):
+  '''Returns the stages that are slower than their baseline times the tolerance.
+
+  Differences under min_seconds are ignored so timer noise on fast stages is not a regression.
+  '''
+  regressions = []
+  for stage, seconds in timings.items():
+    if stage in baselines and seconds > baselines[stage] * tolerance and seconds - baselines[stage] > min_seconds:
+      regressions.append(stage)
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--scale', choices=SCALES, default='small')
+  parser.add_argument('--tickers', type=int, help='overrides the amount of tickers of the scale')
+  parser.add_argument('--years', type=int, help='overrides the amount of years of the scale')
+  parser.add_argument('--repeats', type=int, default=3)
+  parser.add_argument('--tolerance', type=float, default=1.5, help='slowdown factor that counts as a regression')
+  parser.add_argument('--update-baselines', action='store_true', help='saves this run as the baselines of the scale')
+  args = parser.parse_args()
+
+  scale = dict(SCALES[args.scale])
+  scale['tickers'] = args.tickers or scale['tickers']
+  scale['years'] = args.years or scale['years']
+  scale_name = args.scale if scale == SCALES[args.scale] else f'{scale["tickers"]}x{scale["years"]}'
+
+  baselines = json.loads(BASELINES_FILEPATH.read_text()) if BASELINES_FILEPATH.is_file() else dict()
+  scale_baselines = baselines.get(scale_name, dict())
+
+  print(f'{scale_name}: {scale["tickers"]} tickers, {scale["years"]} years, best of {args.repeats}')
+  timings = time_pipeline(scale['tickers'], scale['years'], args.repeats)
+  regressions = compare_with_baselines(timings, scale_baselines, args.tolerance)
+
+  print(f'{"stage":<11} {"seconds":>9} {"baseline":>9} {"ratio":>7}')
+  for stage, seconds in timings.items():
+    baseline = scale_baselines.get(stage)
+    ratio = f'{seconds / baseline:>7.2f}' if baseline else f'{"-":>7}'
+    baseline = f'{baseline:>9.3f}' if baseline else f'{"-":>9}'
+    flag = '  REGRESSION' if stage in regressions else ''
+    print(f'{stage:<11} {seconds:>9.3f} {baseline} {ratio}{flag}')
+
+  if args.update_baselines:
+    baselines[scale_name] = {stage: round(seconds, 4) for stage, seconds in timings.items()}
+    BASELINES_FILEPATH.write_text(json.dumps(baselines, indent=2) + '\n')
+    print(f'Saved the {scale_name} baselines to {BASELINES_FILEPATH.name}')
+  elif regressions:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,56 @@
+'''Benchmark for filtering missing dates to when the tickers were in the SP500.
+
+Times build_sp500_membership_intervals, filter_out_the_dates_not_in_sp500 and
+collect_amount_of_missing_data_per_year from the Part 3A module on synthetic
+constituents where every ticker enters and exits the SP500 many times. The
+suite sweeps both the amount of tickers and the amount of entries and exits
+per ticker. The time per ticker should stay flat along both, which shows that
+the date selection scales linearly instead of quadratically.
+
+Run from the repository root:
+  python benchmarks/bench_sp500_date_filtering.py
+'''
+
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'allmodules'))
+import p3Amodule
+from synthetic import generate_missing_dates, generate_sp500_changes
+
+def time_stages(ticker_count, entries_per_ticker, missing_per_ticker=300):
+  '''Times each filtering stage for the given amount of tickers.'''
+  trading_days = pd.bdate_range('2007-01-01', '2022-01-01')
+  change_dates = trading_days[::5]
+  tickers = [f'T{i:05d}' for i in range(ticker_count)]
+  sp500_changes = generate_sp500_changes(tickers, change_dates, entries_per_ticker)
+  missing_dates = generate_missing_dates(tickers, trading_days, missing_per_ticker)
+
+  timings = dict()
+  start = time.perf_counter()
+  membership_intervals = p3Amodule.build_sp500_membership_intervals(sp500_changes)
+  timings['intervals'] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  dates_in_sp500 = p3Amodule.filter_out_the_dates_not_in_sp500(missing_dates, sp500_changes, membership_intervals)
+  timings['filter'] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  p3Amodule.collect_amount_of_missing_data_per_year(dates_in_sp500)
+  timings['per_year'] = time.perf_counter() - start
+  return timings
+
+def main(ticker_counts=(250, 500, 1000, 2000, 4000), entries_per_ticker_counts=(5, 20, 80)):
+  print(f'{"tickers":>8} {"entries":>8} {"intervals s":>12} {"filter s":>10} {"per year s":>11} {"total us/ticker":>16}')
+  for entries_per_ticker in entries_per_ticker_counts:
+    for ticker_count in ticker_counts:
+      timings = time_stages(ticker_count, entries_per_ticker)
+      total = sum(timings.values())
+      print(f'{ticker_count:>8} {entries_per_ticker:>8} {timings["intervals"]:>12.4f} {timings["filter"]:>10.4f} '
+            f'{timings["per_year"]:>11.4f} {total / ticker_count * 1e6:>16.1f}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,314 @@
+'''Local stand-in for the Yahoo Finance and IEX Cloud historical endpoints.
+
+FakeMarketServer serves synthetic historicals (see synthetic.py) over http on
+localhost in the same json layout as the live services:
+
+  /v8/finance/chart/{ticker}?period1=&period2=&interval=1d    Yahoo Finance chart
+  /stable/stock/market/batch?symbols=&types=chart&range=      IEX Cloud batch chart
+
+Every request can be delayed, fail with a 500 or 503, or be throttled with a
+429 and a Retry-After header, and a fraction of the IEX chart records can be
+left incomplete, so the downloaders' concurrency and retry handling can be
+measured offline. FakeYahooBackend requests the chart endpoint and returns
+yfinance shaped dataframes, so it can be passed to
+download_yf_tickers_concurrently as its yf_backend. IEX batch urls only need
+their host swapped with FakeMarketServer.iex_batch_url(batch_url).
+
+Example:
+  with FakeMarketServer(historicals, latency=0.05, error_rate=0.01) as server:
+    p2module.download_yf_tickers_concurrently(tickers, yf_backend=FakeYahooBackend(server.url))
+'''
+
+import json
+import random
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import requests
+
+class FakeMarketServer:
+  '''Serves synthetic historicals like the Yahoo Finance and IEX Cloud historical endpoints.
+
+  Args:
+    historicals: dict with tickers as keys and yfinance style OHLCV dataframes as values.
+    latency: float of seconds every request is delayed by. Defaults 0.0.
+    latency_jitter: float mean of an extra exponentially distributed delay in seconds,
+                    which gives the latency a long tail. Defaults 0.0.
+    error_rate: float fraction of requests answered with a 500 or 503. Defaults 0.0.
+    max_requests_per_second: int of requests served in any one second before the rest
+                             are answered with a 429. Defaults to None, which never throttles.
+    partial_rate: float fraction of IEX chart records with one of their values missing. Defaults 0.0.
+    seed: int seed of the injected faults. Defaults 0.
+    host: string host to listen on. Defaults '127.0.0.1'.
+    port: int port to listen on. Defaults 0, which picks a free port.
+  '''
+
+  def __init__(self, historicals, latency=0.0, latency_jitter=0.0, error_rate=0.0, max_requests_per_second=None,
+               partial_rate=0.0, seed=0, host='127.0.0.1', port=0):
+    self.latency = latency
+    self.latency_jitter = latency_jitter
+    self.error_rate = error_rate
+    self.max_requests_per_second = max_requests_per_second
+    self.partial_rate = partial_rate
+    self.seed = seed
+    self.request_log = []  # (endpoint, status, seconds) of every request.
+
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+    self._recent_requests = deque()
+    self._iex_charts = dict()
+    self._histories = {ticker: self._to_arrays(historical) for ticker, historical in historicals.items()}
+
+    self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+    self._httpd.daemon_threads = True
+    self._thread = None
+
+  @property
+  def url(self):
+    '''Base url of the server, e.g. http://127.0.0.1:54321.'''
+    host, port = self._httpd.server_address[:2]
+    return f'http://{host}:{port}'
+
+  def iex_batch_url(self, batch_url):
+    '''Points an IEX Cloud batch url from generate_iex_historical_batch_urls at the server.'''
+    parsed = urlparse(batch_url)
+    return f'{self.url}{parsed.path}?{parsed.query}'
+
+  def start(self):
+    '''Starts serving on a background thread.'''
+    self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+    self._thread.start()
+    return self
+
+  def stop(self):
+    '''Stops serving and closes the socket.'''
+    self._httpd.shutdown()
+    self._httpd.server_close()
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *exc_info):
+    self.stop()
+
+  def prepare_iex_charts(self, date_length='max'):
+    '''Encodes every ticker's IEX chart ahead of time, so the first batches are not slowed down by encoding them.'''
+    for ticker in self._histories:
+      self._iex_chart(ticker, date_length)
+
+  def reset_stats(self):
+    '''Clears the request log.'''
+    with self._lock:
+      self.request_log = []
+
+  def stats(self):
+    '''Summarises the request log as counts per status and server side latency percentiles in seconds.'''
+    with self._lock:
+      request_log = list(self.request_log)
+    seconds = np.array([entry[2] for entry in request_log]) if request_log else np.zeros(1)
+    statuses = pd.Series([entry[1] for entry in request_log], dtype=np.int64).value_counts().to_dict()
+    return {'requests': len(request_log),
+            'statuses': statuses,
+            'p50': float(np.percentile(seconds, 50)),
+            'p95': float(np.percentile(seconds, 95)),
+            'p99': float(np.percentile(seconds, 99)),
+            'max': float(seconds.max())}
+
+  @staticmethod
+  def _to_arrays(historical):
+    '''Returns a ticker's UTC second timestamps of each day's market open and its OHLCV values.'''
+    days = pd.DatetimeIndex(historical.index)
+    if days.tz is None:
+      days = days.tz_localize('America/New_York')
+    market_open = (days.tz_convert('America/New_York').normalize() + pd.Timedelta(hours=9, minutes=30))
+    timestamps = market_open.tz_convert('UTC').tz_localize(None).values.astype('datetime64[s]').astype(np.int64)
+    values = historical[['Open', 'High', 'Low', 'Close', 'Volume']].to_numpy(dtype=np.float64)
+    return timestamps, values
+
+  def _make_handler(self):
+    market = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'  # Keep-alive, so pooled client connections are reused like with the live services.
+
+      def log_message(self, *args):
+        pass
+
+      def do_GET(self):
+        start = time.perf_counter()
+        parsed = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        if parsed.path.startswith('/v8/finance/chart/'):
+          endpoint = 'chart'
+        elif parsed.path.endswith('/stock/market/batch'):
+          endpoint = 'batch'
+        else:
+          endpoint = 'unknown'
+
+        status, body, headers = market._fault()
+        if status is None:
+          if endpoint == 'chart':
+            status, body = market._chart_response(parsed.path.rsplit('/', 1)[-1], query)
+          elif endpoint == 'batch':
+            status, body = market._batch_response(query)
+          else:
+            status, body = 404, b'{"error": "Not Found"}'
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in headers.items():
+          self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with market._lock:
+          market.request_log.append((endpoint, status, time.perf_counter() - start))
+
+    return Handler
+
+  def _fault(self):
+    '''Delays the request and returns an injected (status, body, headers) or (None, None, {}) to serve it.'''
+    with self._lock:
+      delay = self.latency + (self._random.expovariate(1 / self.latency_jitter) if self.latency_jitter else 0.0)
+      fail = self._random.random() < self.error_rate
+      error_status = self._random.choice([500, 503])
+    time.sleep(delay)
+
+    if self.max_requests_per_second:
+      with self._lock:
+        now = time.monotonic()
+        while self._recent_requests and now - self._recent_requests[0] >= 1:
+          self._recent_requests.popleft()
+        throttled = len(self._recent_requests) >= self.max_requests_per_second
+        if not throttled:
+          self._recent_requests.append(now)
+      if throttled:
+        return 429, b'{"error": "Too Many Requests"}', {'Retry-After': '1'}
+    if fail:
+      return error_status, b'{"error": "Internal Server Error"}', {}
+    return None, None, {}
+
+  def _chart_response(self, ticker, query):
+    '''Returns a Yahoo Finance chart response for the ticker between period1 and period2.'''
+    if ticker not in self._histories:
+      error = {'code': 'Not Found', 'description': 'No data found, symbol may be delisted'}
+      return 404, json.dumps({'chart': {'result': None, 'error': error}}).encode()
+
+    timestamps, values = self._histories[ticker]
+    first, last = np.searchsorted(timestamps, [int(query.get('period1', 0)), int(query.get('period2', 2**62))])
+    timestamps, values = timestamps[first:last], values[first:last]
+    quote = {column: values[:, i].tolist() for i, column in enumerate(['open', 'high', 'low', 'close', 'volume'])}
+    result = {'meta': {'symbol': ticker, 'currency': 'USD', 'exchangeTimezoneName': 'America/New_York',
+                       'dataGranularity': '1d'},
+              'timestamp': timestamps.tolist(),
+              'events': {},
+              'indicators': {'quote': [quote], 'adjclose': [{'adjclose': quote['close']}]}}
+    return 200, json.dumps({'chart': {'result': [result], 'error': None}}).encode()
+
+  def _batch_response(self, query):
+    '''Returns an IEX Cloud batch chart response for the symbols, leaving out unknown symbols like IEX does.'''
+    range_years = query.get('range', 'max')
+    parts = []
+    for ticker in query.get('symbols', '').split(','):
+      if ticker in self._histories:
+        parts.append(json.dumps(ticker).encode() + b':' + self._iex_chart(ticker, range_years))
+    return 200, b'{' + b','.join(parts) + b'}'
+
+  def _iex_chart(self, ticker, range_years):
+    '''Returns the encoded IEX chart of a ticker, cached because batches repeat the same charts.'''
+    key = (ticker, range_years)
+    if key not in self._iex_charts:
+      timestamps, values = self._histories[ticker]
+      dates = timestamps.astype('datetime64[s]').astype('datetime64[D]')
+      if range_years.endswith('y') and range_years[:-1].isdigit() and len(dates):  # e.g. '15y', anything else is 'max'.
+        keep = dates > dates[-1] - np.timedelta64(365 * int(range_years[:-1]), 'D')
+        dates, values = dates[keep], values[keep]
+
+      rng = np.random.default_rng([self.seed, zlib.crc32(ticker.encode())])  # The same records are partial on every run.
+      partial = rng.random(len(dates)) < self.partial_rate
+      partial_keys = rng.choice(['fOpen', 'fHigh', 'fLow', 'fClose', 'fVolume'], len(dates))
+      chart = []
+      for i, date in enumerate(dates.astype(str)):
+        open_, high, low, close, volume = values[i]
+        record = {'date': date, 'symbol': ticker, 'label': date,
+                  'open': open_, 'high': high, 'low': low, 'close': close, 'volume': int(volume),
+                  'fOpen': open_, 'fHigh': high, 'fLow': low, 'fClose': close, 'fVolume': int(volume)}
+        if partial[i]:
+          record[partial_keys[i]] = None
+        chart.append(record)
+      self._iex_charts[key] = json.dumps({'chart': chart}).encode()  # Two threads may both encode a chart, which is harmless.
+    return self._iex_charts[key]
+
+class FakeYahooBackend:
+  '''yfinance stand-in that downloads from a FakeMarketServer's chart endpoint.
+
+  Provides the Ticker(ticker).history and download parts of the yfinance
+  interface that download_yf_tickers_concurrently uses. Each thread keeps its
+  own keep-alive session. Unknown tickers return an empty dataframe like
+  yfinance, and 429 and 5xx responses raise requests.HTTPError so they are retried.
+
+  Args:
+    base_url: string base url of the server, see FakeMarketServer.url.
+    timeout: float of seconds to wait for a server response. Defaults 30.
+  '''
+
+  def __init__(self, base_url, timeout=30):
+    self.base_url = base_url
+    self.timeout = timeout
+    self._local = threading.local()
+
+  def Ticker(self, ticker):
+    backend = self
+
+    class Ticker:
+      def history(self, start=None, end=None, auto_adjust=True, actions=True, **kwargs):
+        return backend.history(ticker, start, end, auto_adjust, actions)
+
+    return Ticker()
+
+  def download(self, tickers, start=None, end=None, auto_adjust=True, actions=False, group_by='column', **kwargs):
+    '''Requests each ticker's chart and combines them like yf.download.'''
+    histories = {ticker: self.history(ticker, start, end, auto_adjust, actions) for ticker in tickers}
+    histories = {ticker: history for ticker, history in histories.items() if not history.empty}
+    if not histories:
+      return pd.DataFrame()
+    batch_history = pd.concat(histories, axis=1, sort=True)  # The union of the tickers' dates, in order like yf.download.
+    if group_by != 'ticker':
+      batch_history = batch_history.swaplevel(axis=1).sort_index(axis=1)
+    return batch_history
+
+  def history(self, ticker, start=None, end=None, auto_adjust=True, actions=True):
+    '''Requests a ticker's chart and returns it as a yfinance shaped dataframe.'''
+    if not hasattr(self._local, 'session'):
+      self._local.session = requests.Session()
+    params = {'interval': '1d', 'events': 'div,splits'}
+    if start is not None:
+      params['period1'] = int(pd.Timestamp(start, tz='America/New_York').timestamp())
+    if end is not None:
+      params['period2'] = int(pd.Timestamp(end, tz='America/New_York').timestamp())
+    response = self._local.session.get(f'{self.base_url}/v8/finance/chart/{ticker}', params=params, timeout=self.timeout)
+    if response.status_code == 404:
+      return pd.DataFrame()
+    response.raise_for_status()
+
+    result = response.json()['chart']['result'][0]
+    quote = result['indicators']['quote'][0]
+    dates = pd.to_datetime(result['timestamp'], unit='s', utc=True).tz_convert(result['meta']['exchangeTimezoneName'])
+    history = pd.DataFrame({'Open': quote['open'], 'High': quote['high'], 'Low': quote['low'],
+                            'Close': quote['close'], 'Volume': quote['volume']},
+                           index=pd.DatetimeIndex(dates.normalize(), name='Date'), dtype=np.float64)
+    if auto_adjust:  # Scale the prices by the adjusted close like yfinance.
+      ratio = np.asarray(result['indicators']['adjclose'][0]['adjclose'], dtype=np.float64) / history['Close'].to_numpy()
+      history[['Open', 'High', 'Low', 'Close']] = history[['Open', 'High', 'Low', 'Close']].mul(ratio, axis=0)
+    else:
+      history['Adj Close'] = result['indicators']['adjclose'][0]['adjclose']
+    if actions:
+      history['Dividends'] = 0.0
+      history['Stock Splits'] = 0.0
+    return history
@@ -0,0 +1,107 @@
+'''Deterministic synthetic data for the benchmarks.
+
+Generates the inputs of every part of the tutorial at any scale without
+downloading anything: SP500 constituents records like Part 1's csv, Yahoo
+Finance style OHLCV historicals with listing dates and missing dates like
+Part 2's downloads, and IEX style rows that backfill those missing dates like
+Part 3B's downloads. The same arguments always generate the same data, and
+each ticker is generated from its own seed so adding tickers does not change
+the existing ones.
+'''
+
+import numpy as np
+import pandas as pd
+
+def generate_tickers(ticker_count):
+  '''Generates ticker_count sorted ticker names.'''
+  return [f'T{i:05d}' for i in range(ticker_count)]
+
+def generate_trading_days(years, end_date='2022-01-14'):
+  '''Generates the business days of the years before end_date.'''
+  end_date = pd.Timestamp(end_date)
+  return pd.bdate_range(end_date - pd.DateOffset(years=years), end_date)
+
+def generate_sp500_changes(tickers, change_dates, entries_per_ticker):
+  '''Generates sp500 changes where each ticker enters and exits the SP500 entries_per_ticker times.'''
+  rows_per_membership = max(1, len(change_dates) // (2 * entries_per_ticker))
+  membership_phase = np.arange(len(tickers)) % (2 * rows_per_membership)  # Stagger tickers so the SP500 size stays even.
+  in_sp500 = ((np.arange(len(change_dates))[:, None] + membership_phase) // rows_per_membership) % 2 == 0
+  tickers = np.asarray(tickers)
+  sp500_changes = pd.DataFrame({'date': change_dates,
+                                'tickers': [list(tickers[row]) for row in in_sp500]})
+  return sp500_changes
+
+def generate_constituents_records(sp500_changes):
+  '''Formats sp500 changes like the Part 1 constituents records csv, with a 'date' index and comma separated tickers.'''
+  records = pd.DataFrame({'tickers': [','.join(tickers) for tickers in sp500_changes['tickers']]},
+                         index=pd.Index(sp500_changes['date'].dt.strftime('%Y-%m-%d'), name='date'))
+  return records
+
+def generate_missing_dates(tickers, trading_days, missing_per_ticker, seed=0):
+  '''Generates a sorted random set of missing trading days for each ticker.'''
+  rng = np.random.default_rng(seed)
+  missing_dates = {ticker: trading_days[np.sort(rng.choice(len(trading_days), missing_per_ticker, replace=False))]
+                   for ticker in tickers}
+  return missing_dates
+
+def generate_historicals(tickers, trading_days, gap_rate=0.002, gap_blocks=1, listed_fraction=0.8, seed=0):
+  '''Generates Yahoo Finance style historicals with listing dates and missing dates.
+
+  Each ticker is a random walk of closes with Open, High, Low and Volume around
+  it on a time zone aware 'America/New_York' index, like yf.Ticker.history.
+  Tickers outside the listed_fraction start trading part of the way through the
+  trading days. Each ticker then misses about gap_rate of its days at random plus
+  gap_blocks runs of up to ten consecutive days.
+
+  Args:
+    tickers: list containing each ticker given as a string.
+    trading_days: datetimeindex of every trading day.
+    gap_rate: float fraction of each ticker's days that are missing at random. Defaults 0.002.
+    gap_blocks: int amount of runs of consecutive missing days per ticker. Defaults 1.
+    listed_fraction: float fraction of tickers that trade on every day. Defaults 0.8.
+    seed: int seed of the generator. Defaults 0.
+
+  Returns:
+    historicals: dict with tickers as keys and OHLCV dataframes as values.
+    missing_dates: dict with tickers as keys and the datetimeindex of their missing days as values.
+  '''
+
+  trading_days = pd.DatetimeIndex(trading_days).tz_localize('America/New_York')
+  day_count = len(trading_days)
+  historicals, missing_dates = dict(), dict()
+
+  for i, ticker in enumerate(tickers):
+    rng = np.random.default_rng([seed, i])
+    first_day = 0 if rng.random() < listed_fraction else int(rng.integers(1, day_count // 2))
+
+    present = np.ones(day_count, dtype=bool)
+    present[:first_day] = False
+    present[first_day + np.flatnonzero(rng.random(day_count - first_day) < gap_rate)] = False
+    for block_start in rng.integers(first_day, day_count, gap_blocks):
+      present[block_start:block_start + int(rng.integers(1, 11))] = False
+
+    close = 20 * np.exp(np.cumsum(rng.normal(0, 0.02, day_count)))
+    spread = np.abs(rng.normal(0, 0.01, day_count)) * close
+    open_ = close * (1 + rng.normal(0, 0.005, day_count))
+    historical = pd.DataFrame({'Open': open_,
+                               'High': np.maximum(open_, close) + spread,
+                               'Low': np.minimum(open_, close) - spread,
+                               'Close': close,
+                               'Volume': rng.integers(10**5, 10**7, day_count).astype(np.float64),
+                               'Dividends': 0.0,
+                               'Stock Splits': 0.0},
+                              index=trading_days.rename('Date'))
+    historicals[ticker] = historical[present]
+    missing_dates[ticker] = trading_days[first_day:][~present[first_day:]].tz_localize(None)
+  return historicals, missing_dates
+
+def generate_backfill_rows(missing_dates, seed=0):
+  '''Generates IEX style [timestamp, Open, High, Low, Close, Volume] rows for each ticker's missing dates.'''
+  backfill_rows = dict()
+  for i, ticker in enumerate(missing_dates):
+    rng = np.random.default_rng([seed, i, 1])
+    timestamps = missing_dates[ticker].values.astype('datetime64[s]').astype(np.float64)
+    prices = 20 * np.exp(rng.normal(0, 0.5, (len(timestamps), 4)))
+    volumes = rng.integers(10**5, 10**7, (len(timestamps), 1))
+    backfill_rows[ticker] = np.column_stack([timestamps, prices, volumes]).tolist()
+  return backfill_rows
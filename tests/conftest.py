@@ -0,0 +1,36 @@
+'''Shared fixtures of the tests.
+
+The tests import the modules from the allmodules folder and the synthetic data
+and fake Yahoo Finance and IEX Cloud server from the benchmarks folder.
+'''
+
+import sys
+from pathlib import Path
+
+import pytest
+
+REPOSITORY = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPOSITORY / 'allmodules'))
+sys.path.insert(0, str(REPOSITORY / 'benchmarks'))
+sys.path.insert(0, str(REPOSITORY / 'Part 3 - Handling Missing YF Historicals'))  # For p3Binputs.
+
+import synthetic
+from fake_market_server import FakeMarketServer
+
+@pytest.fixture(scope='session')
+def trading_days():
+  '''Business days of one year.'''
+  return synthetic.generate_trading_days(1)
+
+@pytest.fixture(scope='session')
+def yf_historicals(trading_days):
+  '''Yahoo Finance style historicals of a few tickers, some listed late and all with missing dates.'''
+  historicals, _ = synthetic.generate_historicals(synthetic.generate_tickers(6), trading_days, gap_rate=0.02,
+                                                  gap_blocks=2, listed_fraction=0.5)
+  return historicals
+
+@pytest.fixture
+def fake_market_server(yf_historicals):
+  '''FakeMarketServer serving the yf_historicals without any faults.'''
+  with FakeMarketServer(yf_historicals) as server:
+    yield server
@@ -0,0 +1,47 @@
+'''Equivalence tests of the vectorized chronological order validator in the Part 3B module.'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import p3Bmodule
+
+def _original_ordinance_errors(historical):
+  '''Returns the positions of the rows that are not after their previous row, checked one row at a time like the original loop.'''
+  positions = []
+  previous_date = None
+  for position, date in enumerate(historical.index):
+    if previous_date is not None and previous_date >= date:
+      positions.append(position)
+    previous_date = date
+  return positions
+
+@pytest.fixture
+def unordered_historicals(yf_historicals):
+  '''Historicals where some tickers have duplicated or swapped dates.'''
+  historicals = dict(yf_historicals)
+  tickers = list(historicals)
+  historical = historicals[tickers[0]]
+  historicals[tickers[0]] = pd.concat([historical.iloc[:10], historical.iloc[9:]])  # A duplicated date.
+  historical = historicals[tickers[2]]
+  historicals[tickers[2]] = historical.iloc[np.r_[0:50, 51, 50, 52:len(historical)]]  # Two swapped dates.
+  historicals['EMPTY'] = historical.iloc[:0]
+  return historicals
+
+@pytest.mark.parametrize('max_workers', [None, 3])
+def test_validator_finds_the_same_rows_as_the_original_loop(unordered_historicals, max_workers):
+  ordinance_report = p3Bmodule.validate_chronological_order(unordered_historicals, max_workers=max_workers)
+  expected = {ticker: _original_ordinance_errors(historical) for ticker, historical in unordered_historicals.items()}
+  expected = {ticker: positions for ticker, positions in expected.items() if positions}
+
+  assert sorted(ordinance_report) == sorted(expected)
+  for ticker, positions in expected.items():
+    np.testing.assert_array_equal(ordinance_report[ticker]['positions'], positions)
+    dates = unordered_historicals[ticker].index.tz_convert('UTC').tz_localize(None)
+    steps = dates[positions] - dates[np.array(positions) - 1]
+    assert ordinance_report[ticker]['duplicates'].equals(dates[positions][steps == pd.Timedelta(0)])
+    assert ordinance_report[ticker]['out_of_order'].equals(dates[positions][steps < pd.Timedelta(0)])
+
+def test_for_ordinance_is_false_only_when_a_ticker_is_out_of_order(yf_historicals, unordered_historicals):
+  assert p3Bmodule.test_for_ordinance(yf_historicals)
+  assert not p3Bmodule.test_for_ordinance(unordered_historicals)
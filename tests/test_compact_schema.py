@@ -0,0 +1,60 @@
+'''Round trip accuracy tests of the compact hdf5 schema in the Part 2 module.
+
+Run from the repository root:
+  python -m pytest tests
+'''
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'allmodules'))
+import p2module
+
+FLOAT32_RELATIVE_ERROR = 2**-24
+
+@pytest.fixture
+def hdf5_historicals():
+  '''Hdf5 formatted historicals with prices from cents to thousands of dollars and volumes up to billions of shares.'''
+  rng = np.random.default_rng(0)
+  hdf5_historicals = dict()
+  for ticker, price in [('PENNY', 0.01), ('MID', 45.0), ('LARGE', 3500.0)]:
+    dates = pd.bdate_range('2007-01-22', '2022-01-19', tz='America/New_York')
+    close = price * np.exp(np.cumsum(rng.normal(0, 0.02, len(dates))))
+    hdf5_historicals[ticker] = pd.DataFrame({'Date': [date.timestamp() for date in dates],
+                                             'Open': close * (1 + rng.normal(0, 0.005, len(dates))),
+                                             'High': close * 1.01,
+                                             'Low': close * 0.99,
+                                             'Close': close,
+                                             'Volume': rng.integers(0, 5 * 10**9, len(dates)).astype(np.float64)})
+  return hdf5_historicals
+
+def test_compact_rows_keep_prices_within_float32_precision(hdf5_historicals):
+  for historical in hdf5_historicals.values():
+    rows = historical.to_numpy(dtype=np.float64)
+    round_trip = p2module._from_compact_rows(p2module._to_compact_rows(historical))
+    relative_error = np.abs(round_trip[:, 1:5] - rows[:, 1:5]) / np.abs(rows[:, 1:5])
+    assert relative_error.max() <= FLOAT32_RELATIVE_ERROR
+
+def test_compact_rows_keep_dates_and_volumes_exactly(hdf5_historicals):
+  for historical in hdf5_historicals.values():
+    compact_rows = p2module._to_compact_rows(historical)
+    assert compact_rows['Volume'].dtype == np.uint64
+    np.testing.assert_array_equal(compact_rows['Volume'], historical['Volume'].to_numpy().astype(np.uint64))
+    np.testing.assert_array_equal(p2module._from_compact_rows(compact_rows)[:, 0], historical['Date'].to_numpy())
+
+def test_compact_schema_survives_saving_and_loading(hdf5_historicals, tmp_path):
+  p2module.save_historicals_to_hdf5(hdf5_historicals, tmp_path, schema='compact')
+  loaded = p2module.load_hdf5_historicals(list(hdf5_historicals), tmp_path)
+  for ticker, historical in hdf5_historicals.items():
+    expected_dates = pd.to_datetime(historical['Date'], unit='s')
+    np.testing.assert_array_equal(loaded[ticker].index.to_numpy(dtype='datetime64[ns]'), expected_dates.to_numpy(dtype='datetime64[ns]'))
+    for column in ['Open', 'High', 'Low', 'Close']:
+      assert loaded[ticker][column].dtype == np.float32
+      relative_error = np.abs(loaded[ticker][column].to_numpy(dtype=np.float64) / historical[column].to_numpy() - 1)
+      assert relative_error.max() <= FLOAT32_RELATIVE_ERROR
+    assert loaded[ticker]['Volume'].dtype == np.uint64
+    np.testing.assert_array_equal(loaded[ticker]['Volume'].to_numpy(), historical['Volume'].to_numpy().astype(np.uint64))
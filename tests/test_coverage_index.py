@@ -0,0 +1,56 @@
+'''Tests of the missing dates queries of the coverage index in the Part 2 module.'''
+
+import pandas as pd
+import pytest
+
+import p2module
+
+def _naive_dates(historical):
+  '''Returns a historical's dates as naive midnight dates like the coverage index reports them.'''
+  return historical.index.tz_localize(None).normalize()
+
+def _expected_missing_dates(historicals, tickers, start=None, end=None):
+  '''Returns the master calendar dates between start and end that each ticker has no data for.'''
+  calendar = pd.DatetimeIndex(sorted(set().union(*[_naive_dates(historical) for historical in historicals.values()])), name='Date')
+  if start is not None:
+    calendar = calendar[calendar >= pd.Timestamp(start)]
+  if end is not None:
+    calendar = calendar[calendar <= pd.Timestamp(end)]
+  return {ticker: calendar.difference(_naive_dates(historicals[ticker])) if ticker in historicals else calendar
+          for ticker in tickers}
+
+@pytest.fixture
+def coverage_filepath(yf_historicals, tmp_path):
+  '''Folder with the coverage index of the yf_historicals.'''
+  p2module.update_coverage_index(yf_historicals, tmp_path)
+  return tmp_path
+
+@pytest.mark.parametrize('start, end', [(None, None), ('2021-03-01', '2021-09-30'), ('2000-01-01', '2030-01-01')])
+def test_missing_dates_are_the_calendar_dates_without_data(yf_historicals, coverage_filepath, start, end):
+  tickers = list(yf_historicals)
+  missing_tickers_and_dates = p2module.query_missing_dates(coverage_filepath, start=start, end=end)
+  expected = _expected_missing_dates(yf_historicals, tickers, start, end)
+  assert list(missing_tickers_and_dates) == tickers
+  for ticker in tickers:
+    assert missing_tickers_and_dates[ticker].equals(expected[ticker])
+
+def test_dates_before_the_first_and_after_the_last_saved_date_are_missing(yf_historicals, trading_days, tmp_path):
+  historicals = {'FULL': yf_historicals['T00000'],
+                 'LATE': yf_historicals['T00000'].iloc[50:],
+                 'EARLY': yf_historicals['T00000'].iloc[:-50]}
+  p2module.update_coverage_index(historicals, tmp_path)
+  missing_tickers_and_dates = p2module.query_missing_dates(tmp_path)
+  calendar = _naive_dates(historicals['FULL'])
+  assert len(missing_tickers_and_dates['FULL']) == 0
+  assert missing_tickers_and_dates['LATE'].equals(calendar[:50])
+  assert missing_tickers_and_dates['EARLY'].equals(calendar[-50:])
+  assert p2module.collect_tickers_with_missing_dates(tmp_path) == ['LATE', 'EARLY']
+
+def test_tickers_without_saved_dates_miss_the_whole_calendar(yf_historicals, coverage_filepath):
+  p2module.update_coverage_index({'EMPTY': yf_historicals['T00000'].iloc[:0]}, coverage_filepath)
+  start, end = '2021-06-01', '2021-06-30'
+  missing_tickers_and_dates = p2module.query_missing_dates(coverage_filepath, ['EMPTY', 'NEVER_SAVED'], start, end)
+  expected = _expected_missing_dates(yf_historicals, ['EMPTY'], start, end)['EMPTY']
+  assert len(expected)
+  assert missing_tickers_and_dates['EMPTY'].equals(expected)
+  assert missing_tickers_and_dates['NEVER_SAVED'].equals(expected)
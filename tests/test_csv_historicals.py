@@ -0,0 +1,33 @@
+'''Tests of saving and loading csv historicals with both engines of the Part 2 module.'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import p2module
+
+ENGINES = ['pandas', 'pyarrow']
+
+@pytest.fixture
+def csv_historicals(yf_historicals):
+  '''Csv formatted historicals with whole share int64 volumes like yfinance returns.'''
+  historicals = {ticker: historical.astype({'Volume': np.int64}) for ticker, historical in list(yf_historicals.items())[:3]}
+  return p2module.format_historicals_to_save_as_csv(historicals)
+
+@pytest.mark.parametrize('save_engine', ENGINES)
+@pytest.mark.parametrize('load_engine', ENGINES)
+def test_engines_load_what_the_original_read_csv_loaded(csv_historicals, tmp_path, save_engine, load_engine):
+  pytest.importorskip('pyarrow')
+  p2module.save_historicals_to_csv(csv_historicals, tmp_path, engine=save_engine)
+  loaded = p2module.load_csv_historicals(list(csv_historicals), tmp_path, engine=load_engine)
+  for ticker in csv_historicals:
+    expected = pd.read_csv(tmp_path / f'{ticker}.csv', index_col='Date')  # The loader before the engines were added.
+    assert loaded[ticker]['Volume'].dtype == np.int64
+    pd.testing.assert_frame_equal(loaded[ticker], expected, check_exact=False, rtol=1e-15)
+
+def test_c_is_accepted_for_the_pandas_engine(csv_historicals, tmp_path):
+  p2module.save_historicals_to_csv(csv_historicals, tmp_path, engine='c')
+  loaded = p2module.load_csv_historicals(list(csv_historicals), tmp_path, engine='c')
+  expected = p2module.load_csv_historicals(list(csv_historicals), tmp_path, engine='pandas')
+  for ticker in csv_historicals:
+    pd.testing.assert_frame_equal(loaded[ticker], expected[ticker])
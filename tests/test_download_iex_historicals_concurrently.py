@@ -0,0 +1,41 @@
+'''Tests of the concurrent IEX Cloud downloader in the Part 3B module against the fake market server.'''
+
+import p3Bmodule
+from fake_market_server import FakeMarketServer
+
+def _fake_batch_urls(server, tickers, partition_size=2):
+  '''Returns the IEX batch urls of the tickers pointed at the fake server.'''
+  batch_urls, _ = p3Bmodule.generate_iex_historical_batch_urls(tickers, 'max', partition_size, IEX_TOKEN='fake')
+  return [server.iex_batch_url(batch_url) for batch_url in batch_urls]
+
+def test_concurrent_download_matches_the_sequential_download(yf_historicals):
+  with FakeMarketServer(yf_historicals, partial_rate=0.05) as server:
+    batch_urls = _fake_batch_urls(server, list(yf_historicals) + ['UNKNOWN'])
+    expected_historicals, expected_key_error_log = p3Bmodule.download_iex_historicals(batch_urls)
+    historicals, key_error_log, failed_batch_urls = p3Bmodule.download_iex_historicals_concurrently(batch_urls,
+                                                                                                     max_in_flight=3)
+
+  assert historicals == expected_historicals
+  assert list(historicals) == list(expected_historicals)  # Parsed in batch url order.
+  assert [log[:2] for log in key_error_log] == [log[:2] for log in expected_key_error_log]
+  assert key_error_log
+  assert failed_batch_urls == []
+
+def test_failed_batches_are_logged_and_resumed_from_checkpoints(yf_historicals, tmp_path):
+  tickers = list(yf_historicals)
+
+  with FakeMarketServer(yf_historicals, error_rate=0.5, seed=3) as server:
+    batch_urls = _fake_batch_urls(server, tickers)
+    first_historicals, _, failed_batch_urls = p3Bmodule.download_iex_historicals_concurrently(
+      batch_urls, checkpoint_filepath=tmp_path, max_retries=0, backoff=0.01)
+    server.error_rate = 0.0
+    server.reset_stats()
+    historicals, _, retried_failed_batch_urls = p3Bmodule.download_iex_historicals_concurrently(
+      batch_urls, checkpoint_filepath=tmp_path, max_retries=0, backoff=0.01)
+    requests_made = server.stats()['requests']
+
+  assert 0 < len(failed_batch_urls) < len(batch_urls)
+  assert len(first_historicals) == 2 * (len(batch_urls) - len(failed_batch_urls))
+  assert requests_made == len(failed_batch_urls)  # Finished batches are loaded from their checkpoints.
+  assert retried_failed_batch_urls == []
+  assert sorted(historicals) == sorted(tickers)
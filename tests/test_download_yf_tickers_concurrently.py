@@ -0,0 +1,48 @@
+'''Tests of the concurrent Yahoo Finance downloader in the Part 2 module against the fake market server.'''
+
+import pandas as pd
+import pytest
+
+import p2module
+from fake_market_server import FakeMarketServer, FakeYahooBackend
+
+def _date_range(trading_days):
+  '''Returns the start and end dates that download every trading day.'''
+  return trading_days[0].strftime('%Y-%m-%d'), (trading_days[-1] + trading_days.freq).strftime('%Y-%m-%d')
+
+def _assert_served_historicals(historicals, yf_historicals):
+  '''Checks the downloaded historicals have the served dates and OHLCV values.'''
+  assert sorted(historicals) == sorted(yf_historicals)
+  for ticker, historical in historicals.items():
+    expected = yf_historicals[ticker]
+    assert historical.index.equals(expected.index)
+    pd.testing.assert_frame_equal(historical[['Open', 'High', 'Low', 'Close', 'Volume']],
+                                  expected[['Open', 'High', 'Low', 'Close', 'Volume']],
+                                  check_freq=False, check_names=False, check_index_type=False)
+
+@pytest.mark.parametrize('bulk_size', [None, 4])
+def test_download_returns_the_served_historicals(bulk_size, fake_market_server, yf_historicals, trading_days):
+  tickers = list(yf_historicals) + ['UNKNOWN']
+  start_date, end_date = _date_range(trading_days)
+
+  historicals, avaliable, not_avaliable = p2module.download_yf_tickers_concurrently(
+    tickers, start_date, end_date, max_workers=4, requests_per_second=None, bulk_size=bulk_size,
+    yf_backend=FakeYahooBackend(fake_market_server.url))
+
+  _assert_served_historicals(historicals, yf_historicals)
+  assert avaliable == list(yf_historicals)  # Kept in the requested order.
+  assert not_avaliable == ['UNKNOWN']
+
+def test_download_retries_server_errors(yf_historicals, trading_days):
+  start_date, end_date = _date_range(trading_days)
+
+  with FakeMarketServer(yf_historicals, error_rate=0.3, seed=1) as server:
+    historicals, avaliable, not_avaliable = p2module.download_yf_tickers_concurrently(
+      list(yf_historicals), start_date, end_date, max_workers=4, requests_per_second=None, max_retries=10,
+      backoff=0.01, yf_backend=FakeYahooBackend(server.url))
+    statuses = server.stats()['statuses']
+
+  assert statuses.get(500, 0) + statuses.get(503, 0) > 0
+  _assert_served_historicals(historicals, yf_historicals)
+  assert avaliable == list(yf_historicals)
+  assert not_avaliable == []
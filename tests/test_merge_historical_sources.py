@@ -0,0 +1,76 @@
+'''Equivalence tests of merging historical sources in the Part 3B module.'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import p3Bmodule
+import synthetic
+
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+def _iex_rows_to_dataframe(rows):
+  '''Returns IEX style [timestamp, Open, High, Low, Close, Volume] rows as a dataframe on a naive UTC index.'''
+  rows = np.asarray(rows, dtype=np.float64).reshape(-1, 6)
+  dates = pd.DatetimeIndex((rows[:, 0] * 10**9).round().astype('datetime64[ns]'), name='Date')
+  return pd.DataFrame(rows[:, 1:], index=dates, columns=COLUMNS)
+
+def _reference_merge(sources):
+  '''Merges the sources like the original merge_historicals: concatenated in priority order and grouped by date with first().
+
+  Rows without any values are dropped, since merge_historical_sources never returns them,
+  and the dates are converted to the time zone and resolution of the highest priority dates.
+  '''
+  merged_historicals = dict()
+  for ticker in dict.fromkeys(ticker for historicals in sources.values() for ticker in historicals):
+    ticker_historicals = [historicals[ticker] if isinstance(historicals[ticker], pd.DataFrame)
+                          else _iex_rows_to_dataframe(historicals[ticker])
+                          for historicals in sources.values() if ticker in historicals]
+    first_dates = ticker_historicals[0].index
+    if first_dates.tz is not None:
+      ticker_historicals = [historical.tz_localize('UTC').tz_convert(first_dates.tz) if historical.index.tz is None
+                            else historical for historical in ticker_historicals]
+    concated = pd.concat([historical.reindex(columns=COLUMNS).astype(np.float64) for historical in ticker_historicals])
+    merged = concated.groupby(concated.index).first().sort_index().dropna(how='all')
+    merged.index = merged.index.as_unit(first_dates.unit)
+    merged_historicals[ticker] = merged
+  return merged_historicals
+
+@pytest.fixture
+def sources(yf_historicals, trading_days):
+  '''Yahoo Finance historicals with partly and fully NaN rows and IEX rows that overlap and backfill them.'''
+  rng = np.random.default_rng(1)
+  yf = dict()
+  for ticker, historical in yf_historicals.items():
+    historical = historical[COLUMNS].copy()
+    partly_nan = rng.random(historical.shape) < 0.05
+    historical = historical.mask(partly_nan)
+    historical.iloc[rng.integers(0, len(historical), 3)] = np.nan  # Rows with no values at all.
+    yf[ticker] = historical
+
+  tickers = list(yf_historicals)
+  iex_dates = {ticker: trading_days[rng.random(len(trading_days)) < 0.3] for ticker in tickers[1:]}  # The first ticker is only on yf.
+  iex = synthetic.generate_backfill_rows(iex_dates)
+  iex['IEX_ONLY'] = synthetic.generate_backfill_rows({'IEX_ONLY': trading_days[:20]})['IEX_ONLY']
+  return {'yf': yf, 'iex': iex}
+
+def test_merge_historicals_fills_each_column_like_a_group_by_first(sources):
+  merged_historicals = p3Bmodule.merge_historicals(sources['yf'], sources['iex'])
+  expected = _reference_merge(sources)
+  assert list(merged_historicals) == list(expected)
+  for ticker in expected:
+    pd.testing.assert_frame_equal(merged_historicals[ticker], expected[ticker], check_freq=False)
+
+def test_partly_nan_rows_are_filled_from_the_lower_priority_source(trading_days):
+  dates = trading_days[:3].tz_localize('America/New_York').rename('Date')
+  yf = pd.DataFrame({'Open': [1.0, np.nan, 3.0], 'High': 1.0, 'Low': 1.0, 'Close': [1.0, 2.0, np.nan], 'Volume': 10.0},
+                    index=dates)
+  iex = [[date.timestamp(), 9.0, 9.0, 9.0, 9.0, 90.0] for date in dates[1:]]
+
+  merged = p3Bmodule.merge_historical_sources({'yf': {'A': yf}, 'iex': {'A': iex}}, record_source=True)['A']
+
+  assert merged['Open'].tolist() == [1.0, 9.0, 3.0]
+  assert merged['Close'].tolist() == [1.0, 2.0, 9.0]
+  assert merged['Volume'].tolist() == [10.0, 10.0, 10.0]
+  assert merged['Source'].tolist() == ['yf', 'yf', 'yf']
+  assert str(merged.index.tz) == 'America/New_York'
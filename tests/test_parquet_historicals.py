@@ -0,0 +1,47 @@
+'''Tests of saving subsets of tickers to the parquet dataset in the Part 2 module.'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import p2module
+
+pytest.importorskip('pyarrow')
+
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+def _assert_loaded_like(loaded, historical):
+  '''Asserts that a loaded parquet ticker has the historical's dates and values.'''
+  np.testing.assert_array_equal(loaded.index.to_numpy(dtype='datetime64[ns]'),
+                                historical.index.tz_convert('UTC').tz_localize(None).to_numpy(dtype='datetime64[ns]'))
+  np.testing.assert_array_equal(loaded[COLUMNS].to_numpy(), historical[COLUMNS].to_numpy())
+
+@pytest.fixture
+def two_year_historicals(yf_historicals):
+  '''The yf_historicals of the first tickers, which span two calendar years.'''
+  historicals = {ticker: yf_historicals[ticker] for ticker in list(yf_historicals)[:4]}
+  assert all(historical.index.year.nunique() == 2 for historical in historicals.values())
+  return historicals
+
+def test_saving_a_subset_of_tickers_keeps_the_other_tickers(two_year_historicals, tmp_path):
+  p2module.save_historicals_to_parquet(two_year_historicals, tmp_path)
+  first_ticker, *other_tickers = two_year_historicals
+  updated = two_year_historicals[first_ticker].iloc[-30:] * 2  # Only the last year, with new values.
+  p2module.save_historicals_to_parquet({first_ticker: updated}, tmp_path)
+
+  loaded = p2module.load_parquet_historicals(None, tmp_path)
+  assert sorted(loaded) == sorted(two_year_historicals)
+  _assert_loaded_like(loaded[first_ticker], updated)  # Its rows of the first year are gone too.
+  for ticker in other_tickers:
+    _assert_loaded_like(loaded[ticker], two_year_historicals[ticker])
+  coverage_report = p2module.query_coverage_report(tmp_path, list(two_year_historicals))
+  assert coverage_report['yf_days'].tolist() == [len(updated)] + [len(two_year_historicals[ticker]) for ticker in other_tickers]
+
+def test_year_folders_left_without_rows_are_deleted(two_year_historicals, tmp_path):
+  first_ticker = next(iter(two_year_historicals))
+  historical = two_year_historicals[first_ticker]
+  p2module.save_historicals_to_parquet({first_ticker: historical}, tmp_path)
+  p2module.save_historicals_to_parquet({first_ticker: historical[historical.index.year == historical.index.year[-1]]}, tmp_path)
+
+  year_folders = sorted(path.name for path in (tmp_path / 'historicals_parquet').iterdir())
+  assert year_folders == [f'Year={historical.index.year[-1]}']
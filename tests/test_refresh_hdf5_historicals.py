@@ -0,0 +1,70 @@
+'''Tests of refreshing saved hdf5 historicals with only their new dates in the Part 2 module.'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import p2module
+
+class HistoryBackend:
+  '''yfinance stand-in whose Ticker(ticker).history returns slices of fixed historicals.'''
+
+  def __init__(self, historicals):
+    self.historicals = historicals
+
+  def Ticker(self, ticker):
+    historical = self.historicals.get(ticker)
+
+    class Ticker:
+      def history(self, start=None, end=None, **kwargs):
+        if historical is None:
+          return pd.DataFrame()
+        dates = historical.index.tz_localize(None)
+        return historical[(dates >= pd.Timestamp(start)) & (dates < pd.Timestamp(end))]
+
+    return Ticker()
+
+def _readjust_for_dividend(historical, dividend_date, dividend):
+  '''Returns the historical as Yahoo Finance gives it after a dividend: earlier prices scaled down and the dividend recorded.'''
+  readjusted = historical.copy()
+  before = readjusted.index.tz_localize(None) < pd.Timestamp(dividend_date)
+  factor = 1 - dividend / readjusted.loc[before, 'Close'].iloc[-1]
+  readjusted.loc[before, ['Open', 'High', 'Low', 'Close']] *= factor
+  readjusted.loc[readjusted.index.tz_localize(None) == pd.Timestamp(dividend_date), 'Dividends'] = dividend
+  return readjusted
+
+@pytest.fixture
+def refresh_setup(yf_historicals, trading_days, tmp_path):
+  '''Saves the first part of two tickers' histories and returns the full histories after a dividend of one of them.'''
+  saved_until, dividend_date = trading_days[200], trading_days[220]
+  full_historicals = {'STEADY': yf_historicals['T00000'],
+                      'PAYER': _readjust_for_dividend(yf_historicals['T00001'], dividend_date, 0.5)}
+  saved_historicals = {ticker: yf_historicals[ticker_source][yf_historicals[ticker_source].index.tz_localize(None) < saved_until]
+                       for ticker, ticker_source in [('STEADY', 'T00000'), ('PAYER', 'T00001')]}
+  p2module.save_historicals_to_hdf5(p2module.format_historicals_to_save_as_hdf5(saved_historicals), tmp_path,
+                                    compression='lzf', schema='compact')
+  return full_historicals, saved_historicals
+
+def test_refresh_appends_tails_and_rewrites_tickers_with_a_dividend(refresh_setup, trading_days, tmp_path):
+  full_historicals, saved_historicals = refresh_setup
+  start_date = trading_days[0].strftime('%Y-%m-%d')
+  end_date = (trading_days[-1] + trading_days.freq).strftime('%Y-%m-%d')
+
+  rows_appended, not_avaliable = p2module.refresh_hdf5_historicals(
+    ['STEADY', 'PAYER'], tmp_path, end_date=end_date, default_start_date=start_date,
+    requests_per_second=None, yf_backend=HistoryBackend(full_historicals))
+
+  assert not_avaliable == []
+  loaded = p2module.load_hdf5_historicals(['STEADY', 'PAYER'], tmp_path)
+  for ticker in ['STEADY', 'PAYER']:
+    expected = full_historicals[ticker]
+    assert rows_appended[ticker] == len(expected) - len(saved_historicals[ticker])
+    assert len(loaded[ticker]) == len(expected)
+    np.testing.assert_allclose(loaded[ticker]['Close'].to_numpy(dtype=np.float64), expected['Close'].to_numpy(), rtol=2**-24)
+    assert loaded[ticker]['Close'].dtype == np.float32  # The rewritten file keeps its compact schema.
+
+  # The stored rows before the dividend were readjusted, not only the appended ones.
+  readjusted = loaded['PAYER']['Close'].to_numpy(dtype=np.float64)[:len(saved_historicals['PAYER'])]
+  assert (readjusted < saved_historicals['PAYER']['Close'].to_numpy() * (1 - 2**-20)).all()
+  coverage_report = p2module.query_coverage_report(tmp_path, ['STEADY', 'PAYER'])
+  assert coverage_report['yf_days'].tolist() == [len(full_historicals['STEADY']), len(full_historicals['PAYER'])]
@@ -0,0 +1,69 @@
+'''Equivalence tests of filtering dates by SP500 membership in the Part 3A module.'''
+
+import pandas as pd
+import pytest
+
+import p3Amodule
+import synthetic
+
+def _original_filter_out_the_dates_not_in_sp500(tickers_and_dates, sp500_changes):
+  '''The filter before membership intervals: a list-scan mask and a loc slice per date range of every ticker.'''
+  tickers_and_dates_in_sp500 = dict()
+  for ticker, dates in tickers_and_dates.items():
+    mask = [ticker in current_sp500_tickers for current_sp500_tickers in sp500_changes['tickers'].values]
+    date_ranges_in_sp500 = []
+    prev_mask = False
+    for date_mask in sp500_changes['date'].where(mask, False):
+      if date_mask:
+        if prev_mask == False:
+          start_date = date_mask
+        end_date = date_mask
+      elif prev_mask:
+        date_ranges_in_sp500.append([start_date, end_date])
+      prev_mask = date_mask
+    if prev_mask:
+      date_ranges_in_sp500.append([start_date, end_date])
+
+    dates = dates.to_series().rename()
+    ticker_sp500_dates = None
+    for date_range in date_ranges_in_sp500:
+      if ticker_sp500_dates is None:
+        ticker_sp500_dates = dates.loc[date_range[0]:date_range[1]]
+      else:
+        ticker_sp500_dates = pd.concat([ticker_sp500_dates, dates.loc[date_range[0]:date_range[1]]])
+    tickers_and_dates_in_sp500[ticker] = ticker_sp500_dates
+  return tickers_and_dates_in_sp500
+
+@pytest.fixture
+def membership_inputs(trading_days):
+  '''Missing dates and SP500 changes where tickers enter and exit several times, plus tickers always and never in the SP500.'''
+  tickers = synthetic.generate_tickers(12)
+  change_dates = trading_days[::7]
+  sp500_changes = synthetic.generate_sp500_changes(tickers, change_dates, entries_per_ticker=3)
+  sp500_changes['tickers'] = [row_tickers + ['ALWAYS'] for row_tickers in sp500_changes['tickers']]
+  tickers_and_dates = synthetic.generate_missing_dates(tickers + ['ALWAYS', 'NEVER'], trading_days, missing_per_ticker=40)
+  tickers_and_dates['NO_DATES'] = trading_days[:0]
+  sp500_changes['tickers'] = [row_tickers + ['NO_DATES'] for row_tickers in sp500_changes['tickers']]
+  return tickers_and_dates, sp500_changes
+
+def test_filter_matches_the_original_list_scan(membership_inputs):
+  tickers_and_dates, sp500_changes = membership_inputs
+  filtered = p3Amodule.filter_out_the_dates_not_in_sp500(tickers_and_dates, sp500_changes)
+  expected = _original_filter_out_the_dates_not_in_sp500(tickers_and_dates, sp500_changes)
+
+  assert list(filtered) == list(expected)
+  assert filtered['NEVER'] is None and expected['NEVER'] is None
+  for ticker in expected:
+    if expected[ticker] is not None:
+      pd.testing.assert_series_equal(filtered[ticker], expected[ticker])
+
+def test_prebuilt_membership_intervals_give_the_same_result(membership_inputs):
+  tickers_and_dates, sp500_changes = membership_inputs
+  membership_intervals = p3Amodule.build_sp500_membership_intervals(sp500_changes)
+  filtered = p3Amodule.filter_out_the_dates_not_in_sp500(tickers_and_dates, sp500_changes, membership_intervals)
+  expected = p3Amodule.filter_out_the_dates_not_in_sp500(tickers_and_dates, sp500_changes)
+  for ticker in expected:
+    if expected[ticker] is None:
+      assert filtered[ticker] is None
+    else:
+      pd.testing.assert_series_equal(filtered[ticker], expected[ticker])
@@ -0,0 +1,65 @@
+'''Tests of streaming Yahoo Finance downloads into hdf5 files in the Part 2 module.'''
+
+import threading
+
+import pytest
+
+import p2module
+from fake_market_server import FakeYahooBackend
+
+def _date_range(trading_days):
+  '''Returns the start and end dates that download every trading day.'''
+  return trading_days[0].strftime('%Y-%m-%d'), (trading_days[-1] + trading_days.freq).strftime('%Y-%m-%d')
+
+def _stream_in_thread(*args, **kwargs):
+  '''Runs stream_yf_tickers_to_hdf5 in a thread and returns its result or error, failing if it never finishes.'''
+  outcome = dict()
+
+  def stream():
+    try:
+      outcome['result'] = p2module.stream_yf_tickers_to_hdf5(*args, **kwargs)
+    except Exception as e:
+      outcome['error'] = e
+
+  thread = threading.Thread(target=stream, daemon=True)
+  thread.start()
+  thread.join(timeout=60)
+  assert not thread.is_alive(), 'stream_yf_tickers_to_hdf5 deadlocked'
+  return outcome
+
+def test_stream_saves_the_same_files_as_downloading_then_saving(fake_market_server, yf_historicals, trading_days, tmp_path):
+  tickers = list(yf_historicals) + ['UNKNOWN']
+  start_date, end_date = _date_range(trading_days)
+  backend = FakeYahooBackend(fake_market_server.url)
+  (tmp_path / 'streamed').mkdir()
+  (tmp_path / 'saved').mkdir()
+
+  outcome = _stream_in_thread(tickers, tmp_path / 'streamed', start_date, end_date, coverage_batch_size=2,
+                              max_workers=4, requests_per_second=None, yf_backend=backend)
+  historicals, avaliable, not_avaliable = p2module.download_yf_tickers_concurrently(
+    tickers, start_date, end_date, max_workers=4, requests_per_second=None, yf_backend=backend)
+  p2module.save_historicals_to_hdf5(p2module.format_historicals_to_save_as_hdf5(historicals), tmp_path / 'saved')
+
+  assert outcome['result'] == (avaliable, not_avaliable)
+  streamed = p2module.load_hdf5_historicals(avaliable, tmp_path / 'streamed')
+  saved = p2module.load_hdf5_historicals(avaliable, tmp_path / 'saved')
+  for ticker in avaliable:
+    assert streamed[ticker].equals(saved[ticker])
+  streamed_missing_dates = p2module.query_missing_dates(tmp_path / 'streamed', avaliable)
+  saved_missing_dates = p2module.query_missing_dates(tmp_path / 'saved', avaliable)
+  for ticker in avaliable:
+    assert streamed_missing_dates[ticker].equals(saved_missing_dates[ticker])
+
+@pytest.mark.parametrize('failing_function', ['_create_historicals_dataset', 'update_coverage_index'])
+def test_stream_raises_writer_errors_without_deadlocking(failing_function, fake_market_server, yf_historicals,
+                                                         trading_days, tmp_path, monkeypatch):
+  def fail(*args, **kwargs):
+    raise OSError('disk full')
+  monkeypatch.setattr(p2module, failing_function, fail)
+
+  start_date, end_date = _date_range(trading_days)
+  outcome = _stream_in_thread(list(yf_historicals), tmp_path, start_date, end_date, queue_size=1,
+                              coverage_batch_size=len(yf_historicals) + 1, max_workers=2,
+                              requests_per_second=None, yf_backend=FakeYahooBackend(fake_market_server.url))
+
+  assert isinstance(outcome.get('error'), OSError)
@@ -0,0 +1,58 @@
+'''Equivalence tests of the universe wide gap computations in the Part 3A and 3B modules.'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import p3Amodule
+import p3Bmodule
+import synthetic
+
+@pytest.fixture
+def gap_inputs(yf_historicals, trading_days):
+  '''Yahoo Finance historicals with gaps, the full date range and IEX rows that backfill some of the missing dates.'''
+  historicals = {ticker: historical.tz_localize(None) for ticker, historical in yf_historicals.items()}
+  full_date_range = pd.DatetimeIndex(trading_days, name='Date')
+  rng = np.random.default_rng(2)
+  yf_missing_tickers_and_dates = {ticker: full_date_range.difference(historicals[ticker].index) for ticker in historicals}
+  backfilled_dates = {ticker: missing_dates[rng.random(len(missing_dates)) < 0.5]
+                      for ticker, missing_dates in yf_missing_tickers_and_dates.items()}
+  backfilled_dates['EXTRA'] = full_date_range[:5]
+  return historicals, full_date_range, yf_missing_tickers_and_dates, synthetic.generate_backfill_rows(backfilled_dates)
+
+def test_compile_missing_dates_matches_the_sorted_difference(gap_inputs):
+  historicals, full_date_range, _, _ = gap_inputs
+  tickers = list(historicals)
+  missing_tickers_and_dates = p3Amodule.compile_tickers_and_missing_dates(historicals, tickers, full_date_range)
+  assert list(missing_tickers_and_dates) == tickers
+  for ticker in tickers:
+    expected = full_date_range.difference(historicals[ticker].index)  # The computation before the universe wide bitmap.
+    assert missing_tickers_and_dates[ticker].equals(expected)
+    assert len(missing_tickers_and_dates[ticker])
+
+def test_universe_gaps_apply_backfill_removes_the_backfilled_dates(gap_inputs):
+  historicals, full_date_range, yf_missing_tickers_and_dates, backfill_rows = gap_inputs
+  tickers = list(historicals) + ['NOT_DOWNLOADED']
+  universe_gaps = p3Amodule.compute_universe_gaps(historicals, full_date_range, tickers)
+  remaining = universe_gaps.apply_backfill(backfill_rows).to_dict()
+
+  assert universe_gaps.to_dict()['NOT_DOWNLOADED'].equals(full_date_range)
+  for ticker in historicals:
+    backfilled = pd.to_datetime([row[0] for row in backfill_rows[ticker]], unit='s')
+    assert remaining[ticker].equals(yf_missing_tickers_and_dates[ticker].difference(backfilled))
+
+def test_data_still_missing_matches_the_per_ticker_setdiff(gap_inputs):
+  _, _, yf_missing_tickers_and_dates, backfill_rows = gap_inputs
+  iex_historicals = {ticker: backfill_rows[ticker] for ticker in yf_missing_tickers_and_dates}
+  iex_historicals['NO_ROWS'] = []
+  missing_timestamps = {ticker: (missing_dates.values.astype('datetime64[s]').astype(np.float64)).tolist()
+                        for ticker, missing_dates in yf_missing_tickers_and_dates.items()}
+  missing_timestamps['NO_ROWS'] = missing_timestamps[next(iter(missing_timestamps))]
+
+  data_still_missing = p3Bmodule.collect_data_that_is_still_missing(iex_historicals, missing_timestamps)
+
+  assert list(data_still_missing) == list(iex_historicals)
+  for ticker, rows in iex_historicals.items():
+    # The original np.setdiff1d per ticker, comparing against the timestamp column of the rows.
+    found_timestamps = np.asarray(rows, dtype=np.float64).reshape(-1, 6)[:, 0]
+    np.testing.assert_array_equal(data_still_missing[ticker], np.setdiff1d(missing_timestamps[ticker], found_timestamps))